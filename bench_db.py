@@ -0,0 +1,86 @@
+"""
+Per-call latency of db_utils hot-path functions:
+connect-per-call (previous implementation) vs pooled thread-local connections.
+
+Usage: python bench_db.py [iterations]
+Runs against a temporary database, never touches server.db.
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import statistics
+
+import db_utils
+
+def naive_log_event(ip, event_type, details):
+    conn = sqlite3.connect(db_utils.DB_PATH)
+    c = conn.cursor()
+    c.execute("INSERT INTO logs (timestamp, ip, event_type, details) VALUES (?, ?, ?, ?)",
+              (time.time(), ip, event_type, details))
+    conn.commit()
+    conn.close()
+
+def naive_is_ip_blocked(ip):
+    conn = sqlite3.connect(db_utils.DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM blocked_ips WHERE ip = ?", (ip,))
+    result = c.fetchone()
+    conn.close()
+    return result is not None
+
+def naive_verify_user(username, password):
+    conn = sqlite3.connect(db_utils.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
+    row = c.fetchone()
+    conn.close()
+    if row:
+        conn = sqlite3.connect(db_utils.DB_PATH)
+        conn.execute("UPDATE users SET last_login = ? WHERE id = ?", (time.time(), row['id']))
+        conn.commit()
+        conn.close()
+        return dict(row)
+    return None
+
+def measure(fn, args, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - t0) * 1e6)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1]
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    tmp = tempfile.mkdtemp(prefix="dbbench_")
+    db_utils.DB_PATH = os.path.join(tmp, "server.db")
+    db_utils.init_db()
+    db_utils.block_ip("10.0.0.1", "bench")
+
+    cases = [
+        ("log_event", naive_log_event, db_utils.log_event, ("127.0.0.1", "BENCH", "x")),
+        ("is_ip_blocked", naive_is_ip_blocked, db_utils.is_ip_blocked, ("127.0.0.1",)),
+        ("verify_user", naive_verify_user, db_utils.verify_user, ("user", "0713")),
+    ]
+
+    print(f"{n} calls each, microseconds (mean / p50 / p99)")
+    print(f"{'function':<22}{'connect-per-call':>28}{'pooled':>28}{'speedup':>10}")
+    for name, old, new, args in cases:
+        # Warm up both paths (page cache, statement cache)
+        measure(old, args, 50)
+        measure(new, args, 50)
+        o = measure(old, args, n)
+        p = measure(new, args, n)
+        print(f"{name:<22}{o[0]:>10.1f} /{o[1]:>7.1f} /{o[2]:>7.1f}"
+              f"{p[0]:>10.1f} /{p[1]:>7.1f} /{p[2]:>7.1f}{o[0] / p[0]:>9.1f}x")
+
+    db_utils.close_db()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
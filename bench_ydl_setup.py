@@ -0,0 +1,88 @@
+"""
+Per-job yt-dlp setup time: building options and a fresh YoutubeDL for every call
+(cookie / ffmpeg discovery, cachedir=False) vs option templates + pooled instances.
+
+Usage: python bench_ydl_setup.py [iterations] [--url URL]
+  --url also times a metadata extraction of URL per call (network): cold = new
+        YoutubeDL without a cache dir, warm = pooled YoutubeDL + persistent cache dir.
+Uses a synthetic cookies.txt and a temporary cache directory.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import statistics
+
+import yt_dlp
+from ydl_pool import YoutubeDLPool, prepare_cache_dir
+
+def write_cookie_file(path, count=40):
+    with open(path, 'w') as f:
+        f.write("# Netscape HTTP Cookie File\n")
+        for i in range(count):
+            f.write(f".youtube.com\tTRUE\t/\tTRUE\t{int(time.time()) + 86400}\tCOOKIE_{i}\t{'x' * 60}\n")
+
+def old_setup(exec_dir, url=None):
+    """What run_download / the endpoints did per call before templates and pooling"""
+    opts = {'quiet': True, 'no_warnings': True, 'cachedir': False, 'nocheckcertificate': True}
+    cookies_path = os.path.join(exec_dir, 'cookies.txt')
+    if os.path.exists(cookies_path):
+        opts['cookiefile'] = cookies_path
+    for path in (os.path.join(exec_dir, 'ffmpeg.exe'), os.path.join(exec_dir, 'bin', 'ffmpeg.exe'),
+                 os.path.join(exec_dir, 'release', 'ffmpeg.exe')):
+        if os.path.exists(path):
+            opts['ffmpeg_location'] = os.path.dirname(path)
+            break
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        ydl.cookiejar
+        ydl.get_info_extractor('Youtube')
+        if url:
+            ydl.extract_info(url, download=False)
+
+def new_setup(pool, url=None):
+    with pool.acquire() as ydl:
+        ydl.get_info_extractor('Youtube')
+        if url:
+            ydl.extract_info(url, download=False)
+
+def measure(fn, args, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[max(0, int(len(samples) * 0.99) - 1)]
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    url = sys.argv[sys.argv.index('--url') + 1] if '--url' in sys.argv else None
+    if url in args:
+        args.remove(url)
+    n = int(args[0]) if args else (5 if url else 200)
+
+    tmp = tempfile.mkdtemp(prefix="ydlbench_")
+    write_cookie_file(os.path.join(tmp, 'cookies.txt'))
+    cache_dir = prepare_cache_dir(os.path.join(tmp, 'ytdlp-cache'), yt_dlp.version.__version__)
+    template = {'quiet': True, 'no_warnings': True, 'cachedir': cache_dir, 'nocheckcertificate': True,
+                'cookiefile': os.path.join(tmp, 'cookies.txt')}
+    pool = YoutubeDLPool('bench', lambda: dict(template), yt_dlp.YoutubeDL, max_idle=1)
+    pool.warm_up(1, prepare=lambda ydl: ydl.get_info_extractor('Youtube'))
+
+    # Warm up both paths (imports, lazy extractor loading)
+    measure(old_setup, (tmp, url), 1)
+    measure(new_setup, (pool, url), 1)
+    o = measure(old_setup, (tmp, url), n)
+    p = measure(new_setup, (pool, url), n)
+
+    print(f"{n} calls each, milliseconds (mean / p50 / p99){' incl. extraction of ' + url if url else ''}")
+    print(f"{'per-call YoutubeDL':<28}{o[0]:>10.2f} /{o[1]:>8.2f} /{o[2]:>8.2f}")
+    print(f"{'template + pool':<28}{p[0]:>10.2f} /{p[1]:>8.2f} /{p[2]:>8.2f}")
+    print(f"speedup {o[0] / p[0]:.1f}x   pool: {pool.stats()}")
+
+    pool.reset()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
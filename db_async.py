@@ -0,0 +1,82 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db_utils
+
+# Functions that never touch disk on the calling thread while the server is running:
+# the blocklist is in memory and these writes only enqueue into the write-behind queue.
+# They run inline instead of paying for a thread hop.
+IN_MEMORY = {'is_ip_blocked', 'get_writer_stats'}
+WRITE_BEHIND = {'log_event', 'log_bandwidth', 'update_client_info'}
+
+class AsyncDB:
+    """
+    Async facade over db_utils for use from coroutines (endpoints, middlewares, proxy).
+    `await async_db.verify_user(...)` runs db_utils.verify_user on a dedicated DB thread
+    pool, so a slow disk or a held write lock never stalls the event loop.
+    Each pool thread keeps its own pooled connection (see db_utils.get_conn).
+    """
+
+    def __init__(self, module=db_utils, max_workers: int = 2):
+        self._module = module
+        self._max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._wrappers = {}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="db")
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """Run any blocking DB callable on the DB threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(fn, *args, **kwargs))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        wrapper = self._wrappers.get(name)
+        if wrapper is not None:
+            return wrapper
+
+        fn = getattr(self._module, name)
+        if not callable(fn):
+            return fn
+
+        if name in IN_MEMORY:
+            async def wrapper(*args, **kwargs):
+                return fn(*args, **kwargs)
+        elif name in WRITE_BEHIND:
+            async def wrapper(*args, **kwargs):
+                # Without the background writer these write synchronously
+                if self._module.write_queue.running:
+                    return fn(*args, **kwargs)
+                return await self.run(fn, *args, **kwargs)
+        else:
+            async def wrapper(*args, **kwargs):
+                return await self.run(fn, *args, **kwargs)
+
+        wrapper = functools.wraps(fn)(wrapper)
+        self._wrappers[name] = wrapper
+        return wrapper
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def stats(self) -> dict:
+        ex = self._executor
+        return {
+            "workers": self._max_workers,
+            "queued": ex._work_queue.qsize() if ex else 0
+        }
+
+async_db = AsyncDB()
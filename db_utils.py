@@ -1,7 +1,12 @@
 import sqlite3
 import time
 import os
+import threading
+import collections
+import json
+from contextlib import contextmanager
 from typing import List, Dict, Optional
+from ip_blocklist import IPBlocklist, normalize_entry
 
 if os.name == 'nt':
     DB_PATH = os.path.join(os.environ.get('LOCALAPPDATA', os.getcwd()), 'YtDlpApiServer', 'server.db')
@@ -9,105 +14,804 @@ else:
     # Use Home directory for Linux to ensure write permissions and consistency
     DB_PATH = os.path.join(os.path.expanduser("~"), ".YtDlpApiServer", "server.db")
 
+# --- Connection Management ---
+# All DB access in this module goes through get_conn() / transaction().
+# Each thread (uvicorn loop, download workers, ...) keeps one long-lived connection,
+# so a call costs a prepared-statement cache lookup instead of open + schema parse + close.
+
+# sqlite3 caches prepared statements per connection, keyed by SQL text.
+# Hot-path SQL is kept in constants below so the exact same string is always reused.
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT = 10.0 # seconds to wait for a write lock before raising
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # Readers never block the writer (persistent in the DB file)
+    "PRAGMA synchronous=NORMAL",    # Safe with WAL; fsync on checkpoint instead of every commit
+    "PRAGMA cache_size=-16000",     # ~16MB page cache per connection
+    "PRAGMA mmap_size=134217728",   # 128MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+)
+
+_local = threading.local()
+_open_conns: List[sqlite3.Connection] = []
+_open_conns_lock = threading.Lock()
+_generation = 0 # Bumped by close_db(): thread-local connections of an older generation are closed
+
+def _connect(path: str) -> sqlite3.Connection:
+    # check_same_thread=False only so close_db() can close connections owned by other threads
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    with _open_conns_lock:
+        _open_conns.append(conn)
+    return conn
+
+def get_conn() -> sqlite3.Connection:
+    """Return the calling thread's persistent connection (opened on first use)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != DB_PATH or _local.generation != _generation:
+        generation = _generation
+        conn = _connect(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
+        _local.generation = generation
+    return conn
+
+@contextmanager
+def transaction():
+    """Cursor wrapped in one transaction: commit on success, rollback on error"""
+    conn = get_conn()
+    with conn:
+        yield conn.cursor()
+
+def query_one(sql: str, params=()) -> Optional[sqlite3.Row]:
+    return get_conn().execute(sql, params).fetchone()
+
+def query_all(sql: str, params=()) -> List[sqlite3.Row]:
+    return get_conn().execute(sql, params).fetchall()
+
+def close_db():
+    """
+    Close the connections of all threads (on shutdown, or before switching DB_PATH).
+    Every thread, not only the caller, opens a new connection on its next query.
+    Stop the background writer and retention threads first: a query running while its
+    connection is closed fails.
+    """
+    global _generation
+    with _open_conns_lock:
+        conns = list(_open_conns)
+        _open_conns.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    _local.conn = None
+
+# Hot-path statements
+SQL_INSERT_LOG = "INSERT INTO logs (timestamp, ip, event_type, details, username) VALUES (?, ?, ?, ?, ?)"
+SQL_INSERT_BANDWIDTH = "INSERT INTO bandwidth (timestamp, ip, bytes_sent, bytes_received, type, username) VALUES (?, ?, ?, ?, ?, ?)"
+SQL_UPSERT_CLIENT = '''INSERT OR REPLACE INTO clients
+                     (client_id, ip, user_agent, screen_res, window_size, color_depth, theme, orientation, last_seen, device_name, username)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+SQL_VERIFY_USER = "SELECT * FROM users WHERE username = ? AND password = ?"
+SQL_UPDATE_LAST_LOGIN = "UPDATE users SET last_login = ? WHERE id = ?"
+
+# --- Write-Behind Queue ---
+# Fire-and-forget inserts (request logs, bandwidth, client fingerprints) are buffered
+# and written by one background thread in multi-row transactions, so the request path
+# never waits on a commit. Records are dropped (and counted) when the buffer is full.
+WRITE_QUEUE_MAX = 20000       # records
+WRITE_BATCH_SIZE = 500        # flush as soon as this many are pending
+WRITE_FLUSH_INTERVAL = 1.0    # ... or at least this often (seconds)
+
+class WriteBehindQueue:
+    def __init__(self, max_size: int = WRITE_QUEUE_MAX, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval: float = WRITE_FLUSH_INTERVAL):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buf = collections.deque()
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock() # Serializes writer thread and explicit flush()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        # Counters
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop accepting records, flush everything pending and join the writer thread"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush() # Anything left if join timed out
+
+    def submit(self, sql: str, params: tuple) -> bool:
+        """Queue one statement. Returns False if the queue is not running (caller writes directly)."""
+        with self._cond:
+            if not self._running:
+                return False
+            if len(self._buf) >= self.max_size:
+                self.dropped += 1
+                return True
+            self._buf.append((sql, params))
+            self.enqueued += 1
+            if len(self._buf) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def flush(self):
+        """Synchronously write everything currently queued"""
+        # Take the batch under the write lock so batches always commit in queue order
+        with self._write_lock:
+            with self._cond:
+                batch = list(self._buf)
+                self._buf.clear()
+            self._write(batch)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and len(self._buf) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                running = self._running
+            self.flush()
+            if not running:
+                break
+
+    def _write(self, batch: List[tuple]):
+        """Write one batch in a single transaction (caller holds _write_lock)"""
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            with transaction() as c:
+                # Group consecutive identical statements into executemany, keeping order
+                i = 0
+                while i < len(batch):
+                    sql = batch[i][0]
+                    j = i
+                    while j < len(batch) and batch[j][0] == sql:
+                        j += 1
+                    c.executemany(sql, [params for _, params in batch[i:j]])
+                    i = j
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"DB Error (Write-Behind, {len(batch)} records lost): {e}")
+        self.batches += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            depth = len(self._buf)
+        return {
+            "running": self._running,
+            "queue_depth": depth,
+            "queue_max": self.max_size,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": self.last_flush_ms
+        }
+
+write_queue = WriteBehindQueue()
+
+def start_writer():
+    write_queue.start()
+
+def stop_writer():
+    write_queue.stop()
+
+def get_writer_stats() -> Dict:
+    return write_queue.stats()
+
+def _write_behind(sql: str, params: tuple):
+    """Queue an insert, or write it immediately when the background writer isn't running (scripts, tests)"""
+    if not write_queue.submit(sql, params):
+        with transaction() as c:
+            c.execute(sql, params)
+
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Logs Table
-    c.execute('''CREATE TABLE IF NOT EXISTS logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp REAL,
-        ip TEXT,
-        event_type TEXT,
-        details TEXT
-    )''')
-    
-    # Bandwidth Table (Daily/IP aggregation can be done in query, but raw logs might be heavy. 
-    # Let's store per-request usage or aggregate.)
-    # For simplicity, let's log bandwidth events in a separate table or just use logs?
-    # Let's use a specific table for bandwidth to keep it clean.
-    c.execute('''CREATE TABLE IF NOT EXISTS bandwidth (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp REAL,
-        ip TEXT,
-        bytes_sent INTEGER,
-        bytes_received INTEGER,
-        type TEXT -- 'proxy', 'download', 'upload'
-    )''')
-    
-    # Blocked IPs
-    c.execute('''CREATE TABLE IF NOT EXISTS blocked_ips (
+    _enable_incremental_vacuum()
+    with transaction() as c:
+        # Logs Table
+        c.execute('''CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp REAL,
+            ip TEXT,
+            event_type TEXT,
+            details TEXT
+        )''')
+
+        # Bandwidth Table (Daily/IP aggregation can be done in query, but raw logs might be heavy.
+        # Let's store per-request usage or aggregate.)
+        # For simplicity, let's log bandwidth events in a separate table or just use logs?
+        # Let's use a specific table for bandwidth to keep it clean.
+        c.execute('''CREATE TABLE IF NOT EXISTS bandwidth (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp REAL,
+            ip TEXT,
+            bytes_sent INTEGER,
+            bytes_received INTEGER,
+            type TEXT -- 'proxy', 'download', 'upload'
+        )''')
+
+        _create_bandwidth_rollups(c)
+
+        # Blocked IPs
+        c.execute('''CREATE TABLE IF NOT EXISTS blocked_ips (
+            ip TEXT PRIMARY KEY,
+            reason TEXT,
+            timestamp REAL
+        )''')
+
+        # Client Fingerprints
+        c.execute('''CREATE TABLE IF NOT EXISTS clients (
+            client_id TEXT PRIMARY KEY,
+            ip TEXT,
+            user_agent TEXT,
+            screen_res TEXT,
+            window_size TEXT,
+            color_depth INTEGER,
+            theme TEXT,
+            orientation TEXT,
+            last_seen REAL
+        )''')
+
+        # Users Table
+        c.execute('''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT,
+            role TEXT, -- 'admin', 'user', 'pending'
+            nickname TEXT,
+            ip TEXT,
+            device_name TEXT,
+            user_agent TEXT,
+            screen_res TEXT,
+            created_at REAL,
+            last_login REAL
+        )''')
+
+        # File Owners Table (one row per owner: coalesced downloads give a file several)
+        c.execute('''CREATE TABLE IF NOT EXISTS file_owners (
+            filename TEXT,
+            username TEXT,
+            created_at REAL,
+            PRIMARY KEY (filename, username)
+        )''')
+        _migrate_file_owners(c)
+
+        # Initialize Default Users if Empty
+        try:
+            c.execute("ALTER TABLE clients ADD COLUMN device_name TEXT")
+        except:
+            pass
+        try:
+            c.execute("ALTER TABLE clients ADD COLUMN username TEXT")
+        except:
+            pass
+
+        # Attribute events / bandwidth to the logged-in user (NULL for guests and old rows)
+        try:
+            c.execute("ALTER TABLE logs ADD COLUMN username TEXT")
+        except:
+            pass
+        try:
+            c.execute("ALTER TABLE bandwidth ADD COLUMN username TEXT")
+        except:
+            pass
+
+        _create_indexes(c)
+        _create_user_counters(c)
+        _create_job_store(c)
+        _create_library_index(c)
+        _create_provider_health(c)
+        _create_retry_outcomes(c)
+
+        c.execute("SELECT count(*) FROM users")
+        if c.fetchone()[0] == 0:
+            # Defaults
+            current_time = time.time()
+            c.execute("INSERT INTO users (username, password, role, nickname, created_at) VALUES (?, ?, ?, ?, ?)",
+                      ("admin", "Shogo3170!", "admin", "Administrator", current_time))
+            c.execute("INSERT INTO users (username, password, role, nickname, created_at) VALUES (?, ?, ?, ?, ?)",
+                      ("user", "0713", "user", "Standard User", current_time))
+        else:
+            # Enforce passwords for default accounts on startup
+            c.execute("UPDATE users SET password = ? WHERE username = ?", ("Shogo3170!", "admin"))
+            c.execute("UPDATE users SET password = ? WHERE username = ?", ("0713", "user"))
+
+    load_blocklist()
+
+# --- Bandwidth Rollups ---
+# The raw bandwidth table gets a row per request. Dashboards read these pre-aggregated
+# tables instead, maintained by a trigger in the same transaction as each insert, so
+# every raw row is rolled up the moment it exists and can be pruned afterwards.
+BANDWIDTH_HOURLY_DAYS = 7 # Per-IP hourly buckets kept (get_ip_bandwidth_hourly, top_ips_24h)
+SQL_BANDWIDTH_ROLLUP_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS bandwidth_rollup AFTER INSERT ON bandwidth
+BEGIN
+    INSERT INTO bandwidth_ip_hourly (ip, hour, bytes_sent, bytes_received, requests)
+    VALUES (COALESCE(NEW.ip, 'unknown'), CAST(NEW.timestamp / 3600 AS INTEGER) * 3600,
+            COALESCE(NEW.bytes_sent, 0), COALESCE(NEW.bytes_received, 0), 1)
+    ON CONFLICT(ip, hour) DO UPDATE SET
+        bytes_sent = bytes_sent + excluded.bytes_sent,
+        bytes_received = bytes_received + excluded.bytes_received,
+        requests = requests + 1;
+
+    INSERT INTO bandwidth_type_daily (type, day, bytes_sent, bytes_received, requests)
+    VALUES (COALESCE(NEW.type, 'unknown'), CAST(NEW.timestamp / 86400 AS INTEGER) * 86400,
+            COALESCE(NEW.bytes_sent, 0), COALESCE(NEW.bytes_received, 0), 1)
+    ON CONFLICT(type, day) DO UPDATE SET
+        bytes_sent = bytes_sent + excluded.bytes_sent,
+        bytes_received = bytes_received + excluded.bytes_received,
+        requests = requests + 1;
+
+    INSERT INTO bandwidth_ip_totals (ip, bytes_sent, bytes_received, bytes_total, requests, last_seen)
+    VALUES (COALESCE(NEW.ip, 'unknown'), COALESCE(NEW.bytes_sent, 0), COALESCE(NEW.bytes_received, 0),
+            COALESCE(NEW.bytes_sent, 0) + COALESCE(NEW.bytes_received, 0), 1, NEW.timestamp)
+    ON CONFLICT(ip) DO UPDATE SET
+        bytes_sent = bytes_sent + excluded.bytes_sent,
+        bytes_received = bytes_received + excluded.bytes_received,
+        bytes_total = bytes_total + excluded.bytes_total,
+        requests = requests + 1,
+        last_seen = MAX(last_seen, excluded.last_seen);
+
+    UPDATE bandwidth_totals SET
+        bytes_sent = bytes_sent + COALESCE(NEW.bytes_sent, 0),
+        bytes_received = bytes_received + COALESCE(NEW.bytes_received, 0),
+        requests = requests + 1
+    WHERE id = 1;
+END'''
+
+def _create_bandwidth_rollups(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS bandwidth_ip_hourly (
+        ip TEXT NOT NULL,
+        hour INTEGER NOT NULL, -- epoch seconds, start of hour (UTC)
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        bytes_received INTEGER NOT NULL DEFAULT 0,
+        requests INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (ip, hour)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bw_ip_hourly_hour ON bandwidth_ip_hourly(hour)")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS bandwidth_type_daily (
+        type TEXT NOT NULL,
+        day INTEGER NOT NULL, -- epoch seconds, start of day (UTC)
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        bytes_received INTEGER NOT NULL DEFAULT 0,
+        requests INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (type, day)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bw_type_daily_day ON bandwidth_type_daily(day)")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS bandwidth_ip_totals (
         ip TEXT PRIMARY KEY,
-        reason TEXT,
-        timestamp REAL
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        bytes_received INTEGER NOT NULL DEFAULT 0,
+        bytes_total INTEGER NOT NULL DEFAULT 0,
+        requests INTEGER NOT NULL DEFAULT 0,
+        last_seen REAL
     )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bw_ip_totals_total ON bandwidth_ip_totals(bytes_total DESC)")
 
-    # Client Fingerprints
-    c.execute('''CREATE TABLE IF NOT EXISTS clients (
-        client_id TEXT PRIMARY KEY,
-        ip TEXT,
-        user_agent TEXT,
-        screen_res TEXT,
-        window_size TEXT,
-        color_depth INTEGER,
-        theme TEXT,
-        orientation TEXT,
-        last_seen REAL
+    c.execute('''CREATE TABLE IF NOT EXISTS bandwidth_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        bytes_received INTEGER NOT NULL DEFAULT 0,
+        requests INTEGER NOT NULL DEFAULT 0
     )''')
 
-    # Users Table
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE,
-        password TEXT,
-        role TEXT, -- 'admin', 'user', 'pending'
-        nickname TEXT,
-        ip TEXT,
-        device_name TEXT, 
-        user_agent TEXT,
-        screen_res TEXT,
-        created_at REAL,
-        last_login REAL
+    # First run on an existing DB: roll up the raw history once, then the trigger takes over.
+    # The hourly buckets are filled on their own: a previous version dropped that table.
+    c.execute("SELECT 1 FROM bandwidth_ip_hourly LIMIT 1")
+    if not c.fetchone():
+        c.execute('''INSERT INTO bandwidth_ip_hourly (ip, hour, bytes_sent, bytes_received, requests)
+                     SELECT COALESCE(ip, 'unknown'), CAST(timestamp / 3600 AS INTEGER) * 3600,
+                            SUM(COALESCE(bytes_sent, 0)), SUM(COALESCE(bytes_received, 0)), count(*)
+                     FROM bandwidth GROUP BY 1, 2''')
+    c.execute("SELECT 1 FROM bandwidth_totals WHERE id = 1")
+    if not c.fetchone():
+        c.execute('''INSERT INTO bandwidth_type_daily (type, day, bytes_sent, bytes_received, requests)
+                     SELECT COALESCE(type, 'unknown'), CAST(timestamp / 86400 AS INTEGER) * 86400,
+                            SUM(COALESCE(bytes_sent, 0)), SUM(COALESCE(bytes_received, 0)), count(*)
+                     FROM bandwidth GROUP BY 1, 2''')
+        c.execute('''INSERT INTO bandwidth_ip_totals (ip, bytes_sent, bytes_received, bytes_total, requests, last_seen)
+                     SELECT COALESCE(ip, 'unknown'), SUM(COALESCE(bytes_sent, 0)), SUM(COALESCE(bytes_received, 0)),
+                            SUM(COALESCE(bytes_sent, 0) + COALESCE(bytes_received, 0)), count(*), MAX(timestamp)
+                     FROM bandwidth GROUP BY 1''')
+        c.execute('''INSERT INTO bandwidth_totals (id, bytes_sent, bytes_received, requests)
+                     SELECT 1, COALESCE(SUM(bytes_sent), 0), COALESCE(SUM(bytes_received), 0), count(*)
+                     FROM bandwidth''')
+
+    # Recreated on every start, so databases with an older trigger pick up the current one
+    c.execute("DROP TRIGGER IF EXISTS bandwidth_rollup")
+    c.execute(SQL_BANDWIDTH_ROLLUP_TRIGGER)
+
+# --- Per-User Counters ---
+# Maintained by triggers on logs/bandwidth inserts that carry a username, so the admin
+# user views read a handful of pre-aggregated rows instead of scanning raw history.
+USER_STATS_WINDOW_DAYS = 30
+DOWNLOAD_EVENT = 'DOWNLOAD_START'
+PROXY_EVENT = 'PROXY_ACCESS'
+
+def _create_user_counters(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS user_activity_daily (
+        username TEXT NOT NULL,
+        day INTEGER NOT NULL, -- epoch seconds, start of day (UTC)
+        downloads INTEGER NOT NULL DEFAULT 0,
+        proxy_requests INTEGER NOT NULL DEFAULT 0,
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        bytes_received INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (username, day)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_activity_day ON user_activity_daily(day)")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS user_totals (
+        username TEXT PRIMARY KEY,
+        downloads INTEGER NOT NULL DEFAULT 0,
+        proxy_requests INTEGER NOT NULL DEFAULT 0,
+        bytes_sent INTEGER NOT NULL DEFAULT 0,
+        bytes_received INTEGER NOT NULL DEFAULT 0,
+        last_activity REAL
     )''')
-    
-    # File Owners Table
-    c.execute('''CREATE TABLE IF NOT EXISTS file_owners (
-        filename TEXT PRIMARY KEY,
+
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS logs_user_counters AFTER INSERT ON logs
+    WHEN NEW.username IS NOT NULL AND NEW.event_type IN ('{DOWNLOAD_EVENT}', '{PROXY_EVENT}')
+    BEGIN
+        INSERT INTO user_activity_daily (username, day, downloads, proxy_requests)
+        VALUES (NEW.username, CAST(NEW.timestamp / 86400 AS INTEGER) * 86400,
+                NEW.event_type = '{DOWNLOAD_EVENT}', NEW.event_type = '{PROXY_EVENT}')
+        ON CONFLICT(username, day) DO UPDATE SET
+            downloads = downloads + excluded.downloads,
+            proxy_requests = proxy_requests + excluded.proxy_requests;
+
+        INSERT INTO user_totals (username, downloads, proxy_requests, last_activity)
+        VALUES (NEW.username, NEW.event_type = '{DOWNLOAD_EVENT}', NEW.event_type = '{PROXY_EVENT}', NEW.timestamp)
+        ON CONFLICT(username) DO UPDATE SET
+            downloads = downloads + excluded.downloads,
+            proxy_requests = proxy_requests + excluded.proxy_requests,
+            last_activity = MAX(COALESCE(last_activity, 0), excluded.last_activity);
+    END''')
+
+    c.execute('''CREATE TRIGGER IF NOT EXISTS bandwidth_user_counters AFTER INSERT ON bandwidth
+    WHEN NEW.username IS NOT NULL
+    BEGIN
+        INSERT INTO user_activity_daily (username, day, bytes_sent, bytes_received)
+        VALUES (NEW.username, CAST(NEW.timestamp / 86400 AS INTEGER) * 86400,
+                COALESCE(NEW.bytes_sent, 0), COALESCE(NEW.bytes_received, 0))
+        ON CONFLICT(username, day) DO UPDATE SET
+            bytes_sent = bytes_sent + excluded.bytes_sent,
+            bytes_received = bytes_received + excluded.bytes_received;
+
+        INSERT INTO user_totals (username, bytes_sent, bytes_received, last_activity)
+        VALUES (NEW.username, COALESCE(NEW.bytes_sent, 0), COALESCE(NEW.bytes_received, 0), NEW.timestamp)
+        ON CONFLICT(username) DO UPDATE SET
+            bytes_sent = bytes_sent + excluded.bytes_sent,
+            bytes_received = bytes_received + excluded.bytes_received,
+            last_activity = MAX(COALESCE(last_activity, 0), excluded.last_activity);
+    END''')
+
+# One query for one user or the whole list: users + windowed daily sums + lifetime totals
+SQL_USER_STATS = '''
+    SELECT u.id, u.username, u.last_login,
+           COALESCE(w.downloads, 0) AS downloads_30d,
+           COALESCE(w.proxy_requests, 0) AS proxy_30d,
+           COALESCE(w.bytes, 0) AS bandwidth_30d,
+           COALESCE(t.downloads, 0) AS downloads_total,
+           COALESCE(t.bytes_sent + t.bytes_received, 0) AS bandwidth_total,
+           t.last_activity
+    FROM users u
+    LEFT JOIN (
+        SELECT username, SUM(downloads) AS downloads, SUM(proxy_requests) AS proxy_requests,
+               SUM(bytes_sent + bytes_received) AS bytes
+        FROM user_activity_daily
+        WHERE day >= ?
+        GROUP BY username
+    ) w ON w.username = u.username
+    LEFT JOIN user_totals t ON t.username = u.username
+'''
+
+# Renames: the old name's counters are added onto any the new name already has (new name, old name).
+# "WHERE true" keeps SQLite from reading ON CONFLICT as a join constraint of the SELECT.
+SQL_MERGE_USER_ACTIVITY = '''INSERT INTO user_activity_daily (username, day, downloads, proxy_requests, bytes_sent, bytes_received)
+    SELECT ?, day, downloads, proxy_requests, bytes_sent, bytes_received FROM user_activity_daily WHERE username = ? AND true
+    ON CONFLICT(username, day) DO UPDATE SET
+        downloads = downloads + excluded.downloads,
+        proxy_requests = proxy_requests + excluded.proxy_requests,
+        bytes_sent = bytes_sent + excluded.bytes_sent,
+        bytes_received = bytes_received + excluded.bytes_received'''
+SQL_MERGE_USER_TOTALS = '''INSERT INTO user_totals (username, downloads, proxy_requests, bytes_sent, bytes_received, last_activity)
+    SELECT ?, downloads, proxy_requests, bytes_sent, bytes_received, last_activity FROM user_totals WHERE username = ? AND true
+    ON CONFLICT(username) DO UPDATE SET
+        downloads = downloads + excluded.downloads,
+        proxy_requests = proxy_requests + excluded.proxy_requests,
+        bytes_sent = bytes_sent + excluded.bytes_sent,
+        bytes_received = bytes_received + excluded.bytes_received,
+        last_activity = MAX(COALESCE(last_activity, 0), COALESCE(excluded.last_activity, 0))'''
+
+def _window_start(days: int) -> int:
+    return (int(time.time() // 86400) - days + 1) * 86400
+
+# --- Durable Job Store ---
+# DownloadJob state plus the original DownloadRequest, so queued/running jobs survive
+# restarts (update, watchdog, crash) and job history is bounded and queryable.
+
+UNFINISHED_JOB_STATUSES = ('queued', 'downloading')
+KEPT_JOB_STATUSES = UNFINISHED_JOB_STATUSES + ('paused',) # Paused jobs keep their partial files until resumed
+JOB_RETENTION_DAYS = 30
+JOB_MAX_ROWS = 5000
+
+def _create_job_store(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS download_jobs (
+        id TEXT PRIMARY KEY,
+        status TEXT,
         username TEXT,
-        created_at REAL
+        created_at REAL,
+        updated_at REAL,
+        job TEXT,     -- DownloadJob as JSON
+        request TEXT  -- DownloadRequest as JSON
     )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_download_jobs_created ON download_jobs(created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_download_jobs_status ON download_jobs(status, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_download_jobs_user ON download_jobs(username, created_at)")
+
+SQL_SAVE_JOB = '''INSERT INTO download_jobs (id, status, username, created_at, updated_at, job, request)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        status = excluded.status,
+        username = excluded.username,
+        updated_at = excluded.updated_at,
+        job = excluded.job,
+        request = COALESCE(excluded.request, request)'''
+
+def save_job(job: Dict, request: Optional[Dict] = None):
+    """Upsert a job snapshot. The request is only stored when given (first save)."""
+    with transaction() as c:
+        c.execute(SQL_SAVE_JOB, (job['id'], job.get('status'), job.get('username'), job.get('created_at'),
+                                 time.time(), json.dumps(job), json.dumps(request) if request is not None else None))
+
+def get_job(job_id: str) -> Optional[Dict]:
+    row = query_one("SELECT job FROM download_jobs WHERE id = ?", (job_id,))
+    return json.loads(row[0]) if row else None
+
+def list_jobs(limit: int = 200, status: Optional[str] = None, username: Optional[str] = None,
+              before: Optional[tuple] = None) -> List[Dict]:
+    """Newest first. `before` = (created_at, id) of the last job of the previous page (keyset cursor)."""
+    sql = "SELECT job FROM download_jobs"
+    where, params = [], []
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if username:
+        where.append("username = ?")
+        params.append(username)
+    if before:
+        where.append("(created_at < ? OR (created_at = ? AND id < ?))")
+        params.extend((before[0], before[0], before[1]))
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit)
+    return [json.loads(row[0]) for row in query_all(sql, tuple(params))]
+
+def load_unfinished_jobs() -> List[tuple]:
+    """(job, request) pairs for jobs that were queued or running when the server stopped"""
+    rows = query_all(
+        "SELECT job, request FROM download_jobs WHERE status IN (?, ?) ORDER BY created_at",
+        UNFINISHED_JOB_STATUSES)
+    return [(json.loads(row[0]), json.loads(row[1]) if row[1] else None) for row in rows]
+
+def get_job_request(job_id: str) -> Optional[Dict]:
+    """Original DownloadRequest of a job (needed to resume it)"""
+    row = query_one("SELECT request FROM download_jobs WHERE id = ?", (job_id,))
+    return json.loads(row[0]) if row and row[0] else None
 
-    # Initialize Default Users if Empty
+def delete_job(job_id: str):
+    with transaction() as c:
+        c.execute("DELETE FROM download_jobs WHERE id = ?", (job_id,))
+
+def prune_jobs(max_age_days: float = JOB_RETENTION_DAYS, max_rows: int = JOB_MAX_ROWS) -> int:
+    """Drop finished/failed jobs beyond the age or row cap. Unfinished and paused jobs are never pruned."""
+    placeholders = ", ".join("?" * len(KEPT_JOB_STATUSES))
+    with transaction() as c:
+        c.execute(f"DELETE FROM download_jobs WHERE created_at < ? AND status NOT IN ({placeholders})",
+                  (time.time() - max_age_days * 86400,) + KEPT_JOB_STATUSES)
+        deleted = c.rowcount
+        c.execute("SELECT created_at FROM download_jobs ORDER BY created_at DESC LIMIT 1 OFFSET ?", (max_rows,))
+        row = c.fetchone()
+        if row:
+            c.execute(f"DELETE FROM download_jobs WHERE created_at <= ? AND status NOT IN ({placeholders})",
+                      (row[0],) + KEPT_JOB_STATUSES)
+            deleted += c.rowcount
+    return deleted
+
+# --- Indexes, Retention & Compaction ---
+def _create_indexes(c):
+    # get_logs(): newest-first scan + LEFT JOIN clients ON ip (covering the joined columns)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clients_ip ON clients(ip, user_agent, screen_res, window_size, theme)")
+    # get_user_stats() reads the per-user counter tables now; this index only cost log inserts
+    c.execute("DROP INDEX IF EXISTS idx_logs_ip_event_ts")
+    # Age-based pruning of raw bandwidth rows
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bandwidth_timestamp ON bandwidth(timestamp)")
+
+def _enable_incremental_vacuum():
+    """Switch the DB to auto_vacuum=INCREMENTAL so deleted pages can be released in small steps.
+    Changing the mode on an existing (or already WAL-initialized) file takes a one-time VACUUM."""
+    conn = get_conn()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' LIMIT 1").fetchone():
+            print("DB: converting to incremental auto-vacuum (one-time VACUUM)...")
+        conn.execute("VACUUM")
+
+# Retention limits. Raw bandwidth rows are only needed until rolled up (immediately),
+# so they can be kept much shorter than the event log.
+RETENTION = {
+    'logs': {'max_age_days': 30, 'max_rows': 200000},
+    'bandwidth': {'max_age_days': 3, 'max_rows': 200000},
+}
+# Rollup tables, each on its own horizon: (time column, days kept). bandwidth_ip_totals drops
+# IPs not seen for the horizon (their bytes stay in bandwidth_totals); bandwidth_totals and
+# user_totals hold one row per server / user and need no pruning.
+ROLLUP_RETENTION = {
+    'bandwidth_ip_hourly': ('hour', BANDWIDTH_HOURLY_DAYS),
+    'bandwidth_type_daily': ('day', 90),
+    'bandwidth_ip_totals': ('last_seen', 90),
+    'user_activity_daily': ('day', USER_STATS_WINDOW_DAYS + 1),
+}
+RETENTION_INTERVAL = 600        # seconds between passes
+RETENTION_CHUNK_ROWS = 5000     # rows deleted per transaction (keeps write locks short)
+RETENTION_VACUUM_PAGES = 2000   # pages released per incremental_vacuum step
+
+retention_stats: Dict = {"runs": 0, "last_run": None, "last_duration_ms": 0, "deleted": {}, "freed_pages": 0}
+
+def _delete_in_chunks(table: str, where: str, params: tuple) -> int:
+    """DELETE ... WHERE in RETENTION_CHUNK_ROWS-sized transactions so writers are never blocked for long"""
+    sql = f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE {where} ORDER BY id LIMIT ?)"
+    total = 0
+    while True:
+        with transaction() as c:
+            c.execute(sql, params + (RETENTION_CHUNK_ROWS,))
+            deleted = c.rowcount
+        total += deleted
+        if deleted < RETENTION_CHUNK_ROWS:
+            return total
+        time.sleep(0.01) # Let other writers in between chunks
+
+def prune_table(table: str, max_age_days: Optional[float] = None, max_rows: Optional[int] = None) -> int:
+    deleted = 0
+    if max_age_days:
+        cutoff = time.time() - max_age_days * 86400
+        deleted += _delete_in_chunks(table, "timestamp < ?", (cutoff,))
+    if max_rows:
+        row = query_one(f"SELECT id FROM {table} ORDER BY id DESC LIMIT 1 OFFSET ?", (max_rows,))
+        if row:
+            deleted += _delete_in_chunks(table, "id <= ?", (row[0],))
+    return deleted
+
+def prune_rollup(table: str, column: str, max_age_days: float) -> int:
+    """Delete rollup rows older than max_age_days (whole days, so a day is never cut in half)"""
+    with transaction() as c:
+        c.execute(f"DELETE FROM {table} WHERE {column} < ?", (_window_start(max_age_days),))
+        return c.rowcount
+
+def incremental_vacuum(max_pages: int = RETENTION_VACUUM_PAGES) -> int:
+    """Return up to max_pages free pages to the filesystem. Returns pages freed."""
+    conn = get_conn()
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if before == 0:
+        return 0
+    # executescript steps the pragma to completion (execute() would free a single page)
+    conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+def run_retention() -> Dict:
+    """One retention pass: prune logs/bandwidth by age and row cap, rollups and jobs by age, then release free pages"""
+    start = time.perf_counter()
+    deleted = {}
+    for table, limits in RETENTION.items():
+        try:
+            deleted[table] = prune_table(table, limits.get('max_age_days'), limits.get('max_rows'))
+        except Exception as e:
+            print(f"DB Error (Retention {table}): {e}")
+    for table, (column, max_age_days) in ROLLUP_RETENTION.items():
+        try:
+            deleted[table] = prune_rollup(table, column, max_age_days)
+        except Exception as e:
+            print(f"DB Error (Retention {table}): {e}")
     try:
-        c.execute("ALTER TABLE clients ADD COLUMN device_name TEXT")
-    except:
-        pass
+        deleted['download_jobs'] = prune_jobs()
+    except Exception as e:
+        print(f"DB Error (Retention download_jobs): {e}")
+    freed = 0
     try:
-        c.execute("ALTER TABLE clients ADD COLUMN username TEXT")
-    except:
-        pass
-
-    c.execute("SELECT count(*) FROM users")
-    if c.fetchone()[0] == 0:
-        # Defaults
-        current_time = time.time()
-        c.execute("INSERT INTO users (username, password, role, nickname, created_at) VALUES (?, ?, ?, ?, ?)",
-                  ("admin", "Shogo3170!", "admin", "Administrator", current_time))
-        c.execute("INSERT INTO users (username, password, role, nickname, created_at) VALUES (?, ?, ?, ?, ?)",
-                  ("user", "0713", "user", "Standard User", current_time))
-    else:
-        # Enforce passwords for default accounts on startup
-        c.execute("UPDATE users SET password = ? WHERE username = ?", ("Shogo3170!", "admin"))
-        c.execute("UPDATE users SET password = ? WHERE username = ?", ("0713", "user"))
-
-    conn.commit()
-    conn.close()
+        while True:
+            step = incremental_vacuum()
+            freed += step
+            if step < RETENTION_VACUUM_PAGES:
+                break
+    except Exception as e:
+        print(f"DB Error (Incremental Vacuum): {e}")
+    retention_stats["runs"] += 1
+    retention_stats["last_run"] = time.time()
+    retention_stats["last_duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    retention_stats["deleted"] = deleted
+    retention_stats["freed_pages"] = freed
+    return dict(retention_stats)
+
+_retention_stop = threading.Event()
+_retention_thread: Optional[threading.Thread] = None
+
+def start_retention(interval: float = RETENTION_INTERVAL):
+    global _retention_thread
+    _retention_stop.clear()
+    def loop():
+        while not _retention_stop.is_set():
+            run_retention()
+            _retention_stop.wait(interval)
+    _retention_thread = threading.Thread(target=loop, name="db-retention", daemon=True)
+    _retention_thread.start()
+
+def stop_retention(timeout: float = 30.0):
+    """Stop the retention thread and wait for a pass in progress to finish"""
+    global _retention_thread
+    _retention_stop.set()
+    if _retention_thread:
+        _retention_thread.join(timeout)
+        _retention_thread = None
+
+def get_db_stats() -> Dict:
+    conn = get_conn()
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        "size_bytes": page_size * page_count,
+        "free_bytes": page_size * freelist,
+        "retention": dict(retention_stats),
+        "writer": get_writer_stats()
+    }
 
 def estimate_device_name(ua: str, screen: str) -> str:
     ua = ua.lower()
     device = "Unknown Device"
-    
+
     if "iphone" in ua:
         device = "iPhone"
     elif "ipad" in ua:
@@ -123,341 +827,378 @@ def estimate_device_name(ua: str, screen: str) -> str:
         device = "Mac"
     elif "linux" in ua:
         device = "Linux PC"
-    
+
     # Refine with screen resolution if available
     # e.g. 1920x1080 -> Desktop? this is weak heuristic but requested.
     return device
 
 def register_user_request(nickname: str, password: str, ip: str, ua: str, screen: str) -> bool:
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        # Check if nickname or derived username exists?
-        # For simplicity, we create a pending user. Username will be assigned or same as nickname?
-        # Let's say username = nickname for now, but check uniqueness.
-        
-        # If username exists, return False
-        c.execute("SELECT 1 FROM users WHERE username = ?", (nickname,))
-        if c.fetchone():
-            conn.close()
-            return False
-            
-        device_name = estimate_device_name(ua, screen)
-        
-        c.execute('''INSERT INTO users 
-                     (username, password, role, nickname, ip, device_name, user_agent, screen_res, created_at)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (nickname, password, 'pending', nickname, ip, device_name, ua, screen, time.time()))
-        
-        conn.commit()
-        conn.close()
+        with transaction() as c:
+            # Check if nickname or derived username exists?
+            # For simplicity, we create a pending user. Username will be assigned or same as nickname?
+            # Let's say username = nickname for now, but check uniqueness.
+
+            # If username exists, return False
+            c.execute("SELECT 1 FROM users WHERE username = ?", (nickname,))
+            if c.fetchone():
+                return False
+
+            device_name = estimate_device_name(ua, screen)
+
+            c.execute('''INSERT INTO users
+                         (username, password, role, nickname, ip, device_name, user_agent, screen_res, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                      (nickname, password, 'pending', nickname, ip, device_name, ua, screen, time.time()))
         return True
     except Exception as e:
         print(f"DB Error (Register): {e}")
         return False
 
 def verify_user(username, password):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
-    row = c.fetchone()
-    conn.close()
-    
+    row = query_one(SQL_VERIFY_USER, (username, password))
+
     if row:
         # Update last login
         try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.execute("UPDATE users SET last_login = ? WHERE id = ?", (time.time(), row['id']))
-            conn.commit()
-            conn.close()
+            with transaction() as c:
+                c.execute(SQL_UPDATE_LAST_LOGIN, (time.time(), row['id']))
         except:
             pass
-            
+
         if str(row['role']) == 'pending':
             return None
-            
+
         return dict(row)
     return None
 
 def authenticate_user(username, password):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT role, id FROM users WHERE username = ? AND password = ?", (username, password))
-    row = c.fetchone()
-    conn.close()
-    
+    row = query_one("SELECT role, id FROM users WHERE username = ? AND password = ?", (username, password))
+
     if row:
         # Update last login
         try:
-            conn = sqlite3.connect(DB_PATH)
-            conn.execute("UPDATE users SET last_login = ? WHERE id = ?", (time.time(), row[1]))
-            conn.commit()
-            conn.close()
+            with transaction() as c:
+                c.execute(SQL_UPDATE_LAST_LOGIN, (time.time(), row[1]))
         except:
             pass
-            
+
         if row[0] == 'pending':
             return None # Not approved yet
         return row[0] # Return role
     return None
 
 def get_all_users():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM users ORDER BY created_at DESC")
-    rows = c.fetchall()
-    conn.close()
+    rows = query_all("SELECT * FROM users ORDER BY created_at DESC")
     return [dict(row) for row in rows]
 
 def approve_user(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE users SET role = 'user' WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("UPDATE users SET role = 'user' WHERE id = ?", (user_id,))
 
 def update_user(user_id: int, password: str = None, role: str = None, username: str = None, nickname: str = None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    if password:
-        c.execute("UPDATE users SET password = ? WHERE id = ?", (password, user_id))
-    if role:
-        c.execute("UPDATE users SET role = ? WHERE id = ?", (role, user_id))
-    if username:
-        c.execute("UPDATE users SET username = ? WHERE id = ?", (username, user_id))
-    if nickname:
-        c.execute("UPDATE users SET nickname = ? WHERE id = ?", (nickname, user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        if password:
+            c.execute("UPDATE users SET password = ? WHERE id = ?", (password, user_id))
+        if role:
+            c.execute("UPDATE users SET role = ? WHERE id = ?", (role, user_id))
+        if username:
+            c.execute("SELECT username FROM users WHERE id = ?", (user_id,))
+            row = c.fetchone()
+            c.execute("UPDATE users SET username = ? WHERE id = ?", (username, user_id))
+            if row and row[0] != username:
+                # Counters are keyed by username; add them onto the new name's, then drop the old rows
+                for sql, table in ((SQL_MERGE_USER_ACTIVITY, 'user_activity_daily'), (SQL_MERGE_USER_TOTALS, 'user_totals')):
+                    c.execute(sql, (username, row[0]))
+                    c.execute(f"DELETE FROM {table} WHERE username = ?", (row[0],))
+        if nickname:
+            c.execute("UPDATE users SET nickname = ? WHERE id = ?", (nickname, user_id))
 
 def update_user_password(username: str, password: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE users SET password = ? WHERE username = ?", (password, username))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        c.execute("UPDATE users SET password = ? WHERE username = ?", (password, username))
 
 def get_pending_users_count() -> int:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT count(*) FROM users WHERE role = 'pending'")
-    count = c.fetchone()[0]
-    conn.close()
-    return count
+    return query_one("SELECT count(*) FROM users WHERE role = 'pending'")[0]
 
 def delete_user(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
-    
+    with transaction() as c:
+        c.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
 def get_user_stats(user_id: int):
-    # This is tricky because logs/bandwidth are by IP.
-    # Users might change IP.
-    # But for now, let's just get the user IP from user table and query logs?
-    # Or we should have been logging 'user' in logs table.
-    # Existing logs table only has IP.
-    # Best effort: Get user's registration IP or last known IP.
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT ip FROM users WHERE id = ?", (user_id,))
-    user_row = c.fetchone()
-    
-    if not user_row:
-        conn.close()
+    row = query_one(SQL_USER_STATS + " WHERE u.id = ?", (_window_start(USER_STATS_WINDOW_DAYS), user_id))
+    if not row:
         return {}
-        
-    ip = user_row['ip']
-    
-    # Query stats for this IP
-    # Downloads (last 30 days)
-    month_ago = time.time() - (30 * 24 * 3600)
-    c.execute("SELECT count(*) FROM logs WHERE ip = ? AND event_type = 'DOWNLOAD_START' AND timestamp > ?", (ip, month_ago))
-    download_count = c.fetchone()[0]
-    
-    # Proxy Accesses
-    c.execute("SELECT count(*) FROM logs WHERE ip = ? AND event_type = 'PROXY_ACCESS' AND timestamp > ?", (ip, month_ago))
-    proxy_count = c.fetchone()[0]
-    
-    # Bandwidth
-    c.execute("SELECT SUM(bytes_sent + bytes_received) FROM bandwidth WHERE ip = ?", (ip,))
-    bw = c.fetchone()[0] or 0
-    
-    # Last login
-    c.execute("SELECT last_login FROM users WHERE id = ?", (user_id,))
-    last_login = c.fetchone()[0]
-    
-    conn.close()
-    
-    return {
-        "downloads_30d": download_count,
-        "proxy_30d": proxy_count,
-        "bandwidth_total": bw,
-        "last_login": last_login
-    }
+    stats = dict(row)
+    del stats['id'], stats['username']
+    return stats
+
+def get_all_user_stats() -> Dict[int, Dict]:
+    """Stats for every user in one query, keyed by user id"""
+    rows = query_all(SQL_USER_STATS, (_window_start(USER_STATS_WINDOW_DAYS),))
+    return {row['id']: dict(row) for row in rows}
 
 def update_client_info(client_id: str, ip: str, info: Dict, username: str = None):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''INSERT OR REPLACE INTO clients 
-                     (client_id, ip, user_agent, screen_res, window_size, color_depth, theme, orientation, last_seen, device_name, username)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (client_id, ip, info.get('ua'), info.get('screen'), info.get('window'), 
-                   info.get('depth'), info.get('theme'), info.get('orientation'), time.time(), info.get('device_name'), username))
-        conn.commit()
-        conn.close()
+        _write_behind(SQL_UPSERT_CLIENT,
+                      (client_id, ip, info.get('ua'), info.get('screen'), info.get('window'),
+                       info.get('depth'), info.get('theme'), info.get('orientation'), time.time(), info.get('device_name'), username))
     except Exception as e:
         print(f"DB Error (Client Info): {e}")
 
-def log_event(ip: str, event_type: str, details: str):
+def log_event(ip: str, event_type: str, details: str, username: str = None):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("INSERT INTO logs (timestamp, ip, event_type, details) VALUES (?, ?, ?, ?)",
-                  (time.time(), ip, event_type, details))
-        conn.commit()
-        conn.close()
+        _write_behind(SQL_INSERT_LOG, (time.time(), ip, event_type, details, username))
     except Exception as e:
         print(f"DB Error: {e}")
 
-def log_bandwidth(ip: str, sent: int, received: int, type: str):
+def log_bandwidth(ip: str, sent: int, received: int, type: str, username: str = None):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("INSERT INTO bandwidth (timestamp, ip, bytes_sent, bytes_received, type) VALUES (?, ?, ?, ?, ?)",
-                  (time.time(), ip, sent, received, type))
-        conn.commit()
-        conn.close()
+        _write_behind(SQL_INSERT_BANDWIDTH, (time.time(), ip, sent, received, type, username))
     except Exception as e:
         print(f"DB Error: {e}")
 
+# In-memory copy of blocked_ips (exact IPs and CIDR ranges), checked on every request.
+# Loaded at init_db() and kept in sync by block_ip() / unblock_ip().
+blocklist = IPBlocklist()
+
+def load_blocklist():
+    blocklist.replace(row['ip'] for row in query_all("SELECT ip FROM blocked_ips"))
+
 def block_ip(ip: str, reason: str = ""):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO blocked_ips (ip, reason, timestamp) VALUES (?, ?, ?)",
-              (ip, reason, time.time()))
-    conn.commit()
-    conn.close()
+    """Block a single address or a CIDR range ('203.0.113.0/24'). Raises ValueError if invalid."""
+    entry = normalize_entry(ip)
+    with transaction() as c:
+        c.execute("INSERT OR REPLACE INTO blocked_ips (ip, reason, timestamp) VALUES (?, ?, ?)",
+                  (entry, reason, time.time()))
+    blocklist.add(entry)
 
 def unblock_ip(ip: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM blocked_ips WHERE ip = ?", (ip,))
-    conn.commit()
-    conn.close()
+    try:
+        entry = normalize_entry(ip)
+    except ValueError:
+        # Legacy/invalid row that never made it into the trie, delete verbatim
+        with transaction() as c:
+            c.execute("DELETE FROM blocked_ips WHERE ip = ?", (ip,))
+        return
+    with transaction() as c:
+        c.execute("DELETE FROM blocked_ips WHERE ip = ?", (entry,))
+    blocklist.remove(entry)
 
 def get_blocked_ips() -> List[Dict]:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM blocked_ips")
-    rows = c.fetchall()
-    conn.close()
+    rows = query_all("SELECT * FROM blocked_ips")
     return [dict(row) for row in rows]
 
 def is_ip_blocked(ip: str) -> bool:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM blocked_ips WHERE ip = ?", (ip,))
-    result = c.fetchone()
-    conn.close()
-    return result is not None
+    return blocklist.contains(ip)
 
 def get_logs(limit: int = 100) -> List[Dict]:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
     # Join with clients table to get UA and device info
-    c.execute('''
-        SELECT logs.*, clients.user_agent, clients.screen_res, clients.window_size, clients.theme 
-        FROM logs 
-        LEFT JOIN clients ON logs.ip = clients.ip 
+    rows = query_all('''
+        SELECT logs.*, clients.user_agent, clients.screen_res, clients.window_size, clients.theme
+        FROM logs
+        LEFT JOIN clients ON logs.ip = clients.ip
         ORDER BY logs.timestamp DESC LIMIT ?
     ''', (limit,))
-    rows = c.fetchall()
-    conn.close()
     return [dict(row) for row in rows]
 
 def get_clients() -> List[Dict]:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM clients ORDER BY last_seen DESC")
-    rows = c.fetchall()
-    conn.close()
+    rows = query_all("SELECT * FROM clients ORDER BY last_seen DESC")
     return [dict(row) for row in rows]
 
-def get_bandwidth_stats() -> Dict:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Total
-    c.execute("SELECT SUM(bytes_sent), SUM(bytes_received) FROM bandwidth")
-    total_sent, total_recv = c.fetchone()
-    
+def get_bandwidth_stats(days: int = 7) -> Dict:
+    # All reads hit the rollup tables: 1 row + top 10 by index + (types x days)
+    totals = query_one("SELECT bytes_sent, bytes_received, requests FROM bandwidth_totals WHERE id = 1")
+
     # Per IP (Top 10)
-    c.execute('''
-        SELECT ip, SUM(bytes_sent + bytes_received) as total 
-        FROM bandwidth 
-        GROUP BY ip 
-        ORDER BY total DESC 
+    rows = query_all('''
+        SELECT ip, bytes_total
+        FROM bandwidth_ip_totals
+        ORDER BY bytes_total DESC
         LIMIT 10
     ''')
-    top_ips = [{"ip": row[0], "total": row[1]} for row in c.fetchall()]
-    
-    conn.close()
+    top_ips = [{"ip": row[0], "total": row[1]} for row in rows]
+
+    # Per IP, last 24 hours (Top 10): hourly buckets, at most IPs x 24 rows
+    rows = query_all('''
+        SELECT ip, SUM(bytes_sent + bytes_received) AS total, SUM(requests) AS requests
+        FROM bandwidth_ip_hourly
+        WHERE hour >= ?
+        GROUP BY ip
+        ORDER BY total DESC
+        LIMIT 10
+    ''', ((int(time.time() // 3600) - 23) * 3600,))
+    top_ips_24h = [dict(row) for row in rows]
+
+    # Per type, per day (recent)
+    since = (int(time.time() // 86400) - days + 1) * 86400
+    rows = query_all('''
+        SELECT day, type, bytes_sent, bytes_received, requests
+        FROM bandwidth_type_daily
+        WHERE day >= ?
+        ORDER BY day
+    ''', (since,))
+    daily = [dict(row) for row in rows]
+
     return {
-        "total_sent": total_sent or 0,
-        "total_received": total_recv or 0,
-        "top_ips": top_ips
+        "total_sent": totals['bytes_sent'] if totals else 0,
+        "total_received": totals['bytes_received'] if totals else 0,
+        "total_requests": totals['requests'] if totals else 0,
+        "top_ips": top_ips,
+        "top_ips_24h": top_ips_24h,
+        "daily_by_type": daily
     }
 
+def get_ip_bandwidth_hourly(ip: str, hours: int = 24) -> List[Dict]:
+    since = (int(time.time() // 3600) - hours + 1) * 3600
+    rows = query_all('''
+        SELECT hour, bytes_sent, bytes_received, requests
+        FROM bandwidth_ip_hourly
+        WHERE ip = ? AND hour >= ?
+        ORDER BY hour
+    ''', (ip, since))
+    return [dict(row) for row in rows]
+
+def _migrate_file_owners(c):
+    """Older databases keyed file_owners by filename alone (a single owner per file)"""
+    pk = [row[1] for row in c.execute("PRAGMA table_info(file_owners)").fetchall() if row[5]]
+    if pk != ['filename']:
+        return
+    c.execute('''CREATE TABLE file_owners_new (
+        filename TEXT,
+        username TEXT,
+        created_at REAL,
+        PRIMARY KEY (filename, username)
+    )''')
+    c.execute("INSERT OR IGNORE INTO file_owners_new SELECT filename, username, created_at FROM file_owners")
+    c.execute("DROP TABLE file_owners")
+    c.execute("ALTER TABLE file_owners_new RENAME TO file_owners")
+
 def add_file_owner(filename: str, username: str):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO file_owners (filename, username, created_at) VALUES (?, ?, ?)",
-                  (filename, username, time.time()))
-        conn.commit()
-        conn.close()
+        with transaction() as c:
+            c.execute("INSERT OR IGNORE INTO file_owners (filename, username, created_at) VALUES (?, ?, ?)",
+                      (filename, username, time.time()))
     except Exception as e:
         print(f"DB Error (Add File Owner): {e}")
 
-def get_file_owners() -> Dict[str, str]:
+def get_file_owners() -> Dict[str, List[str]]:
+    """filename -> owners, first owner first"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT filename, username FROM file_owners")
-        rows = c.fetchall()
-        conn.close()
-        return {row[0]: row[1] for row in rows}
+        owners: Dict[str, List[str]] = {}
+        for filename, username in query_all("SELECT filename, username FROM file_owners ORDER BY created_at"):
+            owners.setdefault(filename, []).append(username)
+        return owners
     except Exception as e:
         print(f"DB Error (Get File Owners): {e}")
         return {}
 
 def remove_file_owner(filename: str):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("DELETE FROM file_owners WHERE filename = ?", (filename,))
-        conn.commit()
-        conn.close()
+        with transaction() as c:
+            c.execute("DELETE FROM file_owners WHERE filename = ?", (filename,))
     except Exception as e:
         print(f"DB Error (Remove File Owner): {e}")
 
+# --- Library Index ---
+# Content-addressed view of DOWNLOAD_DIR: (extractor, video id, format signature) -> stored file,
+# so a repeat download of the same media in the same format can reuse the file.
+
+def _create_library_index(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS library_index (
+        extractor TEXT,
+        video_id TEXT,
+        signature TEXT, -- Effective download options (see main.effective_download_options)
+        filename TEXT,  -- Name in DOWNLOAD_DIR
+        title TEXT,
+        size INTEGER,   -- Bytes at indexing time; a mismatch means the file was replaced
+        created_at REAL,
+        PRIMARY KEY (extractor, video_id, signature)
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_library_index_filename ON library_index(filename)")
+
+def index_library_file(extractor: str, video_id: str, signature: str, filename: str, title: Optional[str], size: int):
+    try:
+        with transaction() as c:
+            c.execute("INSERT OR REPLACE INTO library_index (extractor, video_id, signature, filename, title, size, created_at) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?)", (extractor, video_id, signature, filename, title, size, time.time()))
+    except Exception as e:
+        print(f"DB Error (Index Library File): {e}")
+
+def find_library_file(extractor: str, video_id: str, signature: str) -> Optional[Dict]:
+    row = query_one("SELECT filename, title, size FROM library_index WHERE extractor = ? AND video_id = ? AND signature = ?",
+                    (extractor, video_id, signature))
+    return {"filename": row[0], "title": row[1], "size": row[2]} if row else None
+
+def remove_library_file(filename: str):
+    """Forget every index entry pointing at a file (deleted, trashed or replaced)"""
+    try:
+        with transaction() as c:
+            c.execute("DELETE FROM library_index WHERE filename = ?", (filename,))
+    except Exception as e:
+        print(f"DB Error (Remove Library File): {e}")
+
+def rename_library_file(old_filename: str, new_filename: str):
+    try:
+        with transaction() as c:
+            c.execute("UPDATE library_index SET filename = ? WHERE filename = ?", (new_filename, old_filename))
+    except Exception as e:
+        print(f"DB Error (Rename Library File): {e}")
+
+# --- Fallback provider health ---
+# Scoreboard of main.attempt_fallback_download (see provider_health.py), kept across restarts
+# so dead instances stay out of rotation.
+
+def _create_provider_health(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS provider_health (
+        name TEXT PRIMARY KEY,
+        successes INTEGER,
+        failures INTEGER,
+        latency REAL,              -- Smoothed seconds to an answer
+        consecutive_failures INTEGER,
+        open_until REAL,           -- Circuit open until this timestamp (0 = closed)
+        opened INTEGER             -- Times opened in a row (cool-down doubles)
+    )''')
+
+def load_provider_health() -> List[tuple]:
+    return [tuple(row) for row in query_all("SELECT name, successes, failures, latency, consecutive_failures, "
+                                            "open_until, opened FROM provider_health")]
+
+def save_provider_health(rows: List[tuple]):
+    try:
+        with transaction() as c:
+            c.executemany("INSERT OR REPLACE INTO provider_health (name, successes, failures, latency, "
+                          "consecutive_failures, open_until, opened) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    except Exception as e:
+        print(f"DB Error (Save Provider Health): {e}")
+
+# --- Retry outcomes ---
+# Per error class and recovery action of main.run_download (see retry_policy.py): how often
+# it was tried and how often the next attempt worked, for tuning the retry plans
+
+def _create_retry_outcomes(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS retry_outcomes (
+        error_class TEXT,
+        action TEXT,
+        tried INTEGER,
+        recovered INTEGER,
+        delay REAL,                -- Total seconds of backoff spent
+        PRIMARY KEY (error_class, action)
+    )''')
+
+def load_retry_outcomes() -> List[tuple]:
+    return [tuple(row) for row in query_all("SELECT error_class, action, tried, recovered, delay FROM retry_outcomes")]
+
+def save_retry_outcomes(rows: List[tuple]):
+    try:
+        with transaction() as c:
+            c.executemany("INSERT OR REPLACE INTO retry_outcomes (error_class, action, tried, recovered, delay) "
+                          "VALUES (?, ?, ?, ?, ?)", rows)
+    except Exception as e:
+        print(f"DB Error (Save Retry Outcomes): {e}")
+
 def check_username_exists(username: str) -> bool:
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT 1 FROM users WHERE username = ?", (username,))
-        row = c.fetchone()
-        conn.close()
-        return row is not None
+        return query_one("SELECT 1 FROM users WHERE username = ?", (username,)) is not None
     except:
         return False
@@ -0,0 +1,104 @@
+import threading
+import urllib.parse
+from typing import Any, Dict, List, Optional, Tuple
+
+# Query parameters that never change what gets downloaded
+TRACKING_PARAMS = ('si', 'feature', 'pp', 'fbclid', 'gclid', 'igshid', 'ref', 'ref_src')
+YOUTUBE_HOSTS = ('youtube.com', 'music.youtube.com', 'youtube-nocookie.com')
+
+def normalize_url(url: str) -> str:
+    """
+    Canonical form of a media URL for de-duplication: lower-case scheme/host without
+    'www.' / 'm.', no fragment, no tracking parameters, sorted query. YouTube short,
+    shorts and embed links become watch?v= links.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = (parts.scheme or 'https').lower()
+    if scheme == 'http':
+        scheme = 'https'
+    host = parts.netloc.lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = parts.path.rstrip('/') or '/'
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS and not k.startswith('utm_')]
+
+    if host == 'youtu.be' and path != '/':
+        host, query = 'youtube.com', [('v', path.lstrip('/'))] + [(k, v) for k, v in query if k != 'v']
+        path = '/watch'
+    elif host in YOUTUBE_HOSTS:
+        for prefix in ('/shorts/', '/embed/', '/live/'):
+            if path.startswith(prefix):
+                query = [('v', path[len(prefix):])] + [(k, v) for k, v in query if k != 'v']
+                path = '/watch'
+                break
+        if path == '/watch':
+            query = [(k, v) for k, v in query if k not in ('t', 'start', 'index')]
+
+    return urllib.parse.urlunsplit((scheme, host, path, urllib.parse.urlencode(sorted(query)), ''))
+
+def coalesce_key(url: str, options: Dict[str, Any]) -> str:
+    """Singleflight key: normalized URL + the options that change the produced file"""
+    return normalize_url(url) + '#' + '&'.join(f"{k}={options[k]}" for k in sorted(options))
+
+class DownloadCoalescer:
+    """
+    Singleflight registry for download jobs.
+
+    The first job for a key is the leader and does the transfer. Jobs submitted for the
+    same key while the leader is queued or running attach to it as followers: they are
+    never scheduled and only mirror the leader. When the leader stops, release() closes
+    the flight and hands back its followers, so later submissions start a new one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leaders: Dict[str, str] = {}   # key -> leader job id
+        self._keys: Dict[str, str] = {}      # leader job id -> key
+        self._followers: Dict[str, List[Tuple[Any, Any]]] = {} # leader job id -> [(job, request)]
+        self.coalesced = 0
+
+    def claim(self, key: str, job: Any, request: Any) -> Optional[str]:
+        """Make `job` the leader for `key`, or attach it to the current leader.
+        Returns the leader's job id when attached, None when `job` leads."""
+        with self._lock:
+            leader_id = self._leaders.get(key)
+            if leader_id is None:
+                self._leaders[key] = job.id
+                self._keys[job.id] = key
+                self._followers[job.id] = []
+                return None
+            self._followers[leader_id].append((job, request))
+            self.coalesced += 1
+            return leader_id
+
+    def followers(self, leader_id: str) -> List[Any]:
+        with self._lock:
+            return [job for job, _ in self._followers.get(leader_id, ())]
+
+    def detach(self, job_id: str) -> bool:
+        """Remove a follower from its flight (it was cancelled, paused or deleted)"""
+        with self._lock:
+            for followers in self._followers.values():
+                for i, (job, _) in enumerate(followers):
+                    if job.id == job_id:
+                        del followers[i]
+                        return True
+        return False
+
+    def release(self, leader_id: str) -> List[Tuple[Any, Any]]:
+        """Close the leader's flight. Returns its (job, request) followers."""
+        with self._lock:
+            key = self._keys.pop(leader_id, None)
+            if key is not None and self._leaders.get(key) == leader_id:
+                del self._leaders[key]
+            return self._followers.pop(leader_id, [])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'flights': len(self._leaders),
+                'followers': sum(len(f) for f in self._followers.values()),
+                'coalesced_total': self.coalesced
+            }
@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from fragment_concurrency import split_rate_limit
+from progress_tracker import requested_sizes
+
+# Progress fields forwarded from the worker process (everything else in yt-dlp's dict
+# is either large or not picklable)
+PROGRESS_KEYS = ('status', 'filename', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate',
+                 'speed', 'eta', 'elapsed', '_speed_str', '_eta_str', 'fragment_index', 'fragment_count')
+PROGRESS_INTERVAL = 0.25 # Seconds between 'downloading' messages from a worker
+POLL_INTERVAL = 0.2 # How often the parent checks for cancel / timeout while waiting
+# info_dict keys not sent back to the API process
+HEAVY_INFO_KEYS = ('formats', 'thumbnails', 'automatic_captions', 'subtitles', 'requested_formats',
+                   'heatmap', 'chapters', 'fragments', 'http_headers', 'description')
+
+class DownloadCancelled(Exception):
+    pass
+
+class DownloadTimeout(Exception):
+    pass
+
+class WorkerCrashed(Exception):
+    pass
+
+def _slim_info(info):
+    if not isinstance(info, dict):
+        return info
+    slim = {k: v for k, v in info.items() if k not in HEAVY_INFO_KEYS}
+    if isinstance(slim.get('entries'), list):
+        slim['entries'] = [_slim_info(e) for e in slim['entries']]
+    return slim
+
+def run_ytdlp(url: str, opts: Dict, hook: Callable) -> Dict:
+    """Default task body, executed inside the worker process"""
+    import yt_dlp
+    opts = dict(opts, progress_hooks=[hook])
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        split_rate_limit(ydl)
+        info = ydl.extract_info(url, download=True)
+        return _slim_info(ydl.sanitize_info(info)) if info else None
+
+def _worker_main(conn, runner):
+    """Worker process loop: receive (url, opts), stream ('progress', d) messages, end with ('done', info) or ('error', ...)"""
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if task is None:
+            return
+        url, opts = task
+        last = 0.0
+        first = True
+
+        def hook(d):
+            nonlocal last, first
+            now = time.monotonic()
+            if d.get('status') == 'downloading' and now - last < PROGRESS_INTERVAL:
+                return
+            last = now
+            progress = {k: d.get(k) for k in PROGRESS_KEYS if k in d}
+            if first:
+                # info_dict stays here; the tracker only needs the sizes of the requested formats
+                progress['requested_sizes'] = requested_sizes(d)
+                first = False
+            conn.send(('progress', progress))
+
+        try:
+            conn.send(('done', runner(url, opts, hook)))
+        except Exception as e:
+            conn.send(('error', (type(e).__name__, str(e))))
+
+class _Worker:
+    __slots__ = ('process', 'conn', 'jobs_run')
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs_run = 0
+
+class DownloadProcessPool:
+    """
+    Runs yt-dlp in long-lived worker subprocesses instead of API threads, so extraction
+    (JS interpreter, signature deciphering) and progress hooks never hold the API's GIL.
+    The calling thread (a scheduler worker) waits on the worker's pipe and relays progress.
+    A cancelled or timed-out job is stopped by killing its process; a fresh one is
+    spawned for the next job.
+    """
+
+    def __init__(self, size: int, runner: Callable = run_ytdlp):
+        self.size = size
+        self.runner = runner
+        self._ctx = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._idle: List[_Worker] = []
+        self._busy: Dict[str, _Worker] = {}
+        self.spawned = 0
+        self.killed = 0
+        self.timeouts = 0
+        self.crashes = 0
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, args=(child_conn, self.runner),
+                                    name=f"download-worker-{self.spawned}", daemon=True)
+        process.start()
+        child_conn.close()
+        self.spawned += 1
+        return _Worker(process, parent_conn)
+
+    def _acquire(self, job_id: str) -> _Worker:
+        with self._lock:
+            worker = None
+            while self._idle and worker is None:
+                candidate = self._idle.pop()
+                if candidate.process.is_alive():
+                    worker = candidate
+            if worker is None:
+                worker = self._spawn()
+            self._busy[job_id] = worker
+            return worker
+
+    def _release(self, job_id: str, worker: _Worker, keep: bool):
+        with self._lock:
+            self._busy.pop(job_id, None)
+            if keep and len(self._idle) < self.size:
+                self._idle.append(worker)
+                return
+        self._terminate(worker)
+
+    def _terminate(self, worker: _Worker):
+        if worker.process.is_alive():
+            worker.process.kill()
+            self.killed += 1
+        worker.process.join(5)
+        worker.conn.close()
+
+    def warm_up(self):
+        """Start the workers ahead of the first job (pays the import cost at startup)"""
+        with self._lock:
+            while len(self._idle) < self.size:
+                self._idle.append(self._spawn())
+
+    def run(self, job_id: str, url: str, opts: Dict, on_progress: Callable[[Dict], None],
+            timeout: Optional[float] = None, should_stop: Optional[Callable[[], Optional[str]]] = None) -> Optional[Dict]:
+        """
+        Blocking: run one yt-dlp download in a worker process and return its (slimmed) info dict.
+        `should_stop` is polled while waiting; a non-empty return value cancels the job with that reason.
+        """
+        # Callables stay in this process (the hook is relayed through on_progress)
+        opts = {k: v for k, v in opts.items() if k not in ('progress_hooks', 'logger')}
+        worker = self._acquire(job_id)
+        keep = False
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            worker.conn.send((url, opts))
+            while True:
+                reason = should_stop and should_stop()
+                if reason:
+                    raise DownloadCancelled(reason)
+                if deadline and time.monotonic() > deadline:
+                    self.timeouts += 1
+                    raise DownloadTimeout(f"Download exceeded {timeout:.0f}s")
+                if not worker.conn.poll(POLL_INTERVAL):
+                    if not worker.process.is_alive():
+                        self.crashes += 1
+                        raise WorkerCrashed(f"Download worker exited (code {worker.process.exitcode})")
+                    continue
+                try:
+                    kind, payload = worker.conn.recv()
+                except EOFError:
+                    self.crashes += 1
+                    raise WorkerCrashed("Download worker closed its pipe")
+                if kind == 'progress':
+                    try:
+                        on_progress(payload)
+                    except Exception as e:
+                        logging.error(f"Progress relay failed for {job_id}: {e}")
+                    continue
+                keep = True
+                worker.jobs_run += 1
+                if kind == 'done':
+                    return payload
+                name, message = payload
+                if name == 'DownloadError':
+                    # Keep the caller's retry logic (format / cookie fallbacks) working
+                    import yt_dlp
+                    raise yt_dlp.utils.DownloadError(message)
+                raise Exception(f"{name}: {message}")
+        finally:
+            self._release(job_id, worker, keep)
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            busy = list(self._busy.values())
+        for worker in idle:
+            try:
+                worker.conn.send(None)
+                worker.process.join(2)
+            except Exception:
+                pass
+        for worker in idle + busy:
+            self._terminate(worker)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "processes": self.size,
+                "idle": len(self._idle),
+                "busy": len(self._busy),
+                "spawned": self.spawned,
+                "killed": self.killed,
+                "timeouts": self.timeouts,
+                "crashes": self.crashes
+            }
@@ -0,0 +1,264 @@
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_JOB_SECONDS = 60.0 # ETA basis until real durations have been observed
+DURATION_SMOOTHING = 0.2   # EWMA weight of the newest job duration
+
+class _Entry:
+    __slots__ = ('job_id', 'owner', 'lane', 'fn', 'args', 'enqueued_at')
+
+    def __init__(self, job_id: str, owner: str, lane: str, fn: Callable, args: tuple):
+        self.job_id = job_id
+        self.owner = owner
+        self.lane = lane
+        self.fn = fn
+        self.args = args
+        self.enqueued_at = time.time()
+
+class _Lane:
+    """One priority lane: admin-pinned entries first, then round-robin across owners"""
+    __slots__ = ('pinned', 'owners')
+
+    def __init__(self):
+        self.pinned: deque = deque()
+        self.owners: "OrderedDict[str, deque]" = OrderedDict()
+
+    def __len__(self):
+        return len(self.pinned) + sum(len(q) for q in self.owners.values())
+
+    def copy(self) -> "_Lane":
+        lane = _Lane()
+        lane.pinned = deque(self.pinned)
+        lane.owners = OrderedDict((owner, deque(q)) for owner, q in self.owners.items())
+        return lane
+
+    def push(self, entry: _Entry, front: bool = False):
+        if front:
+            self.pinned.append(entry)
+            return
+        self.owners.setdefault(entry.owner, deque()).append(entry)
+
+    def remove(self, job_id: str) -> Optional[_Entry]:
+        for entry in self.pinned:
+            if entry.job_id == job_id:
+                self.pinned.remove(entry)
+                return entry
+        for owner, q in self.owners.items():
+            for entry in q:
+                if entry.job_id == job_id:
+                    q.remove(entry)
+                    if not q:
+                        del self.owners[owner]
+                    return entry
+        return None
+
+    def pop(self, can_run: Callable[[str], bool]) -> Optional[_Entry]:
+        for entry in self.pinned:
+            if can_run(entry.owner):
+                self.pinned.remove(entry)
+                return entry
+        for owner in list(self.owners):
+            if not can_run(owner):
+                continue
+            q = self.owners[owner]
+            entry = q.popleft()
+            # Round-robin: this owner goes to the back of the lane
+            del self.owners[owner]
+            if q:
+                self.owners[owner] = q
+            return entry
+        return None
+
+class DownloadScheduler:
+    """
+    Runs download jobs on a fixed number of worker threads, in front of run_download.
+
+    - Lanes: one per role, served in priority order (LIMITS[role]['priority'], lower first).
+    - Fair share: inside a lane owners take turns, so one user's playlist cannot starve others.
+    - Per-owner cap: an owner never has more than LIMITS[role]['max_concurrent'] jobs running;
+      their next job waits while other owners' jobs run.
+    - Admin control: move a queued job to another lane and/or to the head of its lane.
+    """
+
+    def __init__(self, limits: Dict[str, Dict], workers: int = 2, default_lane: str = 'user'):
+        self.limits = limits
+        self.workers = workers
+        self.default_lane = default_lane
+        self._cond = threading.Condition()
+        self._lanes: Dict[str, _Lane] = {role: _Lane() for role in self._lane_order()}
+        self._running: Dict[str, Tuple[str, float]] = {} # job_id -> (owner, started_at)
+        self._running_per_owner: Dict[str, int] = {}
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self.avg_job_seconds = DEFAULT_JOB_SECONDS
+        self.completed = 0
+
+    def _lane_order(self) -> List[str]:
+        return sorted(self.limits, key=lambda role: self.limits[role].get('priority', 99))
+
+    def _cap(self, lane: str) -> int:
+        return max(1, self.limits.get(lane, {}).get('max_concurrent', 1))
+
+    def _lane_name(self, lane: Optional[str]) -> str:
+        return lane if lane in self._lanes else self.default_lane
+
+    # --- Submission / admin control ---
+
+    def submit(self, job_id: str, owner: str, lane: Optional[str], fn: Callable, *args):
+        entry = _Entry(job_id, owner, self._lane_name(lane), fn, args)
+        with self._cond:
+            self._lanes[entry.lane].push(entry)
+            self._cond.notify()
+        self.start()
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a queued job. Returns False if it is not queued (already running or unknown)."""
+        with self._cond:
+            for lane in self._lanes.values():
+                if lane.remove(job_id):
+                    return True
+        return False
+
+    def move(self, job_id: str, lane: Optional[str] = None, front: bool = False) -> Optional[str]:
+        """Move a queued job to `lane` (a role name) and/or to the head of that lane.
+        Returns the new lane, or None if the job is not queued."""
+        if lane is not None and lane not in self._lanes:
+            raise ValueError(f"Unknown lane: {lane}")
+        with self._cond:
+            for current in self._lanes.values():
+                entry = current.remove(job_id)
+                if entry:
+                    break
+            else:
+                return None
+            if lane:
+                entry.lane = lane
+            self._lanes[entry.lane].push(entry, front=front)
+            self._cond.notify()
+            return entry.lane
+
+    # --- Workers ---
+
+    def start(self):
+        with self._cond:
+            if self._threads or self._stopping:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"download-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _can_run(self, lane: str):
+        cap = self._cap(lane)
+        return lambda owner: self._running_per_owner.get(owner, 0) < cap
+
+    def _take(self) -> Optional[_Entry]:
+        for name, lane in self._lanes.items():
+            entry = lane.pop(self._can_run(name))
+            if entry:
+                return entry
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                # On stop, queued jobs stay queued (the durable job store restores them on restart)
+                entry = None if self._stopping else self._take()
+                while entry is None and not self._stopping:
+                    self._cond.wait()
+                    entry = None if self._stopping else self._take()
+                if entry is None:
+                    return
+                self._running[entry.job_id] = (entry.owner, time.time())
+                self._running_per_owner[entry.owner] = self._running_per_owner.get(entry.owner, 0) + 1
+
+            started = time.time()
+            try:
+                entry.fn(*entry.args)
+            except Exception as e:
+                logging.error(f"Scheduled job {entry.job_id} raised: {e}")
+            finally:
+                with self._cond:
+                    self._running.pop(entry.job_id, None)
+                    left = self._running_per_owner.get(entry.owner, 1) - 1
+                    if left > 0:
+                        self._running_per_owner[entry.owner] = left
+                    else:
+                        self._running_per_owner.pop(entry.owner, None)
+                    self.avg_job_seconds += DURATION_SMOOTHING * (time.time() - started - self.avg_job_seconds)
+                    self.completed += 1
+                    self._cond.notify_all()
+
+    # --- Queue position / ETA ---
+
+    def estimates(self) -> Dict[str, Tuple[int, float]]:
+        """
+        job_id -> (queue position starting at 1, estimated start timestamp) for queued jobs.
+        Replays the dispatch rules on a copy of the queue, assuming every job takes the
+        running average duration.
+        """
+        now = time.time()
+        with self._cond:
+            lanes = {name: lane.copy() for name, lane in self._lanes.items()}
+            avg = self.avg_job_seconds
+            # Worker slots as a heap of (free_at, seq, owner of the job occupying it)
+            slots = [(max(now, started + avg), 0, owner) for owner, started in self._running.values()]
+            slots += [(now, 0, None)] * max(0, self.workers - len(slots))
+
+        heapq.heapify(slots)
+        seq = 0
+        running: Dict[str, int] = {}
+        for _, _, owner in slots:
+            if owner:
+                running[owner] = running.get(owner, 0) + 1
+
+        result: Dict[str, Tuple[int, float]] = {}
+        position = 0
+        while slots:
+            t, _, owner = heapq.heappop(slots)
+            seq += 1
+            if owner:
+                running[owner] -= 1
+            entry = None
+            for name, lane in lanes.items():
+                cap = self._cap(name)
+                entry = lane.pop(lambda o, cap=cap: running.get(o, 0) < cap)
+                if entry:
+                    break
+            if entry is None:
+                if not any(len(lane) for lane in lanes.values()):
+                    break
+                # Everything left is held back by per-owner caps: this slot idles until the
+                # next running job finishes
+                if slots:
+                    heapq.heappush(slots, (slots[0][0], seq, None))
+                    continue
+                break
+            position += 1
+            result[entry.job_id] = (position, t)
+            running[entry.owner] = running.get(entry.owner, 0) + 1
+            heapq.heappush(slots, (t + avg, seq, entry.owner))
+        return result
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "running": len(self._running),
+                "queued": {name: len(lane) for name, lane in self._lanes.items()},
+                "running_per_owner": dict(self._running_per_owner),
+                "avg_job_seconds": round(self.avg_job_seconds, 1),
+                "completed": self.completed
+            }
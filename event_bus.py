@@ -0,0 +1,140 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+HISTORY_PER_TOPIC = 500 # Events kept per topic for resume-after-reconnect
+SUBSCRIBER_QUEUE_SIZE = 1000 # A subscriber this far behind gets a 'resync' instead
+
+class Event:
+    __slots__ = ('seq', 'topic', 'timestamp', 'username', 'audience', 'data')
+
+    def __init__(self, seq: int, topic: str, data, username: Optional[str], audience: Optional[str]):
+        self.seq = seq
+        self.topic = topic
+        self.timestamp = time.time()
+        self.username = username # Owner (job owner / notification recipient)
+        self.audience = audience # 'admin' = admins only, None = filter by topic rules
+        self.data = data
+
+    def to_sse(self, boot: str) -> str:
+        payload = json.dumps({"seq": self.seq, "ts": self.timestamp, "data": self.data}, ensure_ascii=False)
+        return f"id: {boot}:{self.seq}\nevent: {self.topic}\ndata: {payload}\n\n"
+
+class Subscription:
+    def __init__(self, bus: "EventBus", accepts: Callable[[Event], bool]):
+        self.bus = bus
+        self.accepts = accepts
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.lagged = False
+
+    def push(self, event: Event):
+        """Runs on the event loop"""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too slow: drop the backlog, the client refetches full state
+            self.lagged = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+class EventBus:
+    """
+    Process-wide publish/subscribe channel behind /api/events.
+    publish() may be called from any thread (download workers, logging); delivery to
+    subscribers happens on the app's event loop. Every event gets a global sequence
+    number so a reconnecting client can resume with Last-Event-ID ("<boot>:<seq>";
+    the boot id tells a resume across a server restart apart from a normal one).
+    """
+
+    def __init__(self, history: int = HISTORY_PER_TOPIC):
+        self._lock = threading.Lock()
+        self.boot = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._history_size = history
+        self._history: Dict[str, deque] = {}
+        self._evicted_upto: Dict[str, int] = {} # topic -> highest seq dropped from history
+        self._subscribers: List[Subscription] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published = 0
+
+    def publish(self, topic: str, data, username: Optional[str] = None, audience: Optional[str] = None) -> int:
+        # Handed to the loop under the lock: loop callbacks run in seq order, so a client never
+        # sees 6 before 5 (and a resume from Last-Event-ID 6 cannot skip 5)
+        with self._lock:
+            self._seq += 1
+            event = Event(self._seq, topic, data, username, audience)
+            history = self._history.get(topic)
+            if history is None:
+                history = self._history[topic] = deque(maxlen=self._history_size)
+            if len(history) == history.maxlen:
+                self._evicted_upto[topic] = history[0].seq
+            history.append(event)
+            self.published += 1
+            loop = self.loop
+            if loop is None or loop.is_closed():
+                return event.seq
+            for sub in self._subscribers:
+                if sub.accepts(event):
+                    try:
+                        loop.call_soon_threadsafe(sub.push, event)
+                    except RuntimeError:
+                        pass # Loop shutting down
+        return event.seq
+
+    def subscribe(self, accepts: Callable[[Event], bool], topics: Iterable[str],
+                  since: Optional[int] = None) -> Tuple[Subscription, List[Event], bool]:
+        """
+        Register a subscriber. Returns (subscription, missed events after `since`, complete).
+        complete=False means part of the gap was already evicted: the client must resync.
+        Must be called on the event loop.
+        """
+        sub = Subscription(self, accepts)
+        missed: List[Event] = []
+        complete = True
+        with self._lock:
+            # Registering under the lock: nothing published in between is lost or duplicated
+            self._subscribers.append(sub)
+            if since is not None:
+                for topic in topics:
+                    if self._evicted_upto.get(topic, 0) > since:
+                        complete = False
+                    missed.extend(e for e in self._history.get(topic, ()) if e.seq > since and accepts(e))
+        missed.sort(key=lambda e: e.seq)
+        return sub, missed, complete
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def parse_last_event_id(self, value: Optional[str]) -> Tuple[Optional[int], bool]:
+        """'<boot>:<seq>' -> (seq, same_boot). A bare number is accepted as a seq of this boot."""
+        if not value:
+            return None, True
+        boot, _, seq = value.rpartition(':')
+        try:
+            seq = int(seq)
+        except ValueError:
+            return None, False
+        if (boot and boot != self.boot) or seq > self._seq:
+            return None, False
+        return seq, True
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "last_seq": self._seq,
+                "published": self.published,
+                "subscribers": len(self._subscribers),
+                "history": {topic: len(h) for topic, h in self._history.items()}
+            }
+
+event_bus = EventBus()
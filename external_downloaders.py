@@ -7,6 +7,18 @@ from typing import Optional, Dict, Any
 
 logger = logging.getLogger("server")
 
+# Scrapers return None when the service cannot serve a URL. Network errors and HTTP 5xx
+# propagate instead: the fallback race counts only those against the service's health.
+
+# Loader.to converts before it hands out a link: status polls, within a time budget. A
+# conversion still running at the end of the budget is slow, not broken: None, like "cannot serve".
+LOADER_POLL_INTERVAL = 1.5
+LOADER_POLL_BUDGET = 15.0
+
+def raise_for_server_error(resp: httpx.Response):
+    if resp.status_code >= 500:
+        resp.raise_for_status()
+
 async def get_savefrom(url: str, client: httpx.AsyncClient) -> Optional[Dict[str, Any]]:
     """Scraper for SaveFrom.net"""
     try:
@@ -32,6 +44,7 @@ async def get_savefrom(url: str, client: httpx.AsyncClient) -> Optional[Dict[str
         }
         
         resp = await client.post(worker_url, data=data, headers=headers)
+        raise_for_server_error(resp)
         if resp.status_code != 200:
             return None
 
@@ -68,6 +81,8 @@ async def get_savefrom(url: str, client: httpx.AsyncClient) -> Optional[Dict[str
             }
             
         return None
+    except httpx.HTTPError:
+        raise
     except Exception as e:
         return None
 
@@ -89,6 +104,7 @@ async def get_loader_to(url: str, client: httpx.AsyncClient) -> Optional[Dict[st
         }
         
         resp = await client.get(create_url, params=params, headers=headers)
+        raise_for_server_error(resp)
         if resp.status_code != 200:
              return None
              
@@ -100,11 +116,13 @@ async def get_loader_to(url: str, client: httpx.AsyncClient) -> Optional[Dict[st
         if not job_id:
              return None
              
-        # 2. Poll for Status (Limit retries to avoid long wait)
+        # 2. Poll for Status (within LOADER_POLL_BUDGET)
         poll_url = "https://loader.to/ajax/progress.php"
-        for _ in range(10): # Max 10 checks (approx 10-20 sec)
-            await asyncio.sleep(1.5)
+        deadline = asyncio.get_running_loop().time() + LOADER_POLL_BUDGET
+        while asyncio.get_running_loop().time() + LOADER_POLL_INTERVAL < deadline:
+            await asyncio.sleep(LOADER_POLL_INTERVAL)
             p_resp = await client.get(poll_url, params={"id": job_id}, headers=headers)
+            raise_for_server_error(p_resp)
             p_data = p_resp.json()
             
             if p_data.get("success") == 1:
@@ -121,6 +139,8 @@ async def get_loader_to(url: str, client: httpx.AsyncClient) -> Optional[Dict[st
                 
         return None
 
+    except httpx.HTTPError:
+        raise
     except Exception as e:
         # logger.warning(f"Loader.to Error: {e}")
         return None
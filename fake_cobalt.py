@@ -0,0 +1,114 @@
+"""
+Local stand-in for a Cobalt instance, for tests and benchmarks of the fallback path.
+
+POST /api/json answers {"status": "redirect", "url": <base>/media/<name>} after `latency`
+seconds (or Cobalt's "cannot download this" error when `fail` is set, or a bare HTTP
+`api_status` other than 200, as a broken instance would); GET /media/<name> serves `size` bytes of
+deterministic content, honouring Range requests unless `ranges` is False. Counts
+requests and TCP connections, so tests can check connection reuse.
+
+    server = FakeCobalt(size=5 * 1024 * 1024)
+    base_url = server.start()
+    ...
+    server.stop()
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RANGE = re.compile(r'bytes=(\d+)-(\d*)')
+
+def media_bytes(size: int) -> bytes:
+    block = bytes(range(256))
+    return (block * (size // 256 + 1))[:size]
+
+class FakeCobalt:
+    def __init__(self, size: int = 1024 * 1024, latency: float = 0.0, ranges: bool = True, fail: bool = False,
+                 api_status: int = 200):
+        self.size = size
+        self.latency = latency
+        self.ranges = ranges
+        self.fail = fail
+        self.api_status = api_status
+        self.body = media_bytes(size)
+        self.api_requests = 0
+        self.media_requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, so clients can reuse connections
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with fake._lock:
+                    fake.api_requests += 1
+                if fake.latency:
+                    fake._stop.wait(fake.latency)
+                if fake.api_status != 200:
+                    self._send(fake.api_status, b'', {})
+                    return
+                if fake.fail:
+                    payload = {"status": "error", "text": "unavailable"}
+                else:
+                    payload = {"status": "redirect", "url": f"{fake.base_url}/media/video.mp4",
+                               "filename": "video.mp4"}
+                self._send(200, json.dumps(payload).encode(), {'Content-Type': 'application/json'})
+
+            def do_GET(self):
+                if not self.path.startswith('/media/'):
+                    self._send(404, b'', {})
+                    return
+                with fake._lock:
+                    fake.media_requests += 1
+                match = RANGE.match(self.headers.get('Range') or '')
+                if match and fake.ranges:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)) if match.group(2) else fake.size - 1, fake.size - 1)
+                    self._send(206, fake.body[start:end + 1],
+                               {'Content-Range': f"bytes {start}-{end}/{fake.size}", 'Accept-Ranges': 'bytes'})
+                else:
+                    self._send(200, fake.body, {})
+
+            def _send(self, status, body, headers):
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._stop.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
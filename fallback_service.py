@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import wait as wait_futures
+from typing import Callable, Dict, Optional
+
+POLL_INTERVAL = 0.5 # Seconds between should_stop() checks while a worker thread waits
+
+class FallbackCancelled(Exception):
+    pass
+
+class FallbackService:
+    """
+    Runs fallback coroutines (provider race + direct download) for download worker threads
+    on the application's event loop, with one long-lived HTTP client: connections, TLS
+    sessions and DNS results are reused across jobs instead of a throwaway event loop and
+    client per fallback.
+
+    start() / stop() are awaited on the app's loop (startup / shutdown). Worker threads call
+    run(fn, *args), which schedules fn(*args, client=...) with run_coroutine_threadsafe and
+    blocks until it is done. Before start() (scripts, tests) run() falls back to a private
+    event loop with a client of its own.
+    """
+
+    def __init__(self, client_factory: Callable[[], object]):
+        self.client_factory = client_factory
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.client = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.active = 0
+        self.run_total = 0.0
+
+    async def start(self):
+        self.client = self.client_factory()
+        self.loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        client, self.client, self.loop = self.client, None, None
+        if client is not None:
+            await client.aclose()
+
+    def run(self, fn, *args, timeout: Optional[float] = None, should_stop: Optional[Callable[[], Optional[str]]] = None):
+        """
+        Blocking (worker threads only): result of `await fn(*args, client=...)`. The coroutine is
+        cancelled on timeout (TimeoutError) or once `should_stop()` returns a reason (FallbackCancelled).
+        """
+        loop = self.loop
+        started = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+            self.active += 1
+        outcome = 'failed'
+        try:
+            if loop is None or not loop.is_running():
+                result = asyncio.run(self._run_private(fn, args))
+            else:
+                if self._on_loop(loop):
+                    raise RuntimeError("FallbackService.run() would block its own event loop")
+                future = asyncio.run_coroutine_threadsafe(fn(*args, client=self.client), loop)
+                result = self._wait(future, timeout, should_stop)
+            outcome = 'completed'
+            return result
+        except FallbackCancelled:
+            outcome = 'cancelled'
+            raise
+        finally:
+            with self._lock:
+                self.active -= 1
+                setattr(self, outcome, getattr(self, outcome) + 1)
+                self.run_total += time.perf_counter() - started
+
+    @staticmethod
+    def _on_loop(loop) -> bool:
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    async def _run_private(self, fn, args):
+        client = self.client_factory()
+        try:
+            return await fn(*args, client=client)
+        finally:
+            await client.aclose()
+
+    @staticmethod
+    def _wait(future, timeout: Optional[float], should_stop):
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            wait = POLL_INTERVAL if should_stop else None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    future.cancel()
+                    raise TimeoutError("Fallback timed out")
+                wait = min(wait, remaining) if wait else remaining
+            if wait_futures([future], wait).done:
+                return future.result()
+            reason = should_stop() if should_stop else None
+            if reason:
+                future.cancel()
+                raise FallbackCancelled(reason)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            finished = self.completed + self.failed + self.cancelled
+            return {
+                'running': self.loop is not None,
+                'active': self.active,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'avg_run_ms': round(self.run_total / finished * 1000, 1) if finished else None
+            }
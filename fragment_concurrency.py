@@ -0,0 +1,188 @@
+import logging
+import math
+import re
+import threading
+import time
+import urllib.parse
+from typing import Dict, Optional
+
+DEFAULT_START = 4
+DEFAULT_MAX = 16
+RAMP_GAIN = 1.15          # A doubled level must be this much faster to be kept
+THROTTLE_HOLD = 600.0     # Seconds without ramping up after 403 / 429 responses
+PROBE_EVERY = 20          # Stable reports before the next level up is tried again
+MIN_SAMPLE_BYTES = 16 * 1024 * 1024
+CAP_BOUND = 0.9           # Throughput this close to the role's cap measures the cap, not the link
+SMOOTHING = 0.5
+FRAGMENTED_PROTOCOLS = ('m3u8', 'http_dash_segments', 'ism', 'f4m')
+THROTTLE_PATTERN = re.compile(r'HTTP Error (403|429)')
+
+def site_key(url: str) -> str:
+    host = (urllib.parse.urlsplit(url).hostname or '').lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return host
+
+def uses_fragments(info: Optional[Dict]) -> bool:
+    """Whether yt-dlp downloaded (part of) the result as DASH / HLS fragments"""
+    if not info:
+        return False
+    # Merged results carry e.g. 'http_dash_segments+https' (worker processes drop requested_formats)
+    protocols = '+'.join(str(f.get('protocol') or '') for f in info.get('requested_formats') or [info])
+    return any(p.startswith(FRAGMENTED_PROTOCOLS) for p in protocols.split('+'))
+
+def is_throttle_error(message: str) -> bool:
+    return bool(THROTTLE_PATTERN.search(message or ''))
+
+class ThrottleLogger:
+    """
+    yt-dlp logger for one download. Fragment retries are only reported as messages
+    ("Got error: HTTP Error 429 ..."), so 403 / 429 responses are counted here. Errors
+    are passed on to logging, everything else is dropped (the templates run quiet).
+    """
+
+    def __init__(self):
+        self.throttles = 0
+
+    def _check(self, msg: str):
+        if is_throttle_error(msg):
+            self.throttles += 1
+
+    def debug(self, msg: str):
+        self._check(msg)
+
+    def info(self, msg: str):
+        self._check(msg)
+
+    def warning(self, msg: str):
+        self._check(msg)
+
+    def error(self, msg: str):
+        self._check(msg)
+        logging.error(msg)
+
+class FragmentRateLimit:
+    """
+    yt-dlp 'before_dl' postprocessor: yt-dlp's ratelimit applies per connection, and only
+    DASH / HLS formats are downloaded over several (fragment threads). Once the format is
+    selected, the per-thread share ('fragment_ratelimit' option) replaces the cap
+    ('ratelimit') for fragmented formats; a progressive download keeps the whole cap.
+    """
+
+    def set_downloader(self, ydl):
+        self._ydl = ydl
+        self._cap = ydl.params.get('ratelimit')
+
+    def run(self, info):
+        share = self._ydl.params.get('fragment_ratelimit')
+        self._ydl.params['ratelimit'] = share if share and uses_fragments(info) else self._cap
+        return [], info
+
+def split_rate_limit(ydl):
+    """Install FragmentRateLimit on a YoutubeDL whose options carry a fragment_ratelimit"""
+    if ydl.params.get('fragment_ratelimit'):
+        ydl.add_post_processor(FragmentRateLimit(), when='before_dl')
+    return ydl
+
+class _Site:
+    __slots__ = ('level', 'samples', 'per_connection', 'hold_until', 'stable', 'throttles')
+
+    def __init__(self, level: int):
+        self.level = level
+        self.samples: Dict[int, float] = {} # level -> smoothed bytes/s
+        self.per_connection = None
+        self.hold_until = 0.0
+        self.stable = 0
+        self.throttles = 0
+
+class FragmentConcurrency:
+    """
+    Fragment threads per download (yt-dlp concurrent_fragment_downloads), learned per site.
+
+    yt-dlp fixes the thread count when a download starts, so levels adapt between
+    downloads: every DASH / HLS download reports the throughput it reached. The level
+    doubles while doubling pays off (RAMP_GAIN), drops back when it did not, and halves
+    after 403 / 429 responses, with no ramp-up for THROTTLE_HOLD seconds. With a speed
+    cap, choose() only opens as many connections as the learned per-connection speed
+    needs to reach the cap (callers split the cap between them).
+    """
+
+    def __init__(self, start: int = DEFAULT_START, minimum: int = 1, maximum: int = DEFAULT_MAX,
+                 gain: float = RAMP_GAIN, hold: float = THROTTLE_HOLD, probe_every: int = PROBE_EVERY,
+                 min_sample_bytes: int = MIN_SAMPLE_BYTES):
+        self.start = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.gain = gain
+        self.hold = hold
+        self.probe_every = probe_every
+        self.min_sample_bytes = min_sample_bytes
+        self._lock = threading.Lock()
+        self._sites: Dict[str, _Site] = {}
+
+    def _site(self, key: str) -> _Site:
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = _Site(self.start)
+        return site
+
+    def choose(self, key: str, cap_bps: Optional[float] = None) -> int:
+        with self._lock:
+            site = self._site(key)
+            if not cap_bps:
+                return site.level
+            if not site.per_connection or site.per_connection >= cap_bps:
+                return self.minimum # One connection reaches the cap (or nothing is known yet)
+            return max(self.minimum, min(site.level, math.ceil(cap_bps / site.per_connection)))
+
+    def report(self, key: str, level: int, downloaded_bytes: int = 0, seconds: float = 0.0,
+               throttled: bool = False, cap_bps: Optional[float] = None):
+        """Outcome of one fragmented download that ran with `level` threads"""
+        with self._lock:
+            site = self._site(key)
+            if throttled:
+                site.level = max(self.minimum, min(site.level, level // 2))
+                site.hold_until = time.time() + self.hold
+                site.stable = 0
+                site.throttles += 1
+                return
+            if seconds <= 0 or downloaded_bytes < self.min_sample_bytes:
+                return # Too short to measure
+            bps = downloaded_bytes / seconds
+            if cap_bps and bps >= cap_bps * CAP_BOUND:
+                return
+            previous = site.samples.get(level)
+            site.samples[level] = bps if previous is None else previous + SMOOTHING * (bps - previous)
+            per_connection = bps / level
+            site.per_connection = per_connection if site.per_connection is None else \
+                site.per_connection + SMOOTHING * (per_connection - site.per_connection)
+            if level != site.level:
+                return # Capped choice, or the level changed while this download ran
+            self._adapt(site, level)
+
+    def _adapt(self, site: _Site, level: int):
+        current = site.samples[level]
+        lower_level = max(self.minimum, level // 2)
+        upper_level = min(self.maximum, level * 2)
+        lower = site.samples.get(lower_level)
+        upper = site.samples.get(upper_level)
+        if lower_level < level and lower is not None and current < lower * self.gain:
+            site.level = lower_level # Doubling did not pay off
+            site.stable = 0
+        elif upper_level > level and time.time() >= site.hold_until and (upper is None or upper >= current * self.gain):
+            site.level = upper_level
+            site.stable = 0
+        else:
+            site.stable += 1
+            if site.stable >= self.probe_every:
+                site.samples.pop(upper_level, None) # Links change: measure the next level again
+                site.stable = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {key: {'level': site.level,
+                          'per_connection_bps': round(site.per_connection) if site.per_connection else None,
+                          'throttles': site.throttles,
+                          'held': site.hold_until > time.time()}
+                    for key, site in self._sites.items()}
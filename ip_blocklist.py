@@ -0,0 +1,133 @@
+import ipaddress
+import threading
+from typing import Iterable, Optional, Union
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+def parse_network(value: str) -> Network:
+    """Parse '1.2.3.4', '1.2.3.0/24' or an IPv6 equivalent. Raises ValueError if invalid."""
+    net = ipaddress.ip_network(value.strip(), strict=False)
+    # Treat IPv4-mapped IPv6 entries as plain IPv4
+    if net.version == 6 and net.network_address.ipv4_mapped is not None and net.prefixlen >= 96:
+        net = ipaddress.ip_network(f"{net.network_address.ipv4_mapped}/{net.prefixlen - 96}")
+    return net
+
+def normalize_entry(value: str) -> str:
+    """Canonical text stored in blocked_ips: bare address for single hosts, CIDR otherwise"""
+    net = parse_network(value)
+    if net.prefixlen == net.max_prefixlen:
+        return str(net.network_address)
+    return str(net)
+
+class _Node:
+    __slots__ = ('children', 'terminal')
+
+    def __init__(self):
+        self.children = [None, None]
+        self.terminal = False
+
+class IPBlocklist:
+    """
+    Binary prefix trie of blocked networks (one trie per address family).
+    A lookup walks at most 32 (IPv4) / 128 (IPv6) nodes and stops at the first
+    blocked prefix, so exact IPs and whole ranges cost the same and never touch disk.
+    """
+
+    def __init__(self, entries: Iterable[str] = ()):
+        self._lock = threading.Lock()
+        self._roots = {4: _Node(), 6: _Node()}
+        self._size = 0
+        self.replace(entries)
+
+    def __len__(self):
+        return self._size
+
+    def replace(self, entries: Iterable[str]):
+        """Rebuild from scratch (startup load). Readers see the old or new trie, never a partial one."""
+        roots = {4: _Node(), 6: _Node()}
+        size = 0
+        for entry in entries:
+            try:
+                if self._insert(roots, parse_network(entry)):
+                    size += 1
+            except ValueError:
+                continue
+        with self._lock:
+            self._roots = roots
+            self._size = size
+
+    def add(self, entry: str):
+        net = parse_network(entry)
+        with self._lock:
+            if self._insert(self._roots, net):
+                self._size += 1
+
+    def remove(self, entry: str):
+        net = parse_network(entry)
+        with self._lock:
+            node = self._roots[net.version]
+            value = int(net.network_address)
+            bits = net.max_prefixlen
+            path = []
+            for i in range(net.prefixlen):
+                bit = (value >> (bits - 1 - i)) & 1
+                path.append((node, bit))
+                node = node.children[bit]
+                if node is None:
+                    return
+            if not node.terminal:
+                return
+            node.terminal = False
+            self._size -= 1
+            # Prune empty branches
+            for parent, bit in reversed(path):
+                child = parent.children[bit]
+                if child.terminal or child.children[0] or child.children[1]:
+                    break
+                parent.children[bit] = None
+
+    def contains(self, ip: str) -> bool:
+        addr = self._parse_address(ip)
+        if addr is None:
+            return False
+        node = self._roots[addr.version]
+        value = int(addr)
+        bits = addr.max_prefixlen
+        if node.terminal: # 0.0.0.0/0
+            return True
+        for i in range(bits):
+            node = node.children[(value >> (bits - 1 - i)) & 1]
+            if node is None:
+                return False
+            if node.terminal:
+                return True
+        return False
+
+    __contains__ = contains
+
+    @staticmethod
+    def _parse_address(ip: str) -> Optional[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None # "unknown", "testclient", ...
+        if addr.version == 6 and addr.ipv4_mapped is not None:
+            return addr.ipv4_mapped
+        return addr
+
+    @staticmethod
+    def _insert(roots, net: Network) -> bool:
+        node = roots[net.version]
+        value = int(net.network_address)
+        bits = net.max_prefixlen
+        for i in range(net.prefixlen):
+            bit = (value >> (bits - 1 - i)) & 1
+            child = node.children[bit]
+            if child is None:
+                child = _Node()
+                node.children[bit] = child
+            node = child
+        if node.terminal:
+            return False
+        node.terminal = True
+        return True
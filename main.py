@@ -29,6 +29,8 @@ try:
     import urllib.parse
     import uuid
     import time
+    import json
+    import threading
     import asyncio
     import secrets
     import hashlib
@@ -36,10 +38,32 @@ try:
     import aiofiles # Added for async file reading
     import zipfile # Added for bulk download
     import io 
+    import copy
     from concurrent.futures import ThreadPoolExecutor
     from typing import Dict, List, Optional
+    from collections import OrderedDict
     from yt_dlp.utils import sanitize_filename
+    from yt_dlp.extractor import gen_extractor_classes
+    from yt_dlp.version import __version__ as YTDLP_VERSION
+    from functools import lru_cache
     import db_utils
+    from db_async import async_db
+    from download_scheduler import DownloadScheduler
+    from worker_pools import MeteredExecutor
+    from download_processes import DownloadProcessPool, DownloadCancelled, DownloadTimeout
+    from event_bus import event_bus
+    from progress_tracker import ProgressTracker, format_speed
+    from download_coalescing import DownloadCoalescer, coalesce_key
+    from metadata_cache import MetadataCache, info_ttl
+    from ydl_pool import YoutubeDLPool, prepare_cache_dir
+    from playlist_progress import PlaylistProgress
+    import segmented_download # Module import: main defines its own download_file (the /files routes)
+    from provider_health import ProviderHealth, hedged_race
+    from fallback_service import FallbackService, FallbackCancelled
+    from fragment_concurrency import (FragmentConcurrency, ThrottleLogger, is_throttle_error, site_key, split_rate_limit,
+                                      uses_fragments)
+    import retry_policy
+    from retry_policy import RetryPolicy
     # Import external downloaders
     import external_downloaders
     
@@ -72,6 +96,8 @@ class SSELogHandler(logging.Handler):
             if '"GET /system/info' in msg or '"GET /jobs' in msg or '"GET /files' in msg or '"GET /download' in msg:
                 return
             
+            # Unified stream (/api/events): admins only
+            event_bus.publish('log', msg, audience='admin')
             for q in list(log_queues):
                 LOG_LOOP.call_soon_threadsafe(q.put_nowait, msg)
         except Exception:
@@ -89,6 +115,28 @@ app = FastAPI(title="yt-dlp API Server", version="8.4.10")
 async def startup_event():
     global LOG_LOOP
     LOG_LOOP = asyncio.get_running_loop()
+    event_bus.loop = LOG_LOOP
+    await fallback_service.start()
+    # Background writer for request logs / bandwidth / client fingerprints
+    db_utils.start_writer()
+    # Periodic pruning of logs / raw bandwidth + incremental vacuum
+    db_utils.start_retention()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Background DB threads finish before connections are closed: a retention pass in progress
+    # is waited for, buffered log/bandwidth rows are flushed (stop_writer)
+    db_utils.stop_retention()
+    download_scheduler.stop()
+    if download_processes:
+        download_processes.shutdown()
+    interactive_executor.shutdown(wait=False, cancel_futures=True)
+    maintenance_executor.shutdown(wait=False, cancel_futures=True)
+    file_io_executor.shutdown(wait=False, cancel_futures=True)
+    await fallback_service.stop()
+    db_utils.stop_writer()
+    async_db.shutdown()
+    db_utils.close_db()
 
 
 # --- Middleware for Bandwidth & Fingerprinting ---
@@ -101,7 +149,7 @@ async def monitor_traffic(request: Request, call_next):
              client_ip = "unknown"
         
         # 1. Check Blocked IP
-        if client_ip != "unknown" and db_utils.is_ip_blocked(client_ip):
+        if client_ip != "unknown" and await async_db.is_ip_blocked(client_ip):
             return Response(content="Access Denied: Your IP is blocked.", status_code=403)
 
         # 2. Track Active Clients
@@ -128,7 +176,7 @@ async def monitor_traffic(request: Request, call_next):
         # We log here for general API usage and static files.
         if not request.url.path.startswith("/proxy") and not request.url.path.startswith("/api/download"):
              try:
-                 db_utils.log_bandwidth(client_ip, req_size, res_size, "api")
+                 await async_db.log_bandwidth(client_ip, req_size, res_size, "api", get_session_username(request))
              except:
                  pass
 
@@ -145,6 +193,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"], # /jobs pagination
 )
 
 # 実行環境のパスを取得
@@ -185,6 +234,10 @@ sessions: Dict[str, Dict] = {}
 # Environment Check for Cookie Security
 # Defaults to False for easier local dev, set YTDLP_ENV=production for secure
 IS_PRODUCTION = os.environ.get('YTDLP_ENV') == 'production'
+# Run yt-dlp in worker subprocesses instead of API threads (hard cancel / timeouts, no GIL contention)
+DOWNLOAD_PROCESSES = os.environ.get('YTDLP_DOWNLOAD_PROCESSES') == '1'
+DOWNLOAD_TIMEOUT = float(os.environ.get('YTDLP_DOWNLOAD_TIMEOUT', 4 * 3600)) # Seconds, process mode only
+PROGRESS_UPDATES_PER_SECOND = float(os.environ.get('YTDLP_PROGRESS_HZ', 2)) # Job progress snapshots per job
 
 # Rate Limiting & Limits
 # user_usage = { username: { 'download': [timestamps], 'proxy': [timestamps] } }
@@ -195,19 +248,28 @@ LIMITS = {
         'download_limit': 1, # per hour
         'proxy_limit': 0,    # per hour (disabled)
         'speed_limit': 0.8,  # MB/s (800KB/s)
-        'session_duration': 86400 * 1 # 1 day
+        'session_duration': 86400 * 1, # 1 day
+        'priority': 2,       # Download scheduler lane (lower runs first)
+        'max_concurrent': 1, # Running downloads per person
+        'playlist_limit': 10 # Entries downloaded per playlist
     },
     'personal': { # Created via registration
         'download_limit': 5, # per hour (includes playlist)
         'proxy_limit': 50,
         'speed_limit': 2.0,  # MB/s
-        'session_duration': 86400 * 7 # 7 days
+        'session_duration': 86400 * 7, # 7 days
+        'priority': 1,
+        'max_concurrent': 1,
+        'playlist_limit': 50
     },
     'admin': {
         'download_limit': 9999,
         'proxy_limit': 9999,
         'speed_limit': 0, # Unlimited
-        'session_duration': 86400 * 30 # 30 days
+        'session_duration': 86400 * 30, # 30 days
+        'priority': 0,
+        'max_concurrent': 2,
+        'playlist_limit': 500
     }
 }
 
@@ -218,12 +280,14 @@ user_notifications: Dict[str, List[Dict]] = {}
 def add_notification(username: str, message: str, type: str = "info"):
     if username not in user_notifications:
         user_notifications[username] = []
-    user_notifications[username].append({
+    notification = {
         "id": str(uuid.uuid4()),
         "message": message,
         "type": type,
         "timestamp": time.time()
-    })
+    }
+    user_notifications[username].append(notification)
+    event_bus.publish('notification', notification, username=username)
 
 def check_rate_limit(username: str, role: str, action: str) -> bool:
     if role == 'admin': return True
@@ -267,6 +331,11 @@ def get_active_client_count():
         del active_clients[ip]
     return len(active_clients)
 
+def get_session_username(request: Request) -> Optional[str]:
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    session = sessions.get(token) if token else None
+    return session.get('username') if session else None
+
 def check_auth(request: Request):
     token = request.cookies.get(AUTH_COOKIE_NAME)
     if not token or token not in sessions:
@@ -311,7 +380,7 @@ async def auth_and_limit_middleware(request: Request, call_next):
         client_ip = request.client.host if request.client else "unknown"
         
         # Check Blocked IP
-        if client_ip != "unknown" and db_utils.is_ip_blocked(client_ip):
+        if client_ip != "unknown" and await async_db.is_ip_blocked(client_ip):
             return JSONResponse(status_code=403, content={"detail": "Access Denied: Your IP is blocked."})
 
         # Check Role for Bypass
@@ -385,6 +454,7 @@ def cleanup_old_files():
                         if now - stat.st_mtime > days_3:
                             logging.info(f"Deleting old file: {f}")
                             os.remove(fp)
+                            db_utils.remove_library_file(f)
                     except Exception as e:
                         logging.error(f"Error deleting old file {f}: {e}")
                         
@@ -395,13 +465,25 @@ def cleanup_old_files():
 @app.on_event("startup")
 async def startup_event():
     # Run cleanup on startup
-    executor.submit(cleanup_old_files)
+    maintenance_executor.submit(cleanup_old_files)
+    # Re-enqueue jobs that were queued/running when the server last stopped
+    await restore_jobs()
+    fallback_providers.load(await async_db.load_provider_health())
+    download_retries.load(await async_db.load_retry_outcomes())
+    maintenance_executor.submit(warm_up_ydl_pools)
+    if download_processes:
+        maintenance_executor.submit(download_processes.warm_up)
 
 class JobStatus:
     QUEUED = "queued"
     DOWNLOADING = "downloading"
     FINISHED = "finished"
     ERROR = "error"
+    PAUSED = "paused" # Stopped by the user; TEMP_DIR partial files kept for resume
+    CANCELLED = "cancelled"
+
+ENDED_JOB_STATUSES = (JobStatus.FINISHED, JobStatus.ERROR, JobStatus.CANCELLED)
+RESTING_JOB_STATUSES = ENDED_JOB_STATUSES + (JobStatus.PAUSED,) # Not queued, not running
 
 class DownloadJob(BaseModel):
     id: str
@@ -418,12 +500,453 @@ class DownloadJob(BaseModel):
     client_ip: Optional[str] = None
     username: Optional[str] = None
     client_id: Optional[str] = None
-
-# In-memory job store
+    # Byte counters behind progress / speed / eta (see progress_tracker.py)
+    downloaded_bytes: Optional[int] = None
+    total_bytes: Optional[int] = None
+    speed_bps: Optional[float] = None
+    eta_seconds: Optional[int] = None
+    # Scheduling (see download_scheduler.py)
+    priority: Optional[str] = None # Lane = LIMITS role
+    queue_position: Optional[int] = None # 1 = next to start; None once running
+    estimated_start: Optional[float] = None # Unix timestamp
+    # Coalescing (see download_coalescing.py): leader job this one mirrors instead of downloading
+    mirror_of: Optional[str] = None
+    # Playlists (see playlist_progress.py): the parent job enumerates the entries and
+    # shows their aggregate; each entry downloads as a child job of its own
+    parent_id: Optional[str] = None
+    child_ids: Optional[List[str]] = None
+    entries_total: Optional[int] = None
+    entries_finished: Optional[int] = None
+    entries_failed: Optional[int] = None
+    # DASH / HLS fragment threads this download runs with (see fragment_concurrency.py)
+    fragment_concurrency: Optional[int] = None
+
+# In-memory job store (live jobs). Every state change is also written to the durable
+# store in db_utils (download_jobs table), which /jobs reads from.
 jobs: Dict[str, DownloadJob] = {}
 
-# Thread pool for concurrent downloads (Limit to 2)
-executor = ThreadPoolExecutor(max_workers=2)
+JOB_PERSIST_INTERVAL = 5.0 # Seconds between progress snapshots of a running job
+JOB_LIST_MAX = 500
+# Jobs that stopped (finished / error / cancelled / paused) stay in memory for live events and
+# quick lookups, then are dropped; the durable store keeps them (see db_utils.prune_jobs)
+JOB_MEMORY_MAX = int(os.environ.get('YTDLP_JOB_MEMORY_MAX', 100))
+JOB_MEMORY_TTL = float(os.environ.get('YTDLP_JOB_MEMORY_TTL', 3600)) # Seconds
+_job_persisted_at: Dict[str, float] = {}
+
+def model_to_dict(model: BaseModel) -> Dict:
+    return model.model_dump() if hasattr(model, 'model_dump') else model.dict()
+
+def update_job_fields(job: DownloadJob, values: Dict):
+    """
+    Set several job fields at once from a worker thread. A single dict.update runs under
+    the GIL, so a concurrent serialization (API response, persist_job, job events) sees
+    either all of the new values or none of them - never progress from one update with
+    speed from another.
+    """
+    job.__dict__.update(values)
+
+def persist_job(job: DownloadJob, req: Optional["DownloadRequest"] = None):
+    """Write a job snapshot (and its original request on first save). Blocking: call from worker threads."""
+    try:
+        db_utils.save_job(model_to_dict(job), model_to_dict(req) if req else None)
+        _job_persisted_at[job.id] = time.time()
+    except Exception as e:
+        logging.error(f"Failed to persist job {job.id}: {e}")
+
+# Pause / cancel requests for running jobs: job_id -> 'pause' | 'cancel'.
+# Thread mode: the yt-dlp progress hook raises DownloadCancelled on its next call.
+# Process mode: the worker process is killed (the pool polls job_stop_requests).
+job_stop_requests: Dict[str, str] = {}
+
+def request_job_stop(job_id: str, action: str):
+    job_stop_requests[job_id] = action
+
+def remove_job_temp_files(job_id: str):
+    """Delete a job's partial downloads (.part, .ytdl, fragments) from TEMP_DIR"""
+    try:
+        for f in os.listdir(TEMP_DIR):
+            if f.startswith(job_id):
+                try:
+                    os.remove(os.path.join(TEMP_DIR, f))
+                except Exception as e:
+                    logging.error(f"Failed to remove temp file {f}: {e}")
+    except Exception as e:
+        logging.error(f"Temp cleanup failed for job {job_id}: {e}")
+
+# Separate pools so search / info latency does not depend on download load:
+# - interactive: extraction behind user-facing requests (/info, /api/stream, /api/search)
+# - maintenance: cleanup and other background housekeeping
+# - file-io: disk writes of fallback downloads (segmented_download.py), off their event loop
+# - downloads: the scheduler below (own worker threads)
+INTERACTIVE_WORKERS = 4
+MAINTENANCE_WORKERS = 1
+FILE_IO_WORKERS = 4
+interactive_executor = MeteredExecutor("interactive", INTERACTIVE_WORKERS)
+maintenance_executor = MeteredExecutor("maintenance", MAINTENANCE_WORKERS)
+file_io_executor = MeteredExecutor("file-io", FILE_IO_WORKERS)
+
+# --- yt-dlp setup, done once ---
+# Persistent player JS / signature cache shared by every YoutubeDL (threads and worker processes)
+YTDLP_CACHE_DIR = prepare_cache_dir(os.path.join(os.path.dirname(DOWNLOAD_DIR), 'ytdlp-cache'), YTDLP_VERSION)
+
+def find_ffmpeg_location() -> Optional[str]:
+    """Directory of a bundled ffmpeg (merging / audio extraction); None = rely on PATH"""
+    for path in (os.path.join(execution_dir, 'ffmpeg.exe'),
+                 os.path.join(execution_dir, 'bin', 'ffmpeg.exe'),
+                 os.path.join(execution_dir, 'release', 'ffmpeg.exe')): # Check release folder
+        if os.path.exists(path):
+            return os.path.dirname(path)
+    return None
+
+FFMPEG_LOCATION = find_ffmpeg_location()
+
+def build_ydl_templates() -> Dict[str, Dict]:
+    """Option templates per kind of yt-dlp call. Rebuilt when cookies.txt changes."""
+    base = {'quiet': True, 'no_warnings': True, 'cachedir': YTDLP_CACHE_DIR}
+    cookie_file = os.path.join(execution_dir, "cookies.txt")
+    if os.path.exists(cookie_file):
+        base['cookiefile'] = cookie_file
+    ipv4 = {'force_ipv4': True, 'source_address': '0.0.0.0'} # Force binding to IPv4 interface
+    download = dict(base, **{
+        'writethumbnail': False,
+        'restrictfilenames': True,
+        'windowsfilenames': True,
+        'noplaylist': False,
+        # Resume <job_id>.part / fragment files left by a previous run of this job (restart recovery)
+        'continuedl': True,
+        'nocheckcertificate': True,
+        # Ranged requests for plain HTTP(S) media: large single responses get throttled (YouTube)
+        'http_chunk_size': 10 * 1024 * 1024,
+        # 'extractor_args': {'youtube': {'player_client': ['tv']}},
+    })
+    if FFMPEG_LOCATION:
+        download['ffmpeg_location'] = FFMPEG_LOCATION
+    return {
+        'extract': base,
+        'extract_ipv4': dict(base, **ipv4),
+        # Prioritize progressive HTTP streams (mp4) which are playable in browser <video>
+        'stream': dict(base, format='best[protocol^=http][ext=mp4]/best[protocol^=http]/best[ext=mp4]/best', **ipv4),
+        'search': {
+            'quiet': True,
+            'cachedir': YTDLP_CACHE_DIR,
+            'extract_flat': 'in_playlist', # Better for search results
+            'default_search': 'ytsearch10',
+            'noplaylist': True,
+        },
+        # Playlist enumeration: entry URLs and titles only, one child job per entry downloads them
+        'playlist': dict(base, extract_flat='in_playlist', noplaylist=False, ignoreerrors=True),
+        'download': download,
+    }
+
+ydl_templates = build_ydl_templates()
+YDL_POOL_SIZE = INTERACTIVE_WORKERS
+ydl_pools = {name: YoutubeDLPool(name, lambda name=name: dict(ydl_templates[name]), yt_dlp.YoutubeDL, YDL_POOL_SIZE)
+             for name in ('extract', 'extract_ipv4', 'stream', 'search')}
+
+def refresh_ydl_templates():
+    """After cookies.txt changed: new templates, and no pooled instance with the old cookies is reused"""
+    global ydl_templates
+    ydl_templates = build_ydl_templates()
+    for pool in ydl_pools.values():
+        pool.reset()
+
+def warm_up_ydl_pools():
+    """Build a YoutubeDL per pool with the YouTube extractor loaded, ahead of the first request"""
+    for pool in ydl_pools.values():
+        try:
+            pool.warm_up(1, prepare=lambda ydl: ydl.get_info_extractor('Youtube'))
+        except Exception as e:
+            logging.warning(f"YoutubeDL warm-up failed for {pool.name}: {e}")
+
+# Shared extraction cache for /info, /api/stream, /api/search and downloads (see metadata_cache.py).
+# Single videos are cached as yt-dlp's raw extractor result (before format selection); each caller
+# applies its own options with process_ie_result, which needs no extraction round trip.
+# Stream URLs are signed: entries expire before the URLs inside them do.
+metadata_cache = MetadataCache(max_entries=int(os.environ.get('YTDLP_INFO_CACHE_ENTRIES', 500)),
+                               max_bytes=int(os.environ.get('YTDLP_INFO_CACHE_MB', 64)) * 1024 * 1024)
+INFO_CACHE_TTL = 1800 # Seconds, upper bound
+SEARCH_CACHE_TTL = 600
+
+def load_raw_info(url: str, force_ipv4: bool):
+    # Stream URLs are bound to the extracting address; /api/stream fetches them over IPv4
+    with ydl_pools['extract_ipv4' if force_ipv4 else 'extract'].acquire() as ydl:
+        raw = ydl.extract_info(url, download=False, process=False)
+    if not raw or raw.get('_type', 'video') != 'video':
+        return None, 0 # Playlists / redirects are not cached; callers extract them normally
+    return raw, info_ttl(raw, INFO_CACHE_TTL)
+
+def fetch_raw_info(url: str, force_ipv4: bool = False, executor=None):
+    """Future of the cached raw info for url (None if not cacheable)"""
+    return metadata_cache.fetch(('info', url, force_ipv4), lambda: load_raw_info(url, force_ipv4), executor)
+
+def process_raw_info(raw: Optional[Dict], url: str, ydl, download: bool = False) -> Dict:
+    """Format selection (and the download, if asked) for a cached raw result with ydl's options. Blocking."""
+    if raw is None:
+        return ydl.extract_info(url, download=download)
+    try:
+        return ydl.process_ie_result(copy.deepcopy(raw), download=download)
+    except yt_dlp.utils.ExtractorError as e:
+        # extract_info reports these as DownloadError; callers match on that
+        raise yt_dlp.utils.DownloadError(str(e), sys.exc_info()) from e
+
+def process_with_pool(raw: Optional[Dict], url: str, pool_name: str) -> Dict:
+    with ydl_pools[pool_name].acquire() as ydl:
+        return process_raw_info(raw, url, ydl)
+
+async def extract_info_cached(url: str, pool_name: str) -> Dict:
+    """Info for url, formats selected with the options of ydl_pools[pool_name]"""
+    raw = await asyncio.wrap_future(fetch_raw_info(url, pool_name == 'stream', interactive_executor))
+    return await interactive_executor.run(process_with_pool, raw, url, pool_name)
+
+# Downloads go through the fair-share scheduler (per-role lanes, per-person concurrency cap)
+DOWNLOAD_WORKERS = 2
+download_scheduler = DownloadScheduler(LIMITS, workers=DOWNLOAD_WORKERS)
+download_processes = DownloadProcessPool(DOWNLOAD_WORKERS) if DOWNLOAD_PROCESSES else None
+
+def fair_share_owner(job: DownloadJob) -> str:
+    """Who a job counts against for fair share. The shared 'user' account is split per client."""
+    if job.username and job.priority != 'user':
+        return job.username
+    return f"{job.username or 'guest'}@{job.client_id or job.client_ip}"
+
+# DASH / HLS fragment threads per site, adapted from the throughput of earlier downloads
+fragment_concurrency = FragmentConcurrency()
+
+# Failed attempts are classified and recovered by the cheapest action of their class (retry_policy.py);
+# outcome counters per class and action are kept in the durable store
+download_retries = RetryPolicy()
+# More generic selectors tried, in order, on format errors (the extracted info is reused); per request type
+RELAXED_FORMATS = {
+    'video': ('bestvideo*+bestaudio/best', 'best'),
+    'audio': ('bestaudio*', 'best'), # Audio of any stream (video included); FFmpegExtractAudio still applies
+}
+
+def schedule_download(job: DownloadJob, req: "DownloadRequest"):
+    download_scheduler.submit(job.id, fair_share_owner(job), job.priority, run_download, job.id, req)
+    publish_queue()
+
+# Identical submissions (same normalized URL and effective options) share one transfer
+download_coalescer = DownloadCoalescer()
+MIRRORED_JOB_FIELDS = ('status', 'progress', 'speed', 'eta', 'filename', 'title', 'error_msg', 'downloaded_bytes',
+                       'total_bytes', 'speed_bps', 'eta_seconds', 'queue_position', 'estimated_start',
+                       'entries_total', 'entries_finished', 'entries_failed')
+
+def mirror_job(follower: DownloadJob, leader: DownloadJob):
+    update_job_fields(follower, {field: getattr(leader, field) for field in MIRRORED_JOB_FIELDS})
+
+def submit_download(job: DownloadJob, req: "DownloadRequest"):
+    """Schedule a job, or attach it to a queued / running job for the same download"""
+    leader_id = download_coalescer.claim(coalesce_key(req.url, effective_download_options(req)), job, req)
+    job.mirror_of = leader_id
+    if leader_id is None:
+        schedule_download(job, req)
+        return
+    leader = jobs.get(leader_id)
+    if leader:
+        mirror_job(job, leader)
+    logging.info(f"Job {job.id} attached to running job {leader_id} ({req.url})")
+
+def detach_follower(job: DownloadJob) -> bool:
+    """Stop mirroring a leader. True if the job was attached (it has no transfer of its own)."""
+    if not job.mirror_of:
+        return False
+    download_coalescer.detach(job.id)
+    job.mirror_of = None
+    return True
+
+def settle_followers(leader: DownloadJob, filenames: Optional[List[str]] = None):
+    """Close the leader's flight once it stopped. Followers share a finished or failed result
+    (and become owners of its files); if the leader was paused, cancelled or deleted they are
+    submitted again on their own. Blocking: call from worker threads."""
+    followers = download_coalescer.release(leader.id)
+    shared = jobs.get(leader.id) is leader and leader.status in (JobStatus.FINISHED, JobStatus.ERROR)
+    for follower, req in followers:
+        if jobs.get(follower.id) is not follower:
+            continue # Deleted meanwhile
+        if not shared:
+            update_job_fields(follower, {'status': JobStatus.QUEUED, 'speed': None, 'eta': None,
+                                         'speed_bps': None, 'eta_seconds': None})
+            submit_download(follower, req)
+            persist_job(follower)
+            publish_job(follower, force=True)
+            continue
+        mirror_job(follower, leader)
+        follower.mirror_of = None
+        if leader.status == JobStatus.FINISHED and follower.username:
+            for fname in filenames or [leader.filename]:
+                db_utils.add_file_owner(fname, follower.username)
+            add_notification(follower.username, f"ダウンロードが完了しました: {leader.title or leader.filename}", "success")
+        persist_job(follower)
+        publish_job(follower, force=True)
+        retire_job(follower)
+        track_playlist_entry(follower, settled=True)
+
+# --- Playlists ---
+# A playlist job enumerates its entries (flat extraction), then each entry is queued as a
+# child job of its own, so entries download in parallel across the worker pool and one
+# failed entry does not stop the others. The parent holds no worker while its entries run.
+# parent job id -> (parent job, PlaylistProgress), until the playlist ends
+playlists: Dict[str, tuple] = {}
+_playlists_lock = threading.Lock()
+
+def is_playlist_url(url: str) -> bool:
+    # Only explicit playlist pages: watch?v=...&list=... downloads the single video
+    return "playlist?list=" in url
+
+def register_playlist(parent: DownloadJob, children: List[DownloadJob]):
+    playlists[parent.id] = (parent, PlaylistProgress(parent.child_ids))
+    for child in children:
+        track_playlist_entry(child, settled=True)
+
+def track_playlist_entry(child: DownloadJob, settled: bool = False, status: Optional[str] = None):
+    """Fold a child job's state into its playlist parent. Stopped states only count once the
+    worker or endpoint is done with the child (`settled`): yt-dlp reports 'finished' per
+    stream, before the files are moved."""
+    entry = playlists.get(child.parent_id) if child.parent_id else None
+    if entry is None:
+        return
+    parent, tracker = entry
+    status = status or child.status
+    if status in RESTING_JOB_STATUSES and not settled:
+        status = JobStatus.DOWNLOADING
+    summary = tracker.update(child.id, status, child.progress, child.speed_bps, child.filename)
+    if summary is None:
+        return
+    filenames = tracker.filenames()
+    with _playlists_lock:
+        if playlists.get(parent.id) is not entry:
+            return # Ended or deleted meanwhile
+        previous = parent.status
+        update_job_fields(parent, dict(summary, speed=format_speed(summary['speed_bps']),
+                                       filename=filenames[0] if filenames else None))
+        if summary['status'] in ENDED_JOB_STATUSES:
+            playlists.pop(parent.id, None)
+    changed = summary['status'] != previous
+    if changed and previous == JobStatus.PAUSED:
+        jobs.setdefault(parent.id, parent) # Resumed after it was evicted from memory
+    publish_job(parent, force=changed)
+    if changed:
+        maintenance_executor.submit(settle_playlist, parent, filenames)
+
+def settle_playlist(parent: DownloadJob, filenames: List[str]):
+    """Persist a playlist's new state; once it stopped, retire it and settle its followers. Blocking."""
+    if jobs.get(parent.id) is not parent:
+        return # Deleted meanwhile
+    persist_job(parent)
+    if parent.status not in RESTING_JOB_STATUSES:
+        return
+    retire_job(parent)
+    settle_followers(parent, filenames)
+    if parent.status == JobStatus.FINISHED and parent.username:
+        add_notification(parent.username, f"プレイリストのダウンロードが完了しました: {parent.title or parent.url} "
+                                          f"({parent.entries_finished}/{parent.entries_total})", "success")
+
+async def playlist_children(parent: DownloadJob) -> List[DownloadJob]:
+    children = []
+    for child_id in parent.child_ids or ():
+        child = jobs.get(child_id)
+        if child is None:
+            data = await async_db.get_job(child_id)
+            child = DownloadJob(**data) if data else None
+        if child:
+            children.append(child)
+    return children
+
+async def ensure_playlist(job: DownloadJob) -> DownloadJob:
+    """Live parent object of a playlist job, with its aggregate loaded (after a restart or eviction)"""
+    entry = playlists.get(job.id)
+    if entry:
+        parent = entry[0]
+    else:
+        parent = job
+        register_playlist(parent, await playlist_children(parent))
+    jobs[parent.id] = parent
+    return parent
+
+# --- Job events (/api/events) ---
+# Each 'job' event carries only the fields that changed since the previous one for that job
+# (the first event for a job is a full snapshot). Progress-only updates are throttled per job.
+JOB_EVENT_INTERVAL = 0.5 # Seconds
+_job_snapshots: Dict[str, Dict] = {}
+_job_published_at: Dict[str, float] = {}
+_job_events_lock = threading.Lock()
+
+def publish_job(job: DownloadJob, force: bool = False):
+    now = time.time()
+    with _job_events_lock:
+        if not force and now - _job_published_at.get(job.id, 0) < JOB_EVENT_INTERVAL:
+            return
+        snapshot = model_to_dict(job)
+        previous = _job_snapshots.get(job.id)
+        if previous is None:
+            delta = snapshot
+        else:
+            delta = {k: v for k, v in snapshot.items() if previous.get(k) != v}
+            if not delta:
+                return
+            delta['id'] = job.id
+        _job_snapshots[job.id] = snapshot
+        _job_published_at[job.id] = now
+        # Publish under the lock so deltas for one job keep their order
+        event_bus.publish('job', delta, username=job.username)
+    for follower in download_coalescer.followers(job.id):
+        mirror_job(follower, job)
+        publish_job(follower, force=True)
+    if job.parent_id:
+        track_playlist_entry(job)
+
+def publish_job_deleted(job_id: str):
+    with _job_events_lock:
+        _job_snapshots.pop(job_id, None)
+        _job_published_at.pop(job_id, None)
+        event_bus.publish('job', {'id': job_id, 'deleted': True})
+
+# --- In-memory job retention ---
+# job_id -> time it stopped, oldest first
+_resting_jobs: "OrderedDict[str, float]" = OrderedDict()
+_resting_jobs_lock = threading.Lock()
+
+def retire_job(job: DownloadJob):
+    """Call once a job's final state has been persisted"""
+    with _resting_jobs_lock:
+        _resting_jobs.pop(job.id, None)
+        _resting_jobs[job.id] = time.time()
+    evict_resting_jobs()
+
+def evict_resting_jobs():
+    """Drop the oldest stopped jobs beyond JOB_MEMORY_MAX or older than JOB_MEMORY_TTL from `jobs`.
+    They stay readable through the durable store. Cost is proportional to the jobs evicted."""
+    now = time.time()
+    expired = []
+    with _resting_jobs_lock:
+        while _resting_jobs:
+            job_id, stopped_at = next(iter(_resting_jobs.items()))
+            if len(_resting_jobs) <= JOB_MEMORY_MAX and now - stopped_at < JOB_MEMORY_TTL:
+                break
+            _resting_jobs.popitem(last=False)
+            expired.append(job_id)
+    for job_id in expired:
+        job = jobs.get(job_id)
+        if job is None or job.status not in RESTING_JOB_STATUSES:
+            continue # Deleted, or resumed meanwhile
+        jobs.pop(job_id, None)
+        with _job_events_lock:
+            _job_snapshots.pop(job_id, None)
+            _job_published_at.pop(job_id, None)
+
+def publish_queue():
+    """Queue positions / ETAs of every queued job shift whenever the queue changes"""
+    queued = [j for j in list(jobs.values()) if j.status == JobStatus.QUEUED]
+    for job in apply_queue_estimates(queued):
+        publish_job(job, force=True)
+
+def apply_queue_estimates(job_list: List[DownloadJob]) -> List[DownloadJob]:
+    """Fill queue_position / estimated_start on queued jobs"""
+    estimates = download_scheduler.estimates()
+    for job in job_list:
+        if (job.mirror_of or job.id) in estimates:
+            job.queue_position, job.estimated_start = estimates[job.mirror_of or job.id]
+    return job_list
 
 class DownloadRequest(BaseModel):
     url: str
@@ -434,28 +957,118 @@ class DownloadRequest(BaseModel):
     subtitles_lang: str = "ja"
     embed_subtitles: bool = True
 
-def progress_hook(d, job_id):
-    """yt-dlp progress hook"""
+def download_format_options(req: DownloadRequest) -> Dict:
+    """yt-dlp options that decide what file a request produces"""
+    opts = {}
+    if req.subtitles:
+        opts.update({
+            'writesubtitles': True,
+            'writeautomaticsub': True,
+            'subtitleslangs': [req.subtitles_lang],
+            'embedsubtitles': req.embed_subtitles,
+        })
+    if req.type == 'audio':
+        opts['format'] = 'bestaudio/best'
+        opts['postprocessors'] = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': req.audio_format,
+            'preferredquality': '192',
+        }]
+    else:
+        # Video format - Try best quality merge first, then best single file, then separate bests
+        # If ffmpeg is missing, merge will fail, but /best should handle it fallback
+        opts['format'] = 'bestvideo+bestaudio/best'
+        opts['format_sort'] = ['res', 'ext:mp4:m4a']
+    return opts
+
+def effective_download_options(req: DownloadRequest) -> Dict:
+    """Request fields that actually change the result (quality is not applied by the format
+    selection above, audio_format only matters for audio, subtitle settings only with subtitles)"""
+    opts = {'type': req.type, 'format': download_format_options(req)['format']}
+    if req.type == 'audio':
+        opts['audio_format'] = req.audio_format
+    if req.subtitles:
+        opts['subtitles'] = f"{req.subtitles_lang}:{'embed' if req.embed_subtitles else 'file'}"
+    return opts
+
+# --- Library index (db_utils.library_index) ---
+# A repeat download of a video that is already in DOWNLOAD_DIR in the same format finishes
+# by adding an owner to the stored file, without any network transfer.
+
+def library_signature(req: DownloadRequest) -> str:
+    return json.dumps(effective_download_options(req), sort_keys=True)
+
+@lru_cache(maxsize=1024)
+def identify_media(url: str) -> Optional[tuple]:
+    """(extractor key, video id) from the URL alone, the way yt-dlp picks its extractor. No network access."""
+    for ie in gen_extractor_classes():
+        if ie.ie_key() == 'Generic':
+            continue
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            return (ie.ie_key(), str(video_id)) if video_id else None
+    return None
+
+def library_filename(path: str) -> Optional[str]:
+    """Indexed name of a path, if it is a file directly in DOWNLOAD_DIR"""
+    path = os.path.abspath(path)
+    if os.path.dirname(path) != os.path.abspath(DOWNLOAD_DIR):
+        return None
+    return os.path.basename(path)
+
+def find_in_library(extractor: str, video_id: str, signature: str) -> Optional[Dict]:
+    """Stored file for this media + format. Entries whose file vanished or changed size are dropped."""
+    stored = db_utils.find_library_file(extractor, video_id, signature)
+    if not stored:
+        return None
+    try:
+        if os.path.getsize(os.path.join(DOWNLOAD_DIR, stored['filename'])) == stored['size']:
+            return stored
+    except OSError:
+        pass
+    db_utils.remove_library_file(stored['filename'])
+    return None
+
+def finish_from_library(job: DownloadJob, stored: Dict) -> List[str]:
+    update_job_fields(job, {'filename': stored['filename'], 'title': stored['title'] or job.title, 'progress': 100,
+                            'downloaded_bytes': stored['size'], 'total_bytes': stored['size'],
+                            'status': JobStatus.FINISHED})
+    logging.info(f"Job {job.id} served from library: {stored['filename']}")
+    details = f"Download Finished (library): {job.title or job.url} ({job.filename})"
+    if job.username:
+        db_utils.add_file_owner(job.filename, job.username)
+        add_notification(job.username, f"ダウンロードが完了しました: {job.title or job.filename}", "success")
+        details += f" User: {job.username}"
+    if job.client_id:
+        details += f" CID: {job.client_id}"
+    db_utils.log_event(job.client_ip or "unknown", "DOWNLOAD", details, job.username)
+    return [job.filename]
+
+def progress_hook(d, job: DownloadJob, tracker: ProgressTracker):
+    """yt-dlp progress hook. Counters go into the job's tracker; the job itself is only
+    updated (and persisted / published) when the tracker hands out a snapshot."""
     if d['status'] == 'downloading':
-        job = jobs.get(job_id)
-        if job:
-            # Calculate progress percentage
-            total = d.get('total_bytes') or d.get('total_bytes_estimate')
-            downloaded = d.get('downloaded_bytes', 0)
-            if total:
-                job.progress = round((downloaded / total) * 100, 1)
-            
-            job.status = JobStatus.DOWNLOADING
-            job.speed = d.get('_speed_str')
-            job.eta = d.get('_eta_str')
-            job.filename = os.path.basename(d.get('filename', ''))
+        snapshot = tracker.update(d)
+        status_changed = job.status != JobStatus.DOWNLOADING
+        if snapshot is None:
+            if not status_changed:
+                return
+            snapshot = tracker.snapshot()
+        if jobs.get(job.id) is not job:
+            return # Deleted meanwhile
+        snapshot['status'] = JobStatus.DOWNLOADING
+        update_job_fields(job, snapshot)
+
+        if status_changed or time.time() - _job_persisted_at.get(job.id, 0) > JOB_PERSIST_INTERVAL:
+            persist_job(job)
+        publish_job(job, force=status_changed)
             
     elif d['status'] == 'finished':
-        job = jobs.get(job_id)
-        if job:
-            job.progress = 100
-            job.status = JobStatus.FINISHED
-            job.filename = os.path.basename(d.get('filename', ''))
+        tracker.update(d)
+        if jobs.get(job.id) is job:
+            snapshot = tracker.snapshot()
+            snapshot.update(progress=100, status=JobStatus.FINISHED, eta=None, eta_seconds=None)
+            update_job_fields(job, snapshot)
             
             # Log successful download
             details = f"Download Finished: {job.title or job.url} ({job.filename})"
@@ -471,14 +1084,121 @@ def progress_hook(d, job_id):
             
             if job.client_id:
                  details += f" CID: {job.client_id}"
+            publish_job(job, force=True)
             
-            db_utils.log_event(job.client_ip or "unknown", "DOWNLOAD", details)
+            db_utils.log_event(job.client_ip or "unknown", "DOWNLOAD", details, job.username)
+
+def stoppable_progress_hook(d, job: DownloadJob, tracker: ProgressTracker):
+    """Thread-mode hook: aborts the transfer once pause/cancel is requested"""
+    if job.id in job_stop_requests:
+        raise yt_dlp.utils.DownloadCancelled(job_stop_requests[job.id])
+    progress_hook(d, job, tracker)
 
 def run_download(job_id: str, req: DownloadRequest):
     """Execute download in thread pool"""
     job = jobs.get(job_id)
     if not job:
         return
+    job.queue_position = None
+    job.estimated_start = None
+    publish_queue()
+    filenames = None
+    try:
+        if is_playlist_url(req.url):
+            filenames = run_playlist(job, req)
+        else:
+            filenames = _run_download(job, req)
+    finally:
+        job_stop_requests.pop(job_id, None)
+        # Final state (finished / error / paused / cancelled) must reach the durable store,
+        # unless the job was deleted meanwhile
+        if jobs.get(job_id) is job:
+            persist_job(job)
+            publish_job(job, force=True)
+            if job.status in RESTING_JOB_STATUSES:
+                retire_job(job)
+        # A playlist whose entries were queued settles when its last entry stops (settle_playlist)
+        if jobs.get(job_id) is not job or not job.child_ids:
+            settle_followers(job, filenames)
+        track_playlist_entry(job, settled=True)
+        _job_persisted_at.pop(job_id, None)
+        publish_queue()
+
+def run_playlist(job: DownloadJob, req: DownloadRequest):
+    """Enumerate a playlist (up to the role's playlist_limit entries) and queue one child job
+    per entry. The parent stays 'downloading' and follows its entries (track_playlist_entry)."""
+    limit = LIMITS.get(job.priority, LIMITS['user'])['playlist_limit']
+    update_job_fields(job, {'status': JobStatus.DOWNLOADING})
+    publish_job(job, force=True)
+    logging.info(f"Playlist job {job.id}: enumerating {req.url} (limit {limit})")
+    try:
+        with yt_dlp.YoutubeDL(dict(ydl_templates['playlist'], playlistend=limit)) as ydl:
+            info = ydl.extract_info(req.url, download=False) or {}
+    except Exception as e:
+        job.status = JobStatus.ERROR
+        job.error_msg = f"Playlist enumeration failed: {e}"
+        logging.error(f"Job {job.id}: {job.error_msg}")
+        return None
+    if job.id in job_stop_requests:
+        job.status = JobStatus.PAUSED if job_stop_requests[job.id] == 'pause' else JobStatus.CANCELLED
+        return None
+
+    children = []
+    for entry in (info.get('entries') or [])[:limit]:
+        url = entry and (entry.get('webpage_url') or entry.get('url'))
+        if not url or not url.startswith('http'):
+            continue
+        child_req = DownloadRequest(**dict(model_to_dict(req), url=url))
+        children.append((DownloadJob(id=str(uuid.uuid4()), url=url, status=JobStatus.QUEUED, created_at=time.time(),
+                                     title=entry.get('title'), client_ip=job.client_ip, username=job.username,
+                                     client_id=job.client_id, priority=job.priority, parent_id=job.id), child_req))
+    if not children:
+        job.status = JobStatus.ERROR
+        job.error_msg = "Playlist has no downloadable entries"
+        return None
+
+    update_job_fields(job, {'title': info.get('title') or job.title, 'child_ids': [c.id for c, _ in children],
+                            'entries_total': len(children), 'entries_finished': 0, 'entries_failed': 0})
+    register_playlist(job, [])
+    for child, child_req in children:
+        jobs[child.id] = child
+        persist_job(child, child_req)
+        submit_download(child, child_req)
+        if child.mirror_of:
+            persist_job(child)
+        publish_job(child, force=True)
+    logging.info(f"Playlist job {job.id}: queued {len(children)} entries")
+    return None
+
+def can_recover(action: str, ydl_opts: Dict, req_type: str = 'video') -> bool:
+    """Whether a recovery action of retry_policy still has something to try for these options"""
+    if action == retry_policy.REFORMAT:
+        return ydl_opts.get('format') != RELAXED_FORMATS.get(req_type, RELAXED_FORMATS['video'])[-1]
+    if action == retry_policy.COOKIES:
+        # Only with cookies.txt in use, and never as a service (no browser profile to read)
+        return 'cookiefile' in ydl_opts and 'systemprofile' not in os.path.expanduser('~').lower()
+    return True
+
+def apply_recovery(action: str, ydl_opts: Dict, req_type: str = 'video'):
+    """Change the options of the next attempt for a recovery action (in place)"""
+    if action == retry_policy.REFORMAT:
+        ladder = RELAXED_FORMATS.get(req_type, RELAXED_FORMATS['video'])
+        current = ydl_opts.get('format')
+        rung = ladder.index(current) + 1 if current in ladder else 0
+        ydl_opts['format'] = ladder[rung]
+        ydl_opts.pop('format_sort', None)
+    elif action == retry_policy.COOKIES:
+        del ydl_opts['cookiefile']
+        ydl_opts['cookiesfrombrowser'] = ('chrome', 'edge') # Firefox left out (keyring issues)
+
+def settle_retries(session, success: bool):
+    """Record what a download's last recovery action led to, and persist the counters"""
+    if session.settle(success):
+        maintenance_executor.submit(db_utils.save_retry_outcomes, download_retries.rows())
+
+def _run_download(job: DownloadJob, req: DownloadRequest):
+    job_id = job.id
+    tracker = ProgressTracker(PROGRESS_UPDATES_PER_SECOND)
 
     # Determine rate limit based on user role
     limit_rate = None
@@ -502,126 +1222,93 @@ def run_download(job_id: str, req: DownloadRequest):
     
     # Use TEMP_DIR for downloading
     # Use job_id as filename to avoid ambiguity and encoding issues during download
-    ydl_opts = {
+    # Shared settings (cache dir, cookies.txt, ffmpeg) come from the template built at startup
+    ydl_opts = dict(ydl_templates['download'], **{
         'outtmpl': os.path.join(TEMP_DIR, f'{job_id}.%(ext)s'),
-        'quiet': True,
-        'no_warnings': True,
-        'progress_hooks': [lambda d: progress_hook(d, job_id)],
-        'writethumbnail': False,
-        'restrictfilenames': True, 
-        'windowsfilenames': True,
-        'noplaylist': False,
-        # Improve stability
-        'cachedir': False, 
-        'nocheckcertificate': True,
-        # 'extractor_args': {'youtube': {'player_client': ['tv']}},
-    }
-    
-    # Cookie handling: Prioritize cookies.txt
-    cookies_path = os.path.join(execution_dir, 'cookies.txt')
-    if os.path.exists(cookies_path):
-        ydl_opts['cookiefile'] = cookies_path
+        'progress_hooks': [lambda d: stoppable_progress_hook(d, job, tracker)],
+    })
     
     # NOTE: "cookiesfrombrowser" removed to prevent errors on servers/services without browser profiles.
     # Users must provide cookies.txt if cookies are needed.
     
+    # Fragment threads learned per site; yt-dlp rate-limits each connection, so the cap is split
+    # over the threads, once the selected format turns out to be fragmented (FragmentRateLimit)
+    site = site_key(req.url)
+    fragments = fragment_concurrency.choose(site, limit_rate)
+    throttle_log = ThrottleLogger()
+    ydl_opts['concurrent_fragment_downloads'] = fragments
+    ydl_opts['logger'] = throttle_log
+    job.fragment_concurrency = fragments
+
     if limit_rate:
-        ydl_opts['ratelimit'] = limit_rate
+        ydl_opts.update(ratelimit=limit_rate, fragment_ratelimit=max(1, limit_rate // fragments))
 
-    # Subtitle options
-    if req.subtitles:
-        ydl_opts.update({
-            'writesubtitles': True,
-            'writeautomaticsub': True,
-            'subtitleslangs': [req.subtitles_lang],
-            'embedsubtitles': req.embed_subtitles,
-        })
+    # Format and subtitle options
+    ydl_opts.update(download_format_options(req))
 
-    # Check for cookies.txt (Overrides browser cookies)
-    cookie_file = os.path.join(execution_dir, "cookies.txt")
-    if os.path.exists(cookie_file):
-        ydl_opts['cookiefile'] = cookie_file
-        logging.info(f"Using cookies from {cookie_file}")
-        if 'cookiesfrombrowser' in ydl_opts:
-            del ydl_opts['cookiesfrombrowser'] # Priority to file
-
-    # Playlist handling logic
-    if "playlist?list=" in req.url:
-        logging.info(f"Explicit playlist URL detected: {req.url}. Enabling playlist mode (limit 10).")
-        ydl_opts['noplaylist'] = False
-        ydl_opts['ignoreerrors'] = True
-        ydl_opts['playlistend'] = 10
-        # For playlist, we need unique filenames
-        ydl_opts['outtmpl'] = os.path.join(TEMP_DIR, f'{job_id}_%(playlist_index)s.%(ext)s')
-    elif "list=" in req.url:
+    # Explicit playlist URLs are fanned out by run_playlist
+    if "list=" in req.url:
         logging.info(f"URL contains list parameter but treated as single video: {req.url}")
 
-    # Locate FFmpeg to ensure merging works
-    ffmpeg_path = None
-    possible_ffmpeg_paths = [
-        os.path.join(execution_dir, 'ffmpeg.exe'),
-        os.path.join(execution_dir, 'bin', 'ffmpeg.exe'),
-        os.path.join(execution_dir, 'release', 'ffmpeg.exe'), # Check release folder
-        "ffmpeg" # System path fallback
-    ]
-    for path in possible_ffmpeg_paths:
-        if path == "ffmpeg" or os.path.exists(path):
-            ffmpeg_path = path
-            break
-            
-    if ffmpeg_path and ffmpeg_path != "ffmpeg":
-         ydl_opts['ffmpeg_location'] = os.path.dirname(ffmpeg_path)
-
-    # Format selection
-    if req.type == 'audio':
-        ydl_opts['format'] = 'bestaudio/best'
-        ydl_opts['postprocessors'] = [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': req.audio_format,
-            'preferredquality': '192',
-        }]
-    else:
-        # Video format - Try best quality merge first, then best single file, then separate bests
-        # If ffmpeg is missing, merge will fail, but /best should handle it fallback
-        ydl_opts['format'] = 'bestvideo+bestaudio/best'
-        ydl_opts['format_sort'] = ['res', 'ext:mp4:m4a']
+    # Same video already stored in this format: link it instead of downloading
+    media = identify_media(req.url)
+    if media:
+        stored = find_in_library(*media, library_signature(req))
+        if stored:
+            return finish_from_library(job, stored)
 
+    retries = download_retries.session()
     try:
         # Wrapper to allow retry logic
         def attempt_download(opts):
+            if job_id in job_stop_requests:
+                raise yt_dlp.utils.DownloadCancelled(job_stop_requests[job_id])
+            if download_processes:
+                return download_processes.run(job_id, req.url, opts, lambda d: progress_hook(d, job, tracker), DOWNLOAD_TIMEOUT,
+                                              should_stop=lambda: job_stop_requests.get(job_id))
+            if 'cookiesfrombrowser' in opts:
+                # Retry with other credentials: extract again
+                with yt_dlp.YoutubeDL(opts) as ydl:
+                    return split_rate_limit(ydl).extract_info(req.url, download=True)
+            # Reuses the extraction of a recent /info or identical download
+            raw = fetch_raw_info(req.url).result()
             with yt_dlp.YoutubeDL(opts) as ydl:
-                 return ydl.extract_info(req.url, download=True)
+                return process_raw_info(raw, req.url, split_rate_limit(ydl), download=True)
 
-        try:
-            info = attempt_download(ydl_opts)
-        except yt_dlp.utils.DownloadError as e:
-            err_msg = str(e)
-            
-            if "Requested format is not available" in err_msg:
-                logging.warning("Requested format unavailable. Retrying with generic 'best' format...")
-                ydl_opts['format'] = 'best'
-                if 'format_sort' in ydl_opts:
-                    del ydl_opts['format_sort']
+        while True:
+            try:
                 info = attempt_download(ydl_opts)
+                settle_retries(retries, True)
+                break
+            except (DownloadCancelled, yt_dlp.utils.DownloadCancelled, DownloadTimeout):
+                raise
+            except Exception as e:
+                step = retries.next_step(e, can=lambda action: can_recover(action, ydl_opts, req.type))
+                logging.warning(f"Job {job_id}: {step.error_class} error ({e}). Next: {step.action}"
+                                + (f" in {step.delay:.0f}s" if step.delay else ""))
+                if step.action in retry_policy.TERMINAL_ACTIONS:
+                    raise
+                if step.action == retry_policy.REFRESH:
+                    # Signed URLs may be burnt: extract again, with fewer fragment threads
+                    metadata_cache.purge(lambda key: key[1] == req.url)
+                    fragment_concurrency.report(site, fragments, throttled=True)
+                    fragments = fragment_concurrency.choose(site, limit_rate)
+                    throttle_log = ThrottleLogger()
+                    ydl_opts.update(concurrent_fragment_downloads=fragments, logger=throttle_log)
+                    if limit_rate:
+                        ydl_opts['fragment_ratelimit'] = max(1, limit_rate // fragments)
+                    job.fragment_concurrency = fragments
+                apply_recovery(step.action, ydl_opts, req.type)
+                # A pause / cancel during the wait is raised by the next attempt
+                retry_policy.sleep(step.delay, lambda: job_stop_requests.get(job_id))
+
+        # Throughput only from uninterrupted transfers: the tracker's span would include the waits
+        # of BACKOFF / REFRESH (REFRESH already reported the throttling)
+        waited = any(s.action in (retry_policy.BACKOFF, retry_policy.REFRESH) for s in retries.steps)
+        if uses_fragments(info) and not waited:
+            fragment_concurrency.report(site, fragments, *tracker.transfer(), throttled=throttle_log.throttles > 0,
+                                        cap_bps=limit_rate)
 
-            elif ("Sign in to confirm" in err_msg or "downloaded file is empty" in err_msg) and 'cookiefile' in ydl_opts:
-                logging.warning(f"Download error detected ({err_msg}). Retrying with browser cookies (Chrome/Edge)...")
-                # Fallback: Remove file and use browser. Removed Firefox to avoid keyring issues.
-                try: 
-                    # Only attempt if not running as system/service to avoid crash
-                    if 'systemprofile' not in os.path.expanduser('~').lower():
-                        del ydl_opts['cookiefile']
-                        ydl_opts['cookiesfrombrowser'] = ('chrome', 'edge')
-                        info = attempt_download(ydl_opts)
-                    else:
-                        logging.error("Cannot use browser cookies in system profile. Please check cookies.txt.")
-                        raise e
-                except Exception as ex:
-                    logging.error(f"Browser cookie fallback failed: {ex}")
-                    raise e
-            else:
-                raise e
-            
         # Update title from final info
         channel_name = 'UnknownChannel'
         if info:
@@ -696,54 +1383,163 @@ def run_download(job_id: str, req: DownloadRequest):
                 # Handle bulk parts if distinct? Assuming single file or playlist.
                 for fname in final_filenames[1:]:
                     db_utils.add_file_owner(fname, job.username)
+
+        # Index single-video results under the ids yt-dlp reported
+        if info and len(final_filenames) == 1 and info.get('extractor_key') and info.get('id'):
+            size = os.path.getsize(os.path.join(DOWNLOAD_DIR, job.filename))
+            db_utils.index_library_file(info['extractor_key'], str(info['id']), library_signature(req), job.filename, job.title, size)
+        return final_filenames
         
+    except (DownloadCancelled, yt_dlp.utils.DownloadCancelled):
+        # Paused or cancelled by the user: no fallback
+        job.speed = job.speed_bps = None
+        job.eta = job.eta_seconds = None
+        if job_stop_requests.get(job_id) == 'pause':
+            job.status = JobStatus.PAUSED
+            logging.info(f"Job {job_id} paused")
+        else:
+            job.status = JobStatus.CANCELLED
+            remove_job_temp_files(job_id)
+            logging.info(f"Job {job_id} cancelled")
+    except DownloadTimeout as e:
+        # Worker process was killed on purpose: no fallback
+        job.status = JobStatus.ERROR
+        job.error_msg = str(e)
+        logging.warning(f"Job {job_id} stopped: {e}")
     except Exception as e:
+        if throttle_log.throttles or is_throttle_error(str(e)):
+            fragment_concurrency.report(site, fragments, throttled=True)
+        if retries.pending and retries.pending.action == retry_policy.FAIL:
+            # Removed / private / unsupported: the fallback chain would not find it either
+            settle_retries(retries, False)
+            job.status = JobStatus.ERROR
+            job.error_msg = f"Download Failed: {e}"
+            return
         # Fallback attempt
         logging.error(f"yt-dlp failed: {e}. Attempting Fallback...")
         
-        # Since we are in a ThreadPoolExecutor, we need to spin up a new event loop for async fallback
+        # Runs on the app's event loop; this worker thread waits (and relays pause / cancel)
         try:
-             fallback_info = asyncio.run(attempt_fallback_download(req.url, job_id))
+             fallback_info = fallback_service.run(attempt_fallback_download, req.url, job_id, timeout=DOWNLOAD_TIMEOUT,
+                                                  should_stop=lambda: job_stop_requests.get(job_id))
+        except FallbackCancelled:
+             job.speed = job.speed_bps = None
+             job.eta = job.eta_seconds = None
+             job.status = JobStatus.PAUSED if job_stop_requests.get(job_id) == 'pause' else JobStatus.CANCELLED
+             if job.status == JobStatus.CANCELLED:
+                 remove_job_temp_files(job_id)
+             logging.info(f"Job {job_id} {job.status} during fallback")
+             return
         except Exception as af_e:
              logging.error(f"Fallback async execution failed: {af_e}")
              fallback_info = None
+        settle_retries(retries, bool(fallback_info))
 
-        if fallback_info:
+        if fallback_info and os.path.exists(fallback_info['path']):
             logging.info("Fallback download successful. Processing file...")
-            # Simulate info dict
-            info = {'title': fallback_info['title']} 
-            channel_name = "ExternalSource"
-            # Re-run file find and move logic
-            # This is duplicate code but cleanest without Refactoring entire function now
-            found_files = []
-            if os.path.exists(TEMP_DIR):
-                for f in os.listdir(TEMP_DIR):
-                    if f.startswith(job_id):
-                        found_files.append(os.path.join(TEMP_DIR, f))
-            
-            if found_files:
-                 from yt_dlp.utils import sanitize_filename
-                 safe_title = sanitize_filename(info['title'])
-                 # Move Logic
-                 dest_path = os.path.join(DOWNLOAD_DIR, safe_title + "." + fallback_info['ext'])
-                 counter = 1
-                 while os.path.exists(dest_path):
-                     dest_path = os.path.join(DOWNLOAD_DIR, f"{safe_title}_{counter}.{fallback_info['ext']}")
-                     counter += 1
-                 
-                 shutil.move(found_files[0], dest_path)
-                 job.filename = os.path.basename(dest_path)
-                 job.status = JobStatus.FINISHED
-                 job.title = info['title']
-                 if job.username: db_utils.add_file_owner(job.filename, job.username)
-                 return
+            # Exactly the file the fallback wrote: TEMP_DIR may still hold .part / .ytdl files
+            # of the yt-dlp attempts (kept so BACKOFF could resume them)
+            from yt_dlp.utils import sanitize_filename
+            safe_title = sanitize_filename(fallback_info['title'])
+            dest_path = os.path.join(DOWNLOAD_DIR, safe_title + "." + fallback_info['ext'])
+            counter = 1
+            while os.path.exists(dest_path):
+                dest_path = os.path.join(DOWNLOAD_DIR, f"{safe_title}_{counter}.{fallback_info['ext']}")
+                counter += 1
+
+            shutil.move(fallback_info['path'], dest_path)
+            remove_job_temp_files(job_id)
+            job.filename = os.path.basename(dest_path)
+            job.status = JobStatus.FINISHED
+            job.title = fallback_info['title']
+            if job.username: db_utils.add_file_owner(job.filename, job.username)
+            if media:
+                db_utils.index_library_file(*media, library_signature(req), job.filename, job.title,
+                                            os.path.getsize(dest_path))
+            return [job.filename]
 
         job.status = JobStatus.ERROR
         job.error_msg = f"Download Failed: {str(e)} (And fallback failed)"
         logging.error(f"Job {job_id} completely failed.")
 
-async def attempt_fallback_download(url: str, job_id: str):
-    """Fallback using multiple Cobalt API providers in parallel (Race)"""
+async def restore_jobs():
+    """Reload unfinished jobs from the durable store and queue them again.
+    yt-dlp picks up the <job_id>.part files in TEMP_DIR, so interrupted downloads resume."""
+    try:
+        unfinished = await async_db.load_unfinished_jobs()
+    except Exception as e:
+        logging.error(f"Failed to load unfinished jobs: {e}")
+        return
+
+    playlist_parents = []
+    for job_data, req_data in unfinished:
+        job = DownloadJob(**job_data)
+        if not req_data:
+            job.status = JobStatus.ERROR
+            job.error_msg = "Interrupted by server restart (original request not stored)"
+            await async_db.save_job(model_to_dict(job))
+            continue
+        if job.child_ids:
+            # Enumerated before the restart: its entries are restored as jobs of their own
+            jobs[job.id] = job
+            playlist_parents.append(job)
+            continue
+        job.status = JobStatus.QUEUED
+        job.speed = job.speed_bps = None
+        job.eta = job.eta_seconds = None
+        jobs[job.id] = job
+        submit_download(job, DownloadRequest(**req_data))
+        logging.info(f"Restored job {job.id} ({job.url})")
+    for parent in playlist_parents:
+        await ensure_playlist(parent)
+
+# Fallback chain: worker threads hand it to the app's event loop, where one pooled client
+# keeps connections / TLS sessions to providers and CDNs alive between jobs
+FALLBACK_MAX_CONNECTIONS = 64
+fallback_service = FallbackService(lambda: httpx.AsyncClient(
+    timeout=25.0, verify=False, # verify=False to avoid SSL issues on some shady instances
+    limits=httpx.Limits(max_connections=FALLBACK_MAX_CONNECTIONS, max_keepalive_connections=FALLBACK_MAX_CONNECTIONS // 2)))
+
+# Fallback providers race by health score (provider_health.py): the best few first, more
+# only after a delay, dead ones circuit-broken. The scoreboard is kept in the durable store.
+fallback_providers = ProviderHealth()
+FALLBACK_RACE_WIDTH = 3
+FALLBACK_HEDGE_DELAY = 4.0     # Seconds without a winner before the next providers join
+FALLBACK_PROVIDER_TIMEOUT = 15.0
+# Cobalt instances in the race, next to the scrapers (SaveFrom, Y2Mate) below
+COBALT_INSTANCES = [
+    "https://api.cobalt.tools",
+    "https://cobalt.tools",
+    "https://co.wuk.sh",
+    "https://api.wuk.sh",
+    "https://nyc1.coapi.ggtyler.dev",
+    "https://cal1.coapi.ggtyler.dev",
+    "https://par1.coapi.ggtyler.dev",
+    "https://coapi.kelig.me",
+    "https://ca.haloz.at",
+    "https://cobalt-api.ayo.tf",
+    "https://api.cobalt.tacohitbox.com",
+    "https://cobalt.twi.sh",
+    "https://api.sukka.moe/cobalt",
+    "https://cobalt.kwiatekmiki.com",
+    "https://cobalt.q1.app",
+    "https://cobalt.synced.sh",
+    "https://c.jaops.org"
+]
+
+FALLBACK_SCRAPERS = {
+    'SaveFrom': external_downloaders.get_savefrom,
+    'Y2Mate': external_downloaders.get_y2mate,
+}
+# Providers slower than FALLBACK_PROVIDER_TIMEOUT by design: Y2Mate (Loader.to) converts first,
+# so it gets its polling budget on top of the request time instead of a timeout failure
+FALLBACK_PROVIDER_TIMEOUTS = {
+    'Y2Mate': FALLBACK_PROVIDER_TIMEOUT + external_downloaders.LOADER_POLL_BUDGET,
+}
+
+async def attempt_fallback_download(url: str, job_id: str, client: "httpx.AsyncClient"):
+    """Fallback using multiple Cobalt API providers in parallel (hedged race).
+    Runs on the app's event loop through fallback_service, with its shared client."""
     logging.info(f"Using Fallback Chain for {job_id}")
     job = jobs.get(job_id)
     if not job: return False
@@ -754,140 +1550,183 @@ async def attempt_fallback_download(url: str, job_id: str):
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
     }
 
-    # Parallel check for fastest instance
-    # We include traditional Cobalt instances AND external scrapers (SaveFrom, Y2Mate)
-    # This ensures maximum robustness and speed.
-    
-    cobalt_instances = [
-        "https://api.cobalt.tools",
-        "https://cobalt.tools",
-        "https://co.wuk.sh",
-        "https://api.wuk.sh",
-        "https://nyc1.coapi.ggtyler.dev",
-        "https://cal1.coapi.ggtyler.dev", 
-        "https://par1.coapi.ggtyler.dev",
-        "https://coapi.kelig.me",
-        "https://ca.haloz.at",
-        "https://cobalt-api.ayo.tf",
-        "https://api.cobalt.tacohitbox.com",
-        "https://cobalt.twi.sh",
-        "https://api.sukka.moe/cobalt",
-        "https://cobalt.kwiatekmiki.com",
-        "https://cobalt.q1.app",
-        "https://cobalt.synced.sh",
-        "https://c.jaops.org"
-    ]
-
     async def check_instance(client, base_url):
+        """Cobalt answer for url, None if the instance cannot serve it. Unreachable instances
+        and HTTP 5xx raise: only those count against the instance's health (hedged_race)."""
+        payload = {"url": url}
+        # Try V7
+        api_url = f"{base_url.rstrip('/')}/api/json"
         try:
-            payload = {"url": url}
-            # Try V7
-            api_url = f"{base_url.rstrip('/')}/api/json"
-            try:
-                resp = await client.post(api_url, json=payload, headers=headers)
-            except:
-                # Try Root if V7 network fails immediately
-                api_url = f"{base_url.rstrip('/')}/"
-                try:
-                    resp = await client.post(api_url, json={"url": url}, headers=headers)
-                except:
-                    return None
-
-            if resp.status_code not in [200, 201]:
-                # Retry Root if V7 returned 404
-                if api_url.endswith("/api/json"):
-                     api_url = f"{base_url.rstrip('/')}/"
-                     try:
-                        resp = await client.post(api_url, json={"url": url}, headers=headers)
-                     except: pass
-            
-            if resp.status_code not in [200, 201]:
-                return None
-                
-            try:
-                data = resp.json()
-            except:
-                return None
-            
-            if data.get('status') == 'error':
-                 return None
-                 
-            # Extract
-            download_url = None
-            status = data.get('status')
-            if status in ['tunnel', 'redirect']:
-                download_url = data.get('url')
-            elif status == 'picker' and data.get('picker'):
-                download_url = data['picker'][0].get('url')
-            elif 'url' in data: 
-                download_url = data.get('url')
-                
-            if download_url:
-                return {'base_url': base_url, 'data': data, 'download_url': download_url, 'source': 'Cobalt'}
-        except:
-            pass
+            resp = await client.post(api_url, json=payload, headers=headers)
+        except httpx.TransportError:
+            # Try Root if V7 network fails immediately
+            api_url = f"{base_url.rstrip('/')}/"
+            resp = await client.post(api_url, json=payload, headers=headers)
+
+        if resp.status_code not in [200, 201]:
+            # Retry Root if V7 returned 404
+            if api_url.endswith("/api/json"):
+                 api_url = f"{base_url.rstrip('/')}/"
+                 try:
+                    resp = await client.post(api_url, json=payload, headers=headers)
+                 except httpx.TransportError: pass
+
+        if resp.status_code >= 500:
+            resp.raise_for_status()
+        if resp.status_code not in [200, 201]:
+            return None
+
+        try:
+            data = resp.json()
+        except ValueError:
+            return None
+
+        if not isinstance(data, dict) or data.get('status') == 'error':
+             return None
+
+        # Extract
+        download_url = None
+        status = data.get('status')
+        if status in ['tunnel', 'redirect']:
+            download_url = data.get('url')
+        elif status == 'picker' and data.get('picker'):
+            download_url = data['picker'][0].get('url')
+        elif 'url' in data:
+            download_url = data.get('url')
+
+        if download_url:
+            return {'base_url': base_url, 'data': data, 'download_url': download_url, 'source': 'Cobalt'}
         return None
 
-    # Use AsyncClient for parallel requests
-    # verify=False to avoid SSL issues on some shady instances
-    async with httpx.AsyncClient(timeout=25.0, verify=False) as client:
-        # Create tasks for Cobalt
-        tasks = [check_instance(client, u) for u in cobalt_instances]
-        
-        # Add external scrapers tasks
-        tasks.append(external_downloaders.get_savefrom(url, client))
-        tasks.append(external_downloaders.get_y2mate(url, client))
-        
-        # Log count
-        # logging.info(f"Racing {len(tasks)} fallback providers...")
-        
-        for future in asyncio.as_completed(tasks):
-            res = await future
-            if res:
-                source = res.get('source', 'Unknown')
-                base_url = res.get('base_url', 'External')
-                download_url = res.get('download_url')
-                data = res.get('data', {})
-                
-                logging.info(f"Fallback Winner: {source} ({base_url})")
-                
-                # Filename hint
-                f_hint = data.get('filename', f'{source}_{job_id}.mp4')
-                ext = f_hint.split('.')[-1] if '.' in f_hint else 'mp4'
-                
-                # Download File
-                return await process_generic_download_async(download_url, job_id, client, f_hint, ext)
-            
+    async def attempt(provider):
+        if provider in FALLBACK_SCRAPERS:
+            return await FALLBACK_SCRAPERS[provider](url, client)
+        return await check_instance(client, provider)
+
+    try:
+        winner = await hedged_race(COBALT_INSTANCES + list(FALLBACK_SCRAPERS), attempt, fallback_providers,
+                                   FALLBACK_RACE_WIDTH, FALLBACK_HEDGE_DELAY, FALLBACK_PROVIDER_TIMEOUT,
+                                   FALLBACK_PROVIDER_TIMEOUTS)
+    finally:
+        maintenance_executor.submit(db_utils.save_provider_health, fallback_providers.rows())
+    if winner:
+        provider, res = winner
+        source = res.get('source', 'Unknown')
+        download_url = res.get('download_url')
+        data = res.get('data', {})
+
+        logging.info(f"Fallback Winner: {source} ({provider})")
+
+        # Filename hint
+        f_hint = data.get('filename', f'{source}_{job_id}.mp4')
+        ext = f_hint.split('.')[-1] if '.' in f_hint else 'mp4'
+
+        # Download File
+        return await process_generic_download_async(download_url, job_id, client, f_hint, ext)
+
     # All fallbacks failed
     logging.error("All fallback instances/scrapers failed.")
 
+FALLBACK_CONNECTIONS = 4 # Parallel byte-range requests per fallback download
+
 async def process_generic_download_async(download_url, job_id, client, filename_hint, ext):
-    """Helper to download file from a direct link (Async)"""
+    """Helper to download file from a direct link (Async): parallel byte ranges when the
+    origin supports them, one stream otherwise (see segmented_download.py)"""
     # Create temp path
     # If generic, we default to mp4
     temp_path = os.path.join(TEMP_DIR, f"{job_id}.{ext}")
     job = jobs.get(job_id)
-    
+
+    def on_progress(downloaded, total):
+        if not job:
+            return
+        values = {'downloaded_bytes': downloaded, 'total_bytes': total}
+        if total:
+            values['progress'] = round((downloaded / total) * 100, 1)
+        update_job_fields(job, values)
+        publish_job(job)
+
     try:
-        async with client.stream("GET", download_url) as r:
-            r.raise_for_status()
-            total = int(r.headers.get('content-length', 0))
-            downloaded = 0
-            with open(temp_path, 'wb') as f:
-                async for chunk in r.aiter_bytes(chunk_size=65536):
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total and job:
-                        job.progress = round((downloaded / total) * 100, 1)
-        
-        return {'title': filename_hint, 'ext': ext}
+        await segmented_download.download_file(client, download_url, temp_path, FALLBACK_CONNECTIONS,
+                                               executor=file_io_executor, on_progress=on_progress)
+        return {'title': filename_hint, 'ext': ext, 'path': temp_path}
     except Exception as e:
         logging.error(f"Generic Download Failed for {job_id}: {e}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
         return False
 
 # --- API Endpoints ---
 
 
+EVENT_TOPICS = ('job', 'notification', 'log')
+EVENT_KEEPALIVE = 15 # Seconds between SSE comments (also detects disconnects)
+EVENT_RETRY_MS = 3000
+
+@app.get("/api/events")
+async def stream_events(request: Request, topics: str = "job,notification", job_id: Optional[str] = None,
+                        mine: bool = False, since: Optional[str] = None):
+    """
+    Unified Server-Sent Events stream: job deltas, notifications and (admins) server logs.
+    Filters: topics=job,notification,log  job_id=<id>[,<id>...]  mine=true (own jobs only).
+    Resume: the browser sends Last-Event-ID on reconnect (or pass since=<last id>); missed
+    events are replayed. A 'hello' event with resync=true means the gap could not be
+    replayed and the client should refetch /jobs.
+    """
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    session = sessions.get(token) if token else None
+    username = session.get('username') if session else None
+    is_admin = bool(session) and session.get('role') == 'admin'
+    topic_set = {t for t in topics.split(',') if t in EVENT_TOPICS}
+    job_ids = set(job_id.split(',')) if job_id else None
+
+    def accepts(event) -> bool:
+        if event.topic not in topic_set:
+            return False
+        if event.audience == 'admin' and not is_admin:
+            return False
+        if event.topic == 'notification':
+            return username is not None and event.username == username
+        if event.topic == 'job':
+            if job_ids is not None and event.data.get('id') not in job_ids:
+                return False
+            if mine and event.username != username:
+                return False
+        return True
+
+    since_seq, same_boot = event_bus.parse_last_event_id(request.headers.get('last-event-id') or since)
+    sub, missed, complete = event_bus.subscribe(accepts, topic_set, since_seq)
+    resync = not same_boot or not complete
+
+    async def event_generator():
+        try:
+            yield f"retry: {EVENT_RETRY_MS}\n\n"
+            hello = {"boot": event_bus.boot, "seq": event_bus.last_seq, "resync": resync}
+            yield f"event: hello\ndata: {json.dumps(hello)}\n\n"
+            for event in missed:
+                yield event.to_sse(event_bus.boot)
+            while True:
+                if sub.lagged:
+                    sub.lagged = False
+                    yield "event: resync\ndata: {}\n\n"
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield event.to_sse(event_bus.boot)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            event_bus.unsubscribe(sub)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/api/logs/stream")
 async def stream_logs(request: Request):
     """Stream server logs via Server-Sent Events"""
@@ -919,10 +1758,21 @@ async def index():
     return FileResponse(os.path.join("static", "index.html"))
 
 @app.get("/api/download/{filename}")
-async def download_file(filename: str):
+async def download_file(filename: str, request: Request):
+    """Direct download endpoint (FileResponse: Range support for seeking)"""
+    # Security check
+    if ".." in filename or "/" in filename or "\\" in filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+
     file_path = os.path.join(DOWNLOAD_DIR, filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
+
+    # Log Download Event (the middleware skips /api/download: the file size is logged here)
+    client_ip = request.client.host
+    username = get_session_username(request)
+    await async_db.log_event(client_ip, "DOWNLOAD", f"File: {filename}", username)
+    await async_db.log_bandwidth(client_ip, 0, os.path.getsize(file_path), "download", username)
     return FileResponse(file_path, media_type='application/octet-stream', filename=filename)
 
 @app.get("/api/stream")
@@ -931,21 +1781,7 @@ async def stream_video(url: str, request: Request):
     Get direct stream URL from yt-dlp and proxy it.
     """
     try:
-        ydl_opts = {
-            # Prioritize progressive HTTP streams (mp4) which are playable in browser <video>
-            'format': 'best[protocol^=http][ext=mp4]/best[protocol^=http]/best[ext=mp4]/best',
-            'quiet': True,
-            'cachedir': False,
-            'force_ipv4': True, # Prioritize IPv4 for extraction
-            'source_address': '0.0.0.0', # Force binding to IPv4 interface
-            # 'extractor_args': {'youtube': {'player_client': ['tv']}},
-        }
-        
-        # Cookie handling
-        cookies_path = os.path.join(execution_dir, 'cookies.txt')
-        if os.path.exists(cookies_path):
-            ydl_opts['cookiefile'] = cookies_path
-        
+        # Options: ydl_templates['stream'] (progressive mp4 first, IPv4, cookies.txt)
         # Note: Do not use cookiesfrombrowser here to avoid system profile errors.
         
         # Determine Speed Limit
@@ -957,67 +1793,66 @@ async def stream_video(url: str, request: Request):
         limit_mb = LIMITS.get(role, {}).get('speed_limit', 0)
         limit_bps = int(limit_mb * 1024 * 1024) if limit_mb > 0 else None
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            stream_url = info.get('url')
-            if not stream_url:
-                raise Exception("No stream URL found")
-            
-            # Proxy the stream
-            # We use the proxy_service logic to utilize the speed limiter (stream_response)
-            # But stream_response takes an httpx.Response object.
-            # We need to make the request using proxy_service.client (or similar) or create options.
-            # proxy_service.client is pre-configured.
-            
-            # Since stream_response closes the response, we should be careful.
+        info = await extract_info_cached(url, 'stream')
+        stream_url = info.get('url')
+        if not stream_url:
+            raise Exception("No stream URL found")
+        
+        # Proxy the stream
+        # We use the proxy_service logic to utilize the speed limiter (stream_response)
+        # But stream_response takes an httpx.Response object.
+        # We need to make the request using proxy_service.client (or similar) or create options.
+        # proxy_service.client is pre-configured.
+        
+        # Since stream_response closes the response, we should be careful.
+        
+        # Use headers from yt-dlp info if available, or default
+        headers = dict(info.get('http_headers') or {})
+        # Ensure User-Agent is set if missing
+        if 'User-Agent' not in headers:
+             headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+        # Forward Range Header
+        range_header = request.headers.get('range')
+        if range_header:
+            headers['Range'] = range_header
+
+        # FORCE IPv4 Connection for httpx to match yt-dlp's IPv4 extraction
+        try:
+            parsed_url = urllib.parse.urlparse(stream_url)
+            hostname = parsed_url.hostname
+            port = parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
             
-            # Use headers from yt-dlp info if available, or default
-            headers = info.get('http_headers', {})
-            # Ensure User-Agent is set if missing
-            if 'User-Agent' not in headers:
-                 headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-
-            # Forward Range Header
-            range_header = request.headers.get('range')
-            if range_header:
-                headers['Range'] = range_header
-
-            # FORCE IPv4 Connection for httpx to match yt-dlp's IPv4 extraction
-            try:
-                parsed_url = urllib.parse.urlparse(stream_url)
-                hostname = parsed_url.hostname
-                port = parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
-                
-                # Resolve to IPv4
-                addr_info = socket.getaddrinfo(hostname, port, socket.AF_INET, socket.SOCK_STREAM)
-                if addr_info:
-                    ip_addr = addr_info[0][4][0]
-                    # Replace hostname with IP in URL logic
-                    # httpx does not have a clean way to force IP without Host header manipulation
-                    stream_url = stream_url.replace(hostname, ip_addr, 1)
-                    headers['Host'] = hostname # Ensure SNI/Host matches original
-                    # logging.info(f"Forced IPv4 resolution: {hostname} -> {ip_addr}")
-            except Exception as e:
-                logging.warning(f"Failed to force IPv4 resolution: {e}")
+            # Resolve to IPv4
+            addr_info = await interactive_executor.run(socket.getaddrinfo, hostname, port, socket.AF_INET, socket.SOCK_STREAM)
+            if addr_info:
+                ip_addr = addr_info[0][4][0]
+                # Replace hostname with IP in URL logic
+                # httpx does not have a clean way to force IP without Host header manipulation
+                stream_url = stream_url.replace(hostname, ip_addr, 1)
+                headers['Host'] = hostname # Ensure SNI/Host matches original
+                # logging.info(f"Forced IPv4 resolution: {hostname} -> {ip_addr}")
+        except Exception as e:
+            logging.warning(f"Failed to force IPv4 resolution: {e}")
 
-            client = httpx.AsyncClient(verify=False, follow_redirects=True)
-            req_stream = client.build_request("GET", stream_url, headers=headers)
-            r = await client.send(req_stream, stream=True)
-            
-            msg = f"Proxying Stream: {stream_url[:50]}... Status: {r.status_code} Type: {r.headers.get('content-type')}"
-            logging.info(msg)
-            
-            response_headers = {}
-            for k in ['Content-Range', 'Content-Length', 'Accept-Ranges', 'Content-Type']:
-                if r.headers.get(k):
-                    response_headers[k] = r.headers.get(k)
-            
-            return StreamingResponse(
-                proxy_service.stream_response(r, request.client.host, limit_bps),
-                status_code=r.status_code,
-                headers=response_headers,
-                media_type=r.headers.get("content-type"),
-            )
+        client = httpx.AsyncClient(verify=False, follow_redirects=True)
+        req_stream = client.build_request("GET", stream_url, headers=headers)
+        r = await client.send(req_stream, stream=True)
+        
+        msg = f"Proxying Stream: {stream_url[:50]}... Status: {r.status_code} Type: {r.headers.get('content-type')}"
+        logging.info(msg)
+        
+        response_headers = {}
+        for k in ['Content-Range', 'Content-Length', 'Accept-Ranges', 'Content-Type']:
+            if r.headers.get(k):
+                response_headers[k] = r.headers.get(k)
+        
+        return StreamingResponse(
+            proxy_service.stream_response(r, request.client.host, limit_bps, get_session_username(request)),
+            status_code=r.status_code,
+            headers=response_headers,
+            media_type=r.headers.get("content-type"),
+        )
     except Exception as e:
         logging.error(f"Stream error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1043,6 +1878,7 @@ async def start_download(request: DownloadRequest, req: Request):
         add_rate_limit_usage(username, 'download')
 
     client_id = req.cookies.get('CLIENT_ID')
+    await async_db.log_event(req.client.host, db_utils.DOWNLOAD_EVENT, request.url, username)
     
     job = DownloadJob(
         id=job_id,
@@ -1051,32 +1887,193 @@ async def start_download(request: DownloadRequest, req: Request):
         created_at=time.time(),
         client_ip=req.client.host,
         username=username,
-        client_id=client_id
+        client_id=client_id,
+        priority=role if role in LIMITS else 'user'
     )
     jobs[job_id] = job
-    
-    # Submit to thread pool
-    executor.submit(run_download, job_id, request)
-    
-    return {"job_id": job_id, "message": "Queued"}
+    await async_db.save_job(model_to_dict(job), model_to_dict(request))
+
+    submit_download(job, request)
+    apply_queue_estimates([job])
+    if job.mirror_of:
+        await async_db.save_job(model_to_dict(job))
+
+    return {"job_id": job_id, "message": "Attached" if job.mirror_of else "Queued", "shared_with": job.mirror_of,
+            "queue_position": job.queue_position, "estimated_start": job.estimated_start}
+
+def encode_job_cursor(job: Dict) -> str:
+    return f"{job['created_at']!r}:{job['id']}"
+
+def decode_job_cursor(cursor: str) -> tuple:
+    try:
+        created_at, job_id = cursor.split(':', 1)
+        return float(created_at), job_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.get("/jobs", response_model=List[DownloadJob])
-async def list_jobs():
-    return list(jobs.values())
+async def list_jobs(response: Response, status: Optional[str] = None, username: Optional[str] = None,
+                    limit: int = 200, cursor: Optional[str] = None):
+    """Newest first. A full page sets X-Next-Cursor; pass it back as ?cursor= for the next (older) page."""
+    evict_resting_jobs()
+    limit = max(1, min(limit, JOB_LIST_MAX))
+    # Served from the durable store; running jobs are overlaid with their live in-memory state
+    stored = await async_db.list_jobs(limit=limit, status=status, username=username,
+                                      before=decode_job_cursor(cursor) if cursor else None)
+    if len(stored) == limit:
+        response.headers["X-Next-Cursor"] = encode_job_cursor(stored[-1])
+    return apply_queue_estimates([jobs.get(data['id']) or DownloadJob(**data) for data in stored])
 
 @app.get("/jobs/{job_id}", response_model=DownloadJob)
 async def get_job(job_id: str):
     job = jobs.get(job_id)
-    if not job:
+    if job:
+        return apply_queue_estimates([job])[0]
+    data = await async_db.get_job(job_id)
+    if not data:
         raise HTTPException(status_code=404, detail="Job not found")
+    return DownloadJob(**data)
+
+def can_control_job(request: Request, job: DownloadJob) -> bool:
+    """Admins, the job's user, or (for anonymous jobs) the same client"""
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    session = sessions.get(token) if token else None
+    if session and session.get('role') == 'admin':
+        return True
+    if job.username:
+        return bool(session) and session.get('username') == job.username
+    return job.client_ip == request.client.host or (job.client_id and job.client_id == request.cookies.get('CLIENT_ID'))
+
+async def get_controllable_job(job_id: str, request: Request) -> DownloadJob:
+    job = jobs.get(job_id)
+    if not job:
+        data = await async_db.get_job(job_id)
+        if not data:
+            raise HTTPException(status_code=404, detail="Job not found")
+        job = DownloadJob(**data)
+    if not can_control_job(request, job):
+        raise HTTPException(status_code=403, detail="Not your job")
     return job
 
+async def control_playlist(job: DownloadJob, action, message: str) -> Dict:
+    """Cancel / pause / resume every entry of a playlist job; the parent follows its entries"""
+    parent = await ensure_playlist(job)
+    for child in await playlist_children(parent):
+        try:
+            await action(child)
+        except HTTPException:
+            pass # Entry already in a state the action does not apply to
+    return {"message": message, "status": parent.status}
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, request: Request):
+    job = await get_controllable_job(job_id, request)
+    if job.child_ids and job.status not in ENDED_JOB_STATUSES:
+        return await control_playlist(job, _cancel_job, "Cancelled")
+    return await _cancel_job(job)
+
+async def _cancel_job(job: DownloadJob) -> Dict:
+    job_id = job.id
+    if job.status in ENDED_JOB_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    if detach_follower(job) or job.status == JobStatus.PAUSED or download_scheduler.cancel(job_id):
+        # Not running: finish it here
+        job.status = JobStatus.CANCELLED
+        await async_db.save_job(model_to_dict(job))
+        publish_job(job, force=True)
+        retire_job(job)
+        publish_queue()
+        await maintenance_executor.run(remove_job_temp_files, job_id)
+        await maintenance_executor.run(settle_followers, job)
+        track_playlist_entry(job, settled=True)
+        return {"message": "Cancelled", "status": job.status}
+    request_job_stop(job_id, 'cancel')
+    return {"message": "Cancelling", "status": job.status}
+
+@app.post("/jobs/{job_id}/pause")
+async def pause_job(job_id: str, request: Request):
+    job = await get_controllable_job(job_id, request)
+    if job.child_ids and job.status == JobStatus.DOWNLOADING:
+        return await control_playlist(job, _pause_job, "Paused")
+    return await _pause_job(job)
+
+async def _pause_job(job: DownloadJob) -> Dict:
+    job_id = job.id
+    if job.status not in (JobStatus.QUEUED, JobStatus.DOWNLOADING):
+        raise HTTPException(status_code=409, detail=f"Cannot pause a {job.status} job")
+    if detach_follower(job) or download_scheduler.cancel(job_id):
+        job.status = JobStatus.PAUSED
+        job.queue_position = None
+        job.estimated_start = None
+        await async_db.save_job(model_to_dict(job))
+        publish_job(job, force=True)
+        retire_job(job)
+        publish_queue()
+        await maintenance_executor.run(settle_followers, job)
+        track_playlist_entry(job, settled=True)
+        return {"message": "Paused", "status": job.status}
+    request_job_stop(job_id, 'pause')
+    return {"message": "Pausing", "status": job.status}
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str, request: Request):
+    job = await get_controllable_job(job_id, request)
+    if job.child_ids and job.status == JobStatus.PAUSED:
+        return await control_playlist(job, _resume_job, "Resumed")
+    return await _resume_job(job)
+
+async def _resume_job(job: DownloadJob) -> Dict:
+    job_id = job.id
+    if job.status != JobStatus.PAUSED:
+        raise HTTPException(status_code=409, detail=f"Cannot resume a {job.status} job")
+    req_data = await async_db.get_job_request(job_id)
+    if not req_data:
+        raise HTTPException(status_code=409, detail="Original request not stored")
+    # continuedl picks up the <job_id>.part files kept by pause
+    job.status = JobStatus.QUEUED
+    jobs[job_id] = job
+    await async_db.save_job(model_to_dict(job))
+    submit_download(job, DownloadRequest(**req_data))
+    if job.mirror_of:
+        await async_db.save_job(model_to_dict(job))
+    apply_queue_estimates([job])
+    track_playlist_entry(job)
+    return {"message": "Resumed", "status": job.status, "queue_position": job.queue_position}
+
 @app.delete("/jobs/{job_id}")
-async def delete_job(job_id: str):
-    if job_id in jobs:
-        del jobs[job_id]
+async def delete_job(job_id: str, request: Request):
+    try:
+        job = await get_controllable_job(job_id, request)
+    except HTTPException as e:
+        if e.status_code == 404:
+            return {"message": "Deleted"}
+        raise
+    await _delete_job(job)
     return {"message": "Deleted"}
 
+async def _delete_job(job: DownloadJob):
+    job_id = job.id
+    if job.child_ids:
+        # Entries go with their playlist; the parent itself has no transfer left
+        playlists.pop(job_id, None)
+        for child in await playlist_children(job):
+            await _delete_job(child)
+    elif detach_follower(job):
+        pass # Never had a transfer of its own
+    elif job_id in jobs and (job.status == JobStatus.DOWNLOADING or (job.status == JobStatus.QUEUED and not download_scheduler.cancel(job_id))):
+        # Running: the worker stops, cleans up its temp files and hands over attached jobs
+        request_job_stop(job_id, 'cancel')
+    elif job.status in (JobStatus.QUEUED, JobStatus.PAUSED):
+        await maintenance_executor.run(remove_job_temp_files, job_id)
+    running = job_id in job_stop_requests
+    jobs.pop(job_id, None)
+    await async_db.delete_job(job_id)
+    publish_job_deleted(job_id)
+    if not running:
+        await maintenance_executor.run(settle_followers, job)
+        track_playlist_entry(job, settled=True, status=JobStatus.CANCELLED)
+    publish_queue()
+
 @app.get("/files", response_model=List[Dict])
 async def list_files(request: Request):
     # Identify User
@@ -1098,7 +2095,7 @@ async def list_files(request: Request):
     
     files = []
     if os.path.exists(DOWNLOAD_DIR):
-        file_owners = db_utils.get_file_owners()
+        file_owners = await async_db.get_file_owners()
         
         # Determine effective role/username
         if token and token in sessions:
@@ -1115,16 +2112,17 @@ async def list_files(request: Request):
             if os.path.isfile(fp):
                 try:
                     stat = os.stat(fp)
-                    owner = file_owners.get(f)
+                    owners = file_owners.get(f, [])
+                    owner = owners[0] if owners else None
                     
                     # Filtering Logic
                     is_visible = False
                     
                     if role == 'admin':
                         is_visible = True
-                    elif owner == 'user' or owner is None:
+                    elif 'user' in owners or owner is None:
                         is_visible = True
-                    elif username and owner == username:
+                    elif username and username in owners:
                         is_visible = True
                     
                     if is_visible:
@@ -1132,7 +2130,8 @@ async def list_files(request: Request):
                             "filename": f,
                             "size": stat.st_size,
                             "created_at": stat.st_ctime,
-                            "owner": owner
+                            "owner": owner,
+                            "owners": owners
                         })
                 except Exception:
                     pass
@@ -1162,7 +2161,8 @@ async def bulk_delete_files(req: BulkFileRequest):
                      trash_path = os.path.join(TRASH_DIR, f"{base}_{int(time.time())}{ext}")
                 shutil.move(file_path, trash_path)
                 # Remove from DB
-                db_utils.remove_file_owner(filename)
+                await async_db.remove_file_owner(filename)
+                await async_db.remove_library_file(safe_name)
                 deleted.append(filename)
             except Exception as e:
                 errors.append(f"{filename}: {e}")
@@ -1205,6 +2205,8 @@ async def delete_file(filename: str):
     if os.path.exists(fp):
         try:
             os.remove(fp)
+            if library_filename(fp):
+                await async_db.remove_library_file(library_filename(fp))
             return {"message": "Deleted"}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -1271,7 +2273,7 @@ async def client_handshake(info: ClientInfo, request: Request, response: Respons
         "orientation": info.orientation,
         "device_name": info.device_name
     }
-    db_utils.update_client_info(client_id, request.client.host, db_info, username)
+    await async_db.update_client_info(client_id, request.client.host, db_info, username)
     
     # Set Cookies (Long lived)
     response.set_cookie(key='CLIENT_ID', value=client_id, max_age=31536000, httponly=False) 
@@ -1283,7 +2285,7 @@ async def client_handshake(info: ClientInfo, request: Request, response: Respons
 @app.post("/api/login")
 async def login(req: LoginRequest, response: Response, request: Request):
     try:
-        user = db_utils.verify_user(req.username, req.password)
+        user = await async_db.verify_user(req.username, req.password)
         if user:
             # Generate Session
             session_token = str(uuid.uuid4())
@@ -1308,7 +2310,7 @@ async def login(req: LoginRequest, response: Response, request: Request):
                 'exp': time.time() + max_age
             }
 
-            db_utils.log_event(request.client.host, "LOGIN_SUCCESS", f"User: {req.username}")
+            await async_db.log_event(request.client.host, "LOGIN_SUCCESS", f"User: {req.username}", req.username)
 
             response.set_cookie(
                 key=AUTH_COOKIE_NAME,
@@ -1320,9 +2322,9 @@ async def login(req: LoginRequest, response: Response, request: Request):
             )
             return {"message": "Logged in", "role": role}
         else:
-            db_utils.log_event(request.client.host, "LOGIN_FAILED", f"User: {req.username}")
+            await async_db.log_event(request.client.host, "LOGIN_FAILED", f"User: {req.username}")
             # Check if username exists to give hint
-            if db_utils.check_username_exists(req.username):
+            if await async_db.check_username_exists(req.username):
                  raise HTTPException(status_code=401, detail="パスワードが違います。忘れた場合は管理者へ連絡してください。")
             raise HTTPException(status_code=401, detail="認証に失敗しました")
     except Exception as e:
@@ -1335,7 +2337,7 @@ async def register(req: RegisterRequest, request: Request):
     password = req.password.strip()
     
     # Check existing
-    if db_utils.check_username_exists(nickname):
+    if await async_db.check_username_exists(nickname):
          raise HTTPException(status_code=400, detail="この名前は既に使用されています。ログインするか、別の名前を使用してください。")
     
     if len(nickname) < 3:
@@ -1345,7 +2347,7 @@ async def register(req: RegisterRequest, request: Request):
     if not (4 <= len(password) <= 20) or not password.isalnum():
          raise HTTPException(status_code=400, detail="パスワードは4文字以上20文字以下の英数字にしてください")
          
-    success = db_utils.register_user_request(
+    success = await async_db.register_user_request(
         nickname=nickname,
         password=password,
         ip=request.client.host,
@@ -1384,10 +2386,13 @@ async def admin_stats(request: Request):
         current_clients = active_clients.copy()
         
         # Get Logs & Bandwidth
-        logs = db_utils.get_logs(limit=50)
-        bandwidth = db_utils.get_bandwidth_stats()
-        blocked_ips = db_utils.get_blocked_ips()
-        clients = db_utils.get_clients()
+        logs, bandwidth, blocked_ips, clients, db_stats = await asyncio.gather(
+            async_db.get_logs(limit=50),
+            async_db.get_bandwidth_stats(),
+            async_db.get_blocked_ips(),
+            async_db.get_clients(),
+            async_db.get_db_stats()
+        )
 
         return {
             "active_clients": get_active_client_count(),
@@ -1397,7 +2402,8 @@ async def admin_stats(request: Request):
             "logs": logs,
             "bandwidth": bandwidth,
             "blocked_ips": blocked_ips,
-            "clients": clients
+            "clients": clients,
+            "db": db_stats
         }
     except Exception as e:
         logging.error(f"Admin stats error: {e}")
@@ -1410,14 +2416,14 @@ async def get_users(request: Request):
     token = request.cookies.get(AUTH_COOKIE_NAME)
     if not token or sessions.get(token, {}).get('role') != 'admin':
         raise HTTPException(status_code=403)
-    return db_utils.get_all_users()
+    return await async_db.get_all_users()
 
 @app.post("/api/admin/users/{user_id}/approve")
 async def approve_user_endpoint(user_id: int, request: Request):
     token = request.cookies.get(AUTH_COOKIE_NAME)
     if not token or sessions.get(token, {}).get('role') != 'admin':
         raise HTTPException(status_code=403)
-    db_utils.approve_user(user_id)
+    await async_db.approve_user(user_id)
     return {"message": "User approved"}
 
 @app.delete("/api/admin/users/{user_id}")
@@ -1425,7 +2431,7 @@ async def delete_user_endpoint(user_id: int, request: Request):
     token = request.cookies.get(AUTH_COOKIE_NAME)
     if not token or sessions.get(token, {}).get('role') != 'admin':
         raise HTTPException(status_code=403)
-    db_utils.delete_user(user_id)
+    await async_db.delete_user(user_id)
     return {"message": "User deleted"}
 
 @app.patch("/api/admin/users/{user_id}")
@@ -1433,15 +2439,97 @@ async def update_user_endpoint(user_id: int, req: UserUpdateRequest, request: Re
     token = request.cookies.get(AUTH_COOKIE_NAME)
     if not token or sessions.get(token, {}).get('role') != 'admin':
         raise HTTPException(status_code=403)
-    db_utils.update_user(user_id, password=req.password, role=req.role, username=req.username, nickname=req.nickname)
+    await async_db.update_user(user_id, password=req.password, role=req.role, username=req.username, nickname=req.nickname)
     return {"message": "User updated"}
 
+# --- Admin Download Queue ---
+
+class JobPriorityRequest(BaseModel):
+    lane: Optional[str] = None # LIMITS role to move the job to
+    front: bool = False # Put it at the head of the lane
+
+@app.get("/api/admin/queue")
+async def get_download_queue(request: Request):
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    if not token or sessions.get(token, {}).get('role') != 'admin':
+        raise HTTPException(status_code=403)
+    queued = apply_queue_estimates([j for j in jobs.values() if j.status == JobStatus.QUEUED])
+    queued.sort(key=lambda j: j.queue_position or 0)
+    return {"scheduler": download_scheduler.stats(), "queued": queued}
+
+@app.post("/api/admin/jobs/{job_id}/priority")
+async def set_job_priority(job_id: str, req: JobPriorityRequest, request: Request):
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    if not token or sessions.get(token, {}).get('role') != 'admin':
+        raise HTTPException(status_code=403)
+    try:
+        lane = download_scheduler.move(job_id, req.lane, req.front)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if lane is None:
+        raise HTTPException(status_code=409, detail="Job is not queued")
+    job = jobs.get(job_id)
+    if job:
+        job.priority = lane
+        await async_db.save_job(model_to_dict(job))
+    publish_queue()
+    return {"message": f"Moved to {lane}", "queue_position": job.queue_position if job else None}
+
+@app.get("/api/admin/pools")
+async def get_worker_pools(request: Request):
+    """Queue metrics per worker pool"""
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    if not token or sessions.get(token, {}).get('role') != 'admin':
+        raise HTTPException(status_code=403)
+    return {
+        "interactive": interactive_executor.stats(),
+        "downloads": download_scheduler.stats(),
+        "coalescing": download_coalescer.stats(),
+        "fragment_concurrency": fragment_concurrency.stats(),
+        "metadata_cache": metadata_cache.stats(),
+        "youtubedl": {name: pool.stats() for name, pool in ydl_pools.items()},
+        "maintenance": maintenance_executor.stats(),
+        "file_io": file_io_executor.stats(),
+        "fallback_providers": fallback_providers.stats(),
+        "fallback_service": fallback_service.stats(),
+        "download_retries": download_retries.stats(),
+        "download_processes": download_processes.stats() if download_processes else None,
+        "events": event_bus.stats(),
+        "db": async_db.stats()
+    }
+
+@app.post("/api/admin/cache/purge")
+async def purge_metadata_cache(request: Request, url: Optional[str] = None):
+    """Drop cached extractions: all of them, or those of one URL / search query"""
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    if not token or sessions.get(token, {}).get('role') != 'admin':
+        raise HTTPException(status_code=403)
+    purged = metadata_cache.purge((lambda key: key[1] == url) if url else None)
+    return {"purged": purged, "stats": metadata_cache.stats()}
+
+@app.get("/api/admin/users/stats")
+async def get_all_user_stats_endpoint(request: Request):
+    """Stats for every user (keyed by user id) in a single query"""
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    if not token or sessions.get(token, {}).get('role') != 'admin':
+        raise HTTPException(status_code=403)
+    return await async_db.get_all_user_stats()
+
 @app.get("/api/admin/users/{user_id}/stats")
 async def get_user_stats_endpoint(user_id: int, request: Request):
     token = request.cookies.get(AUTH_COOKIE_NAME)
     if not token or sessions.get(token, {}).get('role') != 'admin':
         raise HTTPException(status_code=403)
-    return db_utils.get_user_stats(user_id)
+    return await async_db.get_user_stats(user_id)
+
+@app.get("/api/admin/bandwidth/{ip}")
+async def get_ip_bandwidth_endpoint(ip: str, request: Request, hours: int = 24):
+    """Hourly traffic of one IP (bucketed by the bandwidth rollup, kept BANDWIDTH_HOURLY_DAYS)"""
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    if not token or sessions.get(token, {}).get('role') != 'admin':
+        raise HTTPException(status_code=403)
+    hours = max(1, min(hours, db_utils.BANDWIDTH_HOURLY_DAYS * 24))
+    return {"ip": ip, "hourly": await async_db.get_ip_bandwidth_hourly(ip, hours)}
 
 # --- Admin Log Management ---
 
@@ -1549,7 +2637,7 @@ async def client_info(request: Request, info: Dict = Body(...)):
     fingerprint_str = f"{info.get('ua')}{info.get('screen')}{info.get('depth')}{client_ip}"
     client_id = hashlib.md5(fingerprint_str.encode()).hexdigest()[:12]
     
-    db_utils.update_client_info(client_id, client_ip, info)
+    await async_db.update_client_info(client_id, client_ip, info)
     return {"status": "ok", "client_id": client_id}
 
 # --- File Manager API ---
@@ -1638,6 +2726,8 @@ async def delete_file_admin(path: str, request: Request, root: str = "app"):
                 os.remove(target_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if root == "downloads" and library_filename(target_path):
+        await async_db.remove_library_file(library_filename(target_path))
     return {"status": "deleted"}
 
 class RenameRequest(BaseModel):
@@ -1672,6 +2762,11 @@ async def rename_file_admin(req: RenameRequest, request: Request):
         os.rename(old_path, new_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if req.root == "downloads" and library_filename(old_path):
+        if library_filename(new_path):
+            await async_db.rename_library_file(library_filename(old_path), library_filename(new_path))
+        else:
+            await async_db.remove_library_file(library_filename(old_path))
     return {"message": "Renamed"}
 
 @app.post("/api/admin/files/upload")
@@ -1747,8 +2842,11 @@ async def block_ip_endpoint(req: BlockIPRequest, request: Request):
     if not token or sessions.get(token, {}).get('role') != 'admin':
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    db_utils.block_ip(req.ip, req.reason)
-    db_utils.log_event(request.client.host, "BLOCK_IP", f"Blocked {req.ip}: {req.reason}")
+    try:
+        await async_db.block_ip(req.ip, req.reason)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid IP address or CIDR range: {req.ip}")
+    await async_db.log_event(request.client.host, "BLOCK_IP", f"Blocked {req.ip}: {req.reason}")
     return {"message": f"Blocked {req.ip}"}
 
 @app.post("/api/admin/unblock_ip")
@@ -1757,8 +2855,8 @@ async def unblock_ip_endpoint(req: BlockIPRequest, request: Request):
     if not token or sessions.get(token, {}).get('role') != 'admin':
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    db_utils.unblock_ip(req.ip)
-    db_utils.log_event(request.client.host, "UNBLOCK_IP", f"Unblocked {req.ip}")
+    await async_db.unblock_ip(req.ip)
+    await async_db.log_event(request.client.host, "UNBLOCK_IP", f"Unblocked {req.ip}")
     return {"message": f"Unblocked {req.ip}"}
 
 # --- Proxy Endpoints ---
@@ -1776,7 +2874,7 @@ async def proxy_resource(payload: str, request: Request):
     """GET endpoint for proxied resources (images, scripts, css)"""
     try:
         client_ip = request.client.host
-        if db_utils.is_ip_blocked(client_ip):
+        if await async_db.is_ip_blocked(client_ip):
              return Response(content="Access Denied", status_code=403)
 
         # Determine Speed Limit
@@ -1790,12 +2888,13 @@ async def proxy_resource(payload: str, request: Request):
 
         data = proxy_service.decrypt_payload(payload)
         url = data['url']
+        username = get_session_username(request)
         
-        resp = await proxy_service.proxy_request(url, client_ip)
+        resp = await proxy_service.proxy_request(url, client_ip, username)
         
         # Stream response
         return StreamingResponse(
-            proxy_service.stream_response(resp, client_ip, limit_bps),
+            proxy_service.stream_response(resp, client_ip, limit_bps, username),
             media_type=resp.headers.get("content-type", "application/octet-stream"),
             headers={"Content-Disposition": resp.headers.get("Content-Disposition", "")}
         )
@@ -1808,7 +2907,7 @@ async def proxy_handler(payload: str = Form(...), request: Request = None):
         client_ip = request.client.host if request else "unknown"
         
         # Check Blocked IP
-        if db_utils.is_ip_blocked(client_ip):
+        if await async_db.is_ip_blocked(client_ip):
              return Response(content="Access Denied: Your IP is blocked.", status_code=403)
 
         # Rate Limit Check
@@ -1831,21 +2930,21 @@ async def proxy_handler(payload: str = Form(...), request: Request = None):
         url = data['url']
         
         # Execute Proxy Request
-        resp = await proxy_service.proxy_request(url, client_ip)
+        resp = await proxy_service.proxy_request(url, client_ip, username)
         
         # Rewrite HTML if content type is html
         content_type = resp.headers.get("content-type", "")
         if "text/html" in content_type:
             content = await resp.aread()
             # Log bandwidth for non-streamed content
-            db_utils.log_bandwidth(client_ip, len(content), 0, "proxy")
+            await async_db.log_bandwidth(client_ip, len(content), 0, "proxy", username)
             
             rewritten = proxy_service.rewrite_html(content, url)
             return Response(content=rewritten, media_type="text/html; charset=utf-8")
         else:
             # Stream other content with limit
             return StreamingResponse(
-                proxy_service.stream_response(resp, client_ip, limit_bps),
+                proxy_service.stream_response(resp, client_ip, limit_bps, username),
                 media_type=content_type,
                 headers={"Content-Disposition": resp.headers.get("Content-Disposition", "")}
             )
@@ -1881,49 +2980,18 @@ async def debug_info():
         "ffmpeg_found": ffmpeg_found
     }
 
-@app.get("/api/download/{filename}")
-async def download_file(filename: str, request: Request):
-    """Direct download endpoint with Range support"""
-    # Security check
-    if ".." in filename or "/" in filename or "\\" in filename:
-        raise HTTPException(status_code=400, detail="Invalid filename")
-    
-    file_path = os.path.join(DOWNLOAD_DIR, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail=f"File not found: {filename}")
-    
-    # Log Download Event
-    client_ip = request.client.host
-    file_size = os.path.getsize(file_path)
-    db_utils.log_event(client_ip, "DOWNLOAD", f"File: {filename}")
-    db_utils.log_bandwidth(client_ip, 0, file_size, "download")
-
-    # Use FileResponse for proper Range support (seeking)
-    return FileResponse(
-        file_path, 
-        media_type="application/octet-stream", 
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
-
 @app.get("/info")
 async def get_info(url: str):
     """Get video info (no download)"""
-    ydl_opts = {'quiet': True, 'no_warnings': True}
-    
-    cookie_file = os.path.join(execution_dir, "cookies.txt")
-    if os.path.exists(cookie_file):
-        ydl_opts['cookiefile'] = cookie_file
-
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            return {
-                "title": info.get('title'),
-                "duration": info.get('duration'),
-                "uploader": info.get('uploader'),
-                "view_count": info.get('view_count'),
-                "url": info.get('url')
-            }
+        info = await extract_info_cached(url, 'extract')
+        return {
+            "title": info.get('title'),
+            "duration": info.get('duration'),
+            "uploader": info.get('uploader'),
+            "view_count": info.get('view_count'),
+            "url": info.get('url')
+        }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -1945,7 +3013,7 @@ async def change_password(req: ChangePasswordRequest, request: Request):
     # We only support changing DB users for now.
     
     # Verify current password
-    auth_role = db_utils.authenticate_user(username, req.current_password)
+    auth_role = await async_db.authenticate_user(username, req.current_password)
     
     if not auth_role:
          raise HTTPException(status_code=403, detail="Invalid current password")
@@ -1954,7 +3022,7 @@ async def change_password(req: ChangePasswordRequest, request: Request):
          raise HTTPException(status_code=400, detail="Password too short")
          
     # Update DB
-    db_utils.update_user_password(username, req.new_password)
+    await async_db.update_user_password(username, req.new_password)
     return {"message": "Password updated"}
 
 @app.get("/system/info")
@@ -1978,7 +3046,7 @@ async def system_info(request: Request):
     }
     
     if role == 'admin':
-        resp['pending_users'] = db_utils.get_pending_users_count()
+        resp['pending_users'] = await async_db.get_pending_users_count()
         
     return resp
 
@@ -1987,24 +3055,17 @@ async def search_youtube_endpoint(q: str):
     """Search YouTube for videos"""
     try:
         def search():
-            ydl_opts = {
-                'quiet': True,
-                'extract_flat': 'in_playlist', # Better for search results
-                'default_search': 'ytsearch10',
-                'noplaylist': True,
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with ydl_pools['search'].acquire() as ydl:
                 # If q is not a url, ytsearch10: is prefixed by default_search
                 # We need to handle URL vs Search Query manually because extract_flat for URL returns different structure
                 
                 res = ydl.extract_info(q, download=False)
                 if 'entries' in res:
-                    return res['entries']
+                    return list(res['entries']), SEARCH_CACHE_TTL
                 # If it's a direct match or single video from search logic
-                return [res] if res else []
+                return ([res] if res else []), SEARCH_CACHE_TTL
         
-        loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(executor, search)
+        results = await asyncio.wrap_future(metadata_cache.fetch(('search', q), search, interactive_executor))
         return results
     except Exception as e:
         logging.error(f"Search error: {e}")
@@ -2012,11 +3073,12 @@ async def search_youtube_endpoint(q: str):
 
 @app.post("/api/logout")
 async def logout(response: Response, request: Request):
+    username = get_session_username(request)
     token = request.cookies.get(AUTH_COOKIE_NAME)
     if token and token in sessions:
         del sessions[token]
     
-    db_utils.log_event(request.client.host, "LOGOUT", "")
+    await async_db.log_event(request.client.host, "LOGOUT", "", username)
     response.delete_cookie(AUTH_COOKIE_NAME)
     return {"message": "Logged out"}
 
@@ -2039,7 +3101,7 @@ async def get_notifications(request: Request):
         
     # 2. Role specific checks
     if role == 'admin':
-        pending = db_utils.get_pending_users_count()
+        pending = await async_db.get_pending_users_count()
         if pending > 0:
             notifs.append({
                 "id": "pending_users",
@@ -2121,6 +3183,9 @@ async def upload_cookies(request: Request, file: UploadFile = File(...)):
         file_location = os.path.join(execution_dir, "cookies.txt")
         with open(file_location, "wb+") as file_object:
             file_object.write(await file.read())
+        # Cached extractions and pooled YoutubeDL instances were made with the old cookies
+        refresh_ydl_templates()
+        metadata_cache.purge()
         return {"message": f"Cookies saved successfully."}
     except Exception as e:
         logging.error(f"Failed to save cookies: {e}")
@@ -2169,6 +3234,9 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 if __name__ == "__main__":
     import argparse
+    import multiprocessing
+    # Download worker processes in a PyInstaller build re-launch this executable
+    multiprocessing.freeze_support()
     
     parser = argparse.ArgumentParser(description='YtDlp API Server')
     parser.add_argument('--port', type=int, default=8000, help='Port to run the server on')
@@ -0,0 +1,179 @@
+import json
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+DEFAULT_TTL = 1800.0            # Seconds
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+SIGNED_URL_MARGIN = 120.0       # Stop serving signed stream URLs this long before they expire
+EXPIRY_PARAMS = ('expire', 'expires', 'Expires')
+
+def signed_url_expiry(urls: Iterable[str]) -> Optional[float]:
+    """Earliest expiry timestamp carried by signed media URLs (YouTube 'expire', CDN 'Expires')"""
+    earliest = None
+    for url in urls:
+        if not url or '?' not in url:
+            continue
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        for param in EXPIRY_PARAMS:
+            try:
+                value = float(query[param][0])
+            except (KeyError, ValueError):
+                continue
+            if value > 1e9 and (earliest is None or value < earliest): # Unix timestamps only, not durations
+                earliest = value
+    return earliest
+
+def info_ttl(info: Optional[Dict], default: float = DEFAULT_TTL, margin: float = SIGNED_URL_MARGIN) -> float:
+    """How long an extracted info dict can be served: the default TTL, cut short by signed URL expiry"""
+    if not info:
+        return default
+    urls = [info.get('url')] + [f.get('url') for f in info.get('formats') or ()]
+    expires = signed_url_expiry(urls)
+    if expires is None:
+        return default
+    return max(0.0, min(default, expires - margin - time.time()))
+
+def estimate_size(value: Any) -> int:
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'size')
+
+    def __init__(self, value: Any, expires_at: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+class MetadataCache:
+    """
+    Shared cache for yt-dlp extraction results.
+
+    - TTL per entry (the loader returns it, e.g. from info_ttl), LRU eviction beyond
+      max_entries or max_bytes (sizes are estimated once, at insert).
+    - Singleflight: concurrent fetch() calls for a key that is being loaded share the
+      loader's Future, so a burst of identical requests costs one extraction.
+    - fetch() returns a concurrent Future: threads call .result(), coroutines await
+      asyncio.wrap_future(). Cached values are shared; callers must not mutate them.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._loading: Dict[Hashable, Future] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.load_errors = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                return None
+            self.hits += 1
+            return entry.value
+
+    def fetch(self, key: Hashable, loader: Callable[[], Tuple[Any, float]], executor=None) -> Future:
+        """
+        Cached value for key, or the result of loader() -> (value, ttl). The loader runs in
+        `executor` if given, otherwise inline in the calling thread. A ttl <= 0 (or a None
+        value) is handed to the waiting callers but not stored.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                future = Future()
+                future.set_result(entry.value)
+                return future
+            future = self._loading.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            self.misses += 1
+            future = self._loading[key] = Future()
+
+        def load():
+            try:
+                value, ttl = loader()
+            except BaseException as e:
+                with self._lock:
+                    self.load_errors += 1
+                    self._loading.pop(key, None)
+                future.set_exception(e)
+                return
+            with self._lock:
+                if value is not None and ttl > 0:
+                    self._store(key, value, ttl)
+                self._loading.pop(key, None)
+            future.set_result(value)
+
+        if executor is not None:
+            executor.submit(load)
+        else:
+            load()
+        return future
+
+    def purge(self, match: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """Drop every entry, or the ones whose key matches. Returns the number dropped."""
+        with self._lock:
+            keys = [k for k in self._entries if match is None or match(k)]
+            for key in keys:
+                self._bytes -= self._entries.pop(key).size
+            return len(keys)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'loading': len(self._loading),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'load_errors': self.load_errors,
+                'hit_rate': round((self.hits + self.coalesced) / lookups, 3) if lookups else None
+            }
+
+    # --- Internal (caller holds self._lock) ---
+
+    def _lookup(self, key: Hashable) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            del self._entries[key]
+            self._bytes -= entry.size
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: Hashable, value: Any, ttl: float):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        entry = _Entry(value, time.time() + ttl, estimate_size(value))
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
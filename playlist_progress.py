@@ -0,0 +1,78 @@
+import threading
+from typing import Dict, Iterable, List, Optional
+
+ACTIVE_STATUSES = ('queued', 'downloading')
+
+class PlaylistProgress:
+    """
+    State of a playlist job, aggregated from the latest state of each entry (child job).
+
+    update() records one entry and returns the parent's fields: progress is the mean over
+    all entries (ended ones count as complete), speed the sum over running ones. The parent
+    stays 'downloading' while any entry is queued or running, is 'paused' when the others
+    are paused, and otherwise ends: 'finished' if at least one entry finished (failed ones
+    are counted in error_msg), 'cancelled' if every entry was cancelled, else 'error'.
+    Thread-safe: entries report from different download workers.
+    """
+
+    def __init__(self, child_ids: Iterable[str]):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {cid: {'status': 'queued', 'progress': 0.0, 'speed_bps': None, 'filename': None}
+                                          for cid in child_ids}
+
+    def update(self, child_id: str, status: str, progress: float = 0.0, speed_bps: Optional[float] = None,
+               filename: Optional[str] = None) -> Optional[Dict]:
+        """Record an entry's state. None if child_id is not an entry of this playlist."""
+        with self._lock:
+            if child_id not in self._entries:
+                return None
+            self._entries[child_id] = {'status': status, 'progress': progress or 0.0, 'speed_bps': speed_bps,
+                                       'filename': filename}
+            return self._summary()
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return self._summary()
+
+    def filenames(self) -> List[str]:
+        """Files of the finished entries, in playlist order"""
+        with self._lock:
+            return [e['filename'] for e in self._entries.values() if e['status'] == 'finished' and e['filename']]
+
+    def _summary(self) -> Dict:
+        total = len(self._entries)
+        counts = {}
+        progress = 0.0
+        speed = None
+        for entry in self._entries.values():
+            status = entry['status']
+            counts[status] = counts.get(status, 0) + 1
+            if status in ACTIVE_STATUSES:
+                progress += min(entry['progress'], 100.0)
+                if entry['speed_bps'] is not None:
+                    speed = (speed or 0.0) + entry['speed_bps']
+            elif status == 'paused':
+                progress += min(entry['progress'], 100.0)
+            else:
+                progress += 100.0
+        finished, failed, cancelled = counts.get('finished', 0), counts.get('error', 0), counts.get('cancelled', 0)
+
+        if any(counts.get(s) for s in ACTIVE_STATUSES):
+            status = 'downloading'
+        elif counts.get('paused'):
+            status = 'paused'
+        elif finished:
+            status = 'finished'
+        elif cancelled == total:
+            status = 'cancelled'
+        else:
+            status = 'error'
+        return {
+            'status': status,
+            'progress': round(progress / total, 1) if total else 0.0,
+            'speed_bps': speed,
+            'entries_total': total,
+            'entries_finished': finished,
+            'entries_failed': failed,
+            'error_msg': f"{failed} of {total} entries failed" if failed else None
+        }
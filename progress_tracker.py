@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_RATE = 2.0 # Snapshots per second per job
+SPEED_SMOOTHING = 0.3 # EWMA weight of the newest speed sample
+
+def format_speed(bps: Optional[float]) -> Optional[str]:
+    if bps is None:
+        return None
+    for unit in ('B/s', 'KiB/s', 'MiB/s', 'GiB/s'):
+        if bps < 1024 or unit == 'GiB/s':
+            return f"{bps:.1f} {unit}" if unit != 'B/s' else f"{bps:.0f} {unit}"
+        bps /= 1024
+
+def format_eta(seconds: Optional[float]) -> Optional[str]:
+    if seconds is None:
+        return None
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+def requested_sizes(d: Dict) -> Optional[List[int]]:
+    """Sizes of the formats a merged download will fetch (video + audio), from a progress dict.
+    None unless every one is known. Worker processes relay them as 'requested_sizes'."""
+    if 'requested_sizes' in d:
+        return d['requested_sizes']
+    info = d.get('info_dict')
+    formats = info.get('requested_formats') if isinstance(info, dict) else None
+    if not formats:
+        return None
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+    return sizes if all(sizes) else None
+
+class ProgressTracker:
+    """
+    Aggregates yt-dlp progress callbacks for one job.
+
+    update() is cheap (a few integer writes under a lock) and may be called from any
+    number of fragment threads; it returns a snapshot dict at most `rate` times per
+    second. Speed and ETA come from the byte counters (EWMA over snapshot intervals),
+    not from yt-dlp's formatted strings. Byte counts are summed over the files of the
+    job (video + audio streams); the total is seeded from the sizes of all requested
+    formats on the first update, so progress does not drop when the audio stream starts.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, smoothing: float = SPEED_SMOOTHING):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._files: Dict[str, list] = {} # filename -> [downloaded, total or None]
+        self._current = ''
+        self._requested: Optional[List[int]] = None # Sizes of the requested formats, if known
+        self._last_emit = 0.0
+        self._last_bytes = None
+        self._last_time = None
+        self._first_update = None
+        self._latest_update = None
+        self.speed = None # bytes/s, smoothed
+        self.updates = 0
+        self.snapshots = 0
+
+    def update(self, d: Dict) -> Optional[Dict]:
+        """Record one yt-dlp progress dict. Returns a snapshot when one is due, else None."""
+        now = time.monotonic()
+        with self._lock:
+            self.updates += 1
+            if self._first_update is None:
+                self._first_update = now
+            self._latest_update = now
+            if self._requested is None and not self._files:
+                self._requested = requested_sizes(d)
+            name = d.get('filename') or self._current
+            self._current = name
+            entry = self._files.get(name)
+            if entry is None:
+                entry = self._files[name] = [0, None]
+            downloaded = d.get('downloaded_bytes')
+            if downloaded is not None:
+                entry[0] = downloaded
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                entry[1] = total
+            if d.get('status') == 'finished':
+                entry[1] = entry[0] = entry[1] or entry[0]
+            if now - self._last_emit < self.interval:
+                return None
+            return self._snapshot(now)
+
+    def snapshot(self) -> Dict:
+        """Current state regardless of the rate limit"""
+        with self._lock:
+            return self._snapshot(time.monotonic())
+
+    def transfer(self) -> Tuple[int, float]:
+        """(bytes downloaded, seconds from the first to the latest update): the job's mean throughput"""
+        with self._lock:
+            downloaded = sum(f[0] for f in self._files.values())
+            if self._first_update is None:
+                return downloaded, 0.0
+            return downloaded, self._latest_update - self._first_update
+
+    def _snapshot(self, now: float) -> Dict:
+        downloaded = sum(f[0] for f in self._files.values())
+        known_total = all(f[1] for f in self._files.values())
+        total = sum(f[1] or f[0] for f in self._files.values())
+        if self._requested and len(self._files) < len(self._requested):
+            # Streams still to come: the requested sizes stand in for them
+            total = max(total, sum(self._requested))
+            known_total = True
+
+        if self._last_time is not None and now > self._last_time:
+            delta = downloaded - self._last_bytes
+            if delta >= 0: # Negative = a file restarted; skip that sample
+                rate = delta / (now - self._last_time)
+                self.speed = rate if self.speed is None else self.speed + self.smoothing * (rate - self.speed)
+        self._last_bytes = downloaded
+        self._last_time = now
+        self._last_emit = now
+        self.snapshots += 1
+
+        eta = None
+        if known_total and self.speed and self.speed > 0:
+            eta = max(0.0, (total - downloaded) / self.speed)
+        snapshot = {
+            'downloaded_bytes': downloaded,
+            'total_bytes': total if known_total else None,
+            'speed_bps': round(self.speed, 1) if self.speed is not None else None,
+            'eta_seconds': int(eta) if eta is not None else None,
+            'speed': format_speed(self.speed),
+            'eta': format_eta(eta),
+            'filename': os.path.basename(self._current)
+        }
+        if total:
+            snapshot['progress'] = round(min(downloaded / total, 1.0) * 100, 1)
+        return snapshot
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+PRIOR_LATENCY = 8.0       # Seconds assumed for a provider that never answered
+LATENCY_SMOOTHING = 0.3
+FAILURES_TO_OPEN = 3      # Consecutive failures that open a provider's circuit
+OPEN_BASE = 300.0         # First cool-down (seconds); doubles every time the circuit opens again
+OPEN_MAX = 6 * 3600.0
+TRIAL_WINDOW = 60.0       # A half-open provider gets one trial request per window
+
+class ProviderHealth:
+    """
+    Health and latency scoreboard of the fallback providers (Cobalt instances, scrapers).
+
+    Per provider: successes, failures, smoothed latency of successful answers and a
+    circuit breaker. FAILURES_TO_OPEN failures in a row take a provider out of rotation
+    for a cool-down that doubles each time it opens again; after the cool-down one trial
+    request is let through (half-open), and a success closes the circuit. rank() orders
+    the usable providers by expected time to an answer: latency / smoothed success rate;
+    begin_trial() is called when an attempt actually starts and hands out the trial.
+    rows() / load() round-trip the state through the durable store (db_utils).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._providers: Dict[str, Dict] = {}
+
+    def _get(self, name: str) -> Dict:
+        p = self._providers.get(name)
+        if p is None:
+            p = self._providers[name] = {'successes': 0, 'failures': 0, 'latency': None,
+                                         'consecutive_failures': 0, 'open_until': 0.0, 'opened': 0}
+        return p
+
+    def rank(self, names: Iterable[str]) -> List[str]:
+        """Usable providers, most promising first: closed and half-open ones (see begin_trial)"""
+        now = time.time()
+        usable = []
+        with self._lock:
+            for name in names:
+                p = self._get(name)
+                if p['open_until'] and now < p['open_until']:
+                    continue
+                success_rate = (p['successes'] + 1) / (p['successes'] + p['failures'] + 2)
+                usable.append(((p['latency'] or PRIOR_LATENCY) / success_rate, name))
+        usable.sort(key=lambda item: item[0])
+        return [name for _, name in usable]
+
+    def begin_trial(self, name: str) -> bool:
+        """Called as an attempt starts; False if the provider may not be asked now. A half-open
+        provider gets one trial per TRIAL_WINDOW, taken by the attempt, not by being ranked."""
+        now = time.time()
+        with self._lock:
+            p = self._get(name)
+            if p['open_until']:
+                if now < p['open_until']:
+                    return False
+                p['open_until'] = now + TRIAL_WINDOW
+            return True
+
+    def record_success(self, name: str, latency: float):
+        with self._lock:
+            p = self._get(name)
+            p['successes'] += 1
+            p['latency'] = latency if p['latency'] is None else p['latency'] + LATENCY_SMOOTHING * (latency - p['latency'])
+            p['consecutive_failures'] = 0
+            p['open_until'] = 0.0
+            p['opened'] = 0
+
+    def record_failure(self, name: str):
+        with self._lock:
+            p = self._get(name)
+            p['failures'] += 1
+            p['consecutive_failures'] += 1
+            if p['opened'] or p['consecutive_failures'] >= FAILURES_TO_OPEN:
+                p['opened'] += 1
+                p['open_until'] = time.time() + min(OPEN_MAX, OPEN_BASE * 2 ** (p['opened'] - 1))
+
+    def rows(self) -> List[Tuple]:
+        with self._lock:
+            return [(name, p['successes'], p['failures'], p['latency'], p['consecutive_failures'], p['open_until'], p['opened'])
+                    for name, p in self._providers.items()]
+
+    def load(self, rows: Iterable[Tuple]):
+        with self._lock:
+            for name, successes, failures, latency, consecutive, open_until, opened in rows:
+                self._providers[name] = {'successes': successes, 'failures': failures, 'latency': latency,
+                                         'consecutive_failures': consecutive, 'open_until': open_until or 0.0,
+                                         'opened': opened}
+
+    def stats(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            return {name: {'state': 'closed' if not p['open_until'] else 'open' if now < p['open_until'] else 'half-open',
+                           'successes': p['successes'],
+                           'failures': p['failures'],
+                           'latency_ms': round(p['latency'] * 1000) if p['latency'] is not None else None}
+                    for name, p in self._providers.items()}
+
+async def hedged_race(candidates: Iterable[str], attempt: Callable[[str], Awaitable], health: ProviderHealth,
+                      width: int = 3, hedge_delay: float = 3.0, timeout: float = 15.0,
+                      timeouts: Optional[Dict[str, float]] = None) -> Optional[Tuple[str, object]]:
+    """
+    Ask the best `width` providers first; without a winner, `width` more join every
+    `hedge_delay` seconds (or as soon as every running attempt ended). The first
+    non-empty result wins and the remaining attempts are cancelled. Each attempt is
+    limited to `timeout` seconds, or to its provider's entry in `timeouts` (providers
+    that are slow by design, e.g. converting before they answer). Half-open providers
+    are skipped when another race already holds their trial.
+    Outcomes feed `health`: a result is a success, an exception (unreachable, HTTP 5xx) or
+    timeout a failure. An empty result means the provider answered but cannot serve this
+    content; that says nothing about its health and is not counted, so one unservable URL
+    does not open every provider's circuit. Cancelled losers are not counted either.
+    Returns (provider, result) or None.
+    """
+    loop = asyncio.get_running_loop()
+    ranked = health.rank(candidates)
+    pending: Dict[asyncio.Future, Tuple[str, float]] = {}
+    launched = 0
+    next_hedge = 0.0
+
+    def launch():
+        nonlocal launched, next_hedge
+        started = 0
+        while launched < len(ranked) and started < width:
+            name = ranked[launched]
+            launched += 1
+            if not health.begin_trial(name):
+                continue
+            limit = (timeouts or {}).get(name, timeout)
+            pending[asyncio.ensure_future(asyncio.wait_for(attempt(name), limit))] = (name, loop.time())
+            started += 1
+        next_hedge = loop.time() + hedge_delay
+
+    launch()
+    try:
+        while pending:
+            wait = max(0.0, next_hedge - loop.time()) if launched < len(ranked) else None
+            done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name, started = pending.pop(task)
+                if task.cancelled() or task.exception() is not None:
+                    health.record_failure(name)
+                    continue
+                result = task.result()
+                if result:
+                    health.record_success(name, loop.time() - started)
+                    return name, result
+            if launched < len(ranked) and (not pending or loop.time() >= next_hedge):
+                launch()
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -12,6 +12,7 @@ import httpx
 from fastapi import HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 import db_utils
+from db_async import async_db
 
 # Configuration
 # Persistent Key Loading
@@ -121,7 +122,7 @@ class ProxyService:
             logging.error(f"Decryption failed: {e}")
             raise HTTPException(status_code=400, detail="Invalid payload")
 
-    async def proxy_request(self, url: str, client_ip: str = "unknown"):
+    async def proxy_request(self, url: str, client_ip: str = "unknown", username: str = None):
         # Security checks
         if not (url.startswith("http://") or url.startswith("https://")):
             # Try to fix protocol if missing (though frontend should handle this)
@@ -133,7 +134,7 @@ class ProxyService:
              raise HTTPException(status_code=403, detail="Access denied")
 
         try:
-            db_utils.log_event(client_ip, "PROXY_ACCESS", url)
+            await async_db.log_event(client_ip, db_utils.PROXY_EVENT, url, username)
             # Use shared client
             req = self.client.build_request("GET", url)
             r = await self.client.send(req, stream=True)
@@ -624,7 +625,7 @@ class ProxyService:
 
         return str(soup)
 
-    async def stream_response(self, response: httpx.Response, client_ip: str = "unknown", limit_bps: int = None):
+    async def stream_response(self, response: httpx.Response, client_ip: str = "unknown", limit_bps: int = None, username: str = None):
         try:
             total_bytes = 0
             
@@ -687,7 +688,7 @@ class ProxyService:
                         await asyncio.sleep(expected_time)
             
             # Log bandwidth
-            db_utils.log_bandwidth(client_ip, total_bytes, 0, "proxy")
+            await async_db.log_bandwidth(client_ip, total_bytes, 0, "proxy", username)
         except Exception as e:
             logging.error(f"Stream error: {e}")
         finally:
@@ -0,0 +1,211 @@
+import random
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Error classes
+TRANSIENT = 'transient'   # Network hiccups, 5xx, crashed worker: the same request will likely work later
+THROTTLED = 'throttled'   # 429 / 403 from the site: slow down, fresh signed URLs
+FORMAT = 'format'         # Format selection failed: the extraction itself is fine
+AUTH = 'auth'             # Bot check, login, members-only: other credentials
+GEO = 'geo'               # Blocked in the server's region: only another route helps
+PERMANENT = 'permanent'   # Removed, terminated, unsupported: nothing will help
+UNKNOWN = 'unknown'       # Unrecognised: straight to the fallback chain, as before classification
+
+# Recovery actions, cheapest first
+REFORMAT = 'reformat'     # Same extracted info, more generic format selector
+BACKOFF = 'backoff'       # Wait, then the same attempt (yt-dlp resumes the .part file)
+REFRESH = 'refresh'       # Wait longer, drop the cached extraction, fewer fragment threads
+COOKIES = 'cookies'       # Browser cookies instead of cookies.txt (extracts again)
+FALLBACK = 'fallback'     # Cobalt / scraper chain
+FAIL = 'fail'             # Give up without the fallback chain
+TERMINAL_ACTIONS = (FALLBACK, FAIL)
+
+# (class, pattern) in match order: the first hit wins, so specific causes come before the
+# generic network errors they are usually wrapped in ("Unable to download webpage: HTTP Error 429")
+DEFAULT_RULES: List[Tuple[str, str]] = [
+    (THROTTLED, r'HTTP Error 429|Too Many Requests|HTTP Error 403|rate.?limit'),
+    (GEO, r'available in your country|geo.?restrict|available from your location|blocked it in your country'),
+    (AUTH, r'Sign in to confirm|Sign in if|login required|for the authentication|registered users|members.only|'
+           r'Join this channel|confirm your age|age.restricted|HTTP Error 401|downloaded file is empty'),
+    (FORMAT, r'Requested format is not available|requested format not available'),
+    (PERMANENT, r'Unsupported URL|is not a valid URL|Video unavailable|has been removed|no longer available|'
+                r'Private video|HTTP Error 404|HTTP Error 410|account .* terminated'),
+    (TRANSIENT, r'timed out|Connection reset|Connection refused|Connection aborted|Remote end closed|'
+                r'Temporary failure in name resolution|Name or service not known|Network is unreachable|'
+                r'IncompleteRead|HTTP Error 5\d\d|EOF occurred|Unable to download webpage'),
+]
+# Exception types that are transient whatever their message (matched by name: the download
+# worker re-raises child process errors as plain exceptions, and pools live in other modules)
+TRANSIENT_TYPES = ('WorkerCrashed', 'ConnectionError', 'TimeoutError', 'IncompleteDownload')
+
+# Steps tried per class, in order; steps the caller cannot take (can=) are skipped
+DEFAULT_PLANS: Dict[str, Tuple[str, ...]] = {
+    TRANSIENT: (BACKOFF, BACKOFF, BACKOFF, FALLBACK),
+    THROTTLED: (REFRESH, FALLBACK),
+    FORMAT: (REFORMAT, REFORMAT, FALLBACK),
+    AUTH: (COOKIES, FALLBACK),
+    GEO: (FALLBACK,),
+    PERMANENT: (FAIL,),
+    UNKNOWN: (FALLBACK,),
+}
+BACKOFF_BASE = {BACKOFF: 2.0, REFRESH: 20.0} # Seconds before the first retry; doubles per retry
+BACKOFF_MAX = 120.0
+BACKOFF_JITTER = 0.25     # +/- share of the delay, so retries of parallel jobs do not line up
+MAX_RETRIES = 5           # Recoveries per download across all classes, before the fallback chain
+SAMPLE_LENGTH = 300       # Characters of the last message kept per class
+
+class Step(NamedTuple):
+    error_class: str
+    action: str
+    delay: float = 0.0    # Seconds to wait before the next attempt
+
+def sleep(delay: float, should_stop: Optional[Callable[[], Optional[str]]] = None, interval: float = 0.5) -> Optional[str]:
+    """Wait `delay` seconds in slices; returns the stop reason as soon as `should_stop()` gives one"""
+    deadline = time.monotonic() + delay
+    while True:
+        reason = should_stop() if should_stop else None
+        if reason:
+            return reason
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(interval, remaining))
+
+class RetryPolicy:
+    """
+    Error classification and recovery plans for run_download.
+
+    classify() maps an exception to an error class by type name and message rules
+    (add_rule() puts site specific patterns in front). Each class has a plan: the
+    recovery actions to take, cheapest first (set_plan() replaces one). A download's
+    RetrySession walks the plans and reports what each action led to; per class and
+    action the policy counts how often it was tried and how often the next attempt
+    worked, with the backoff time spent, so plans can be tuned from real outcomes.
+    rows() / load() round-trip the counters through the durable store (db_utils).
+    """
+
+    def __init__(self, rules: Iterable[Tuple[str, str]] = DEFAULT_RULES, plans: Optional[Dict[str, Tuple[str, ...]]] = None,
+                 max_retries: int = MAX_RETRIES, rng: Optional[random.Random] = None):
+        self._lock = threading.Lock()
+        self._rules = [(error_class, re.compile(pattern, re.IGNORECASE)) for error_class, pattern in rules]
+        self.plans = dict(DEFAULT_PLANS, **(plans or {}))
+        self.max_retries = max_retries
+        self._rng = rng or random.Random()
+        self._outcomes: Dict[Tuple[str, str], Dict] = {}
+        self._samples: Dict[str, str] = {}
+
+    def add_rule(self, error_class: str, pattern: str):
+        """Matched before the built-in rules"""
+        with self._lock:
+            self._rules.insert(0, (error_class, re.compile(pattern, re.IGNORECASE)))
+
+    def set_plan(self, error_class: str, steps: Iterable[str]):
+        self.plans[error_class] = tuple(steps)
+
+    def classify(self, error: BaseException) -> str:
+        message = str(error)
+        for error_class, pattern in self._rules:
+            if pattern.search(message):
+                return error_class
+        if any(cls.__name__ in TRANSIENT_TYPES for cls in type(error).__mro__):
+            return TRANSIENT
+        return UNKNOWN
+
+    def delay(self, action: str, retry: int) -> float:
+        """Backoff before the `retry`-th retry (0-based) of an action"""
+        base = BACKOFF_BASE.get(action)
+        if not base:
+            return 0.0
+        delay = min(BACKOFF_MAX, base * 2 ** retry)
+        return delay * (1 + self._rng.uniform(-BACKOFF_JITTER, BACKOFF_JITTER))
+
+    def session(self) -> 'RetrySession':
+        return RetrySession(self)
+
+    def record(self, step: Step, recovered: bool):
+        with self._lock:
+            o = self._outcomes.get((step.error_class, step.action))
+            if o is None:
+                o = self._outcomes[(step.error_class, step.action)] = {'tried': 0, 'recovered': 0, 'delay': 0.0}
+            o['tried'] += 1
+            o['recovered'] += int(recovered)
+            o['delay'] += step.delay
+
+    def note(self, error_class: str, message: str):
+        with self._lock:
+            self._samples[error_class] = message[:SAMPLE_LENGTH]
+
+    def rows(self) -> List[tuple]:
+        with self._lock:
+            return [(error_class, action, o['tried'], o['recovered'], o['delay'])
+                    for (error_class, action), o in self._outcomes.items()]
+
+    def load(self, rows: Iterable[tuple]):
+        with self._lock:
+            for error_class, action, tried, recovered, delay in rows:
+                self._outcomes[(error_class, action)] = {'tried': tried, 'recovered': recovered, 'delay': delay}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            classes: Dict[str, Dict] = {}
+            for (error_class, action), o in sorted(self._outcomes.items()):
+                c = classes.setdefault(error_class, {'errors': 0, 'actions': {}})
+                c['errors'] += o['tried'] # Every classified error leads to exactly one step
+                c['actions'][action] = {
+                    'tried': o['tried'],
+                    'recovered': o['recovered'],
+                    'recovery_rate': round(o['recovered'] / o['tried'], 3) if o['tried'] else None,
+                    'avg_delay': round(o['delay'] / o['tried'], 1) if o['tried'] else None
+                }
+            for error_class, message in self._samples.items():
+                classes.setdefault(error_class, {'errors': 0, 'actions': {}})['last_error'] = message
+            return classes
+
+class RetrySession:
+    """
+    Retry state of one download. next_step(error) classifies the error and returns the
+    next action of its class's plan; the outcome of that action is settled by the next
+    next_step() (it failed) or by settle() (the attempt or fallback after it finished).
+    """
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.steps: List[Step] = []
+        self.pending: Optional[Step] = None
+        self._position: Dict[str, int] = {} # Class -> next index into its plan
+        self._retries: Dict[str, int] = {}  # Action -> times taken (backoff doubles per retry)
+
+    def next_step(self, error: BaseException, can: Optional[Callable[[str], bool]] = None) -> Step:
+        self.settle(False)
+        error_class = self.policy.classify(error)
+        self.policy.note(error_class, str(error))
+        plan = self.policy.plans.get(error_class) or (FALLBACK,)
+        recoveries = sum(1 for s in self.steps if s.action not in TERMINAL_ACTIONS)
+        action = FALLBACK
+        position = self._position.get(error_class, 0)
+        while position < len(plan):
+            candidate = plan[position]
+            position += 1
+            if candidate in TERMINAL_ACTIONS:
+                action = candidate
+                break
+            if recoveries < self.policy.max_retries and (can is None or can(candidate)):
+                action = candidate
+                break
+        self._position[error_class] = position
+        retry = self._retries.get(action, 0)
+        self._retries[action] = retry + 1
+        step = Step(error_class, action, self.policy.delay(action, retry))
+        self.steps.append(step)
+        self.pending = step
+        return step
+
+    def settle(self, success: bool) -> bool:
+        """Record the outcome of the pending step; False if there was none"""
+        step, self.pending = self.pending, None
+        if step is None:
+            return False
+        self.policy.record(step, success)
+        return True
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_CONNECTIONS = 4
+MIN_SEGMENT = 4 * 1024 * 1024   # Files below two segments are streamed in one request
+WRITE_BUFFER = 1024 * 1024      # Bytes gathered per write (each write is one hop to the executor)
+SEGMENT_RETRIES = 3
+CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+class IncompleteDownload(Exception):
+    pass
+
+def split_ranges(total: int, connections: int, min_segment: int = MIN_SEGMENT) -> List[Tuple[int, int]]:
+    """Inclusive (start, end) byte ranges covering `total` bytes, at most `connections` of them"""
+    count = max(1, min(connections, total // max(1, min_segment)))
+    size = -(-total // count)
+    return [(start, min(start + size, total) - 1) for start in range(0, total, size)]
+
+async def probe_ranges(client, url: str, headers: Optional[Dict] = None) -> Optional[int]:
+    """Total size when the origin answers byte-range requests, else None"""
+    async with client.stream("GET", url, headers=dict(headers or {}, Range="bytes=0-0")) as r:
+        if r.status_code != 206:
+            return None # Not reading a full 200 body: the connection is closed instead
+        await r.aread() # One byte; a fully read response returns its connection to the pool
+        match = CONTENT_RANGE.match(r.headers.get('content-range', ''))
+        if not match or match.group(3) == '*':
+            return None
+        return int(match.group(3))
+
+def _allocate(path: str, size: int):
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+def _open_at(path: str, offset: int):
+    # One handle per segment, positioned once: writes of different segments never move each
+    # other's file position (os.pwrite would do, but is not available on Windows)
+    f = open(path, 'r+b')
+    f.seek(offset)
+    return f
+
+class _Segment:
+    __slots__ = ('start', 'end', 'done')
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.done = 0 # Bytes written to disk
+
+    @property
+    def remaining(self) -> int:
+        return self.end - self.start + 1 - self.done
+
+async def _write(loop, executor, f, buffer: bytearray, report: Callable[[int], None]) -> int:
+    data = bytes(buffer)
+    buffer.clear()
+    await loop.run_in_executor(executor, f.write, data)
+    report(len(data))
+    return len(data)
+
+async def _fetch_segment(client, url: str, path: str, segment: _Segment, headers: Optional[Dict],
+                         executor, report: Callable[[int], None], retries: int):
+    """Download one byte range. A failed request resumes from the bytes already written."""
+    loop = asyncio.get_running_loop()
+    f = await loop.run_in_executor(executor, _open_at, path, segment.start)
+    try:
+        for attempt in range(retries + 1):
+            try:
+                byte_range = f"bytes={segment.start + segment.done}-{segment.end}"
+                async with client.stream("GET", url, headers=dict(headers or {}, Range=byte_range)) as r:
+                    if r.status_code != 206:
+                        raise IncompleteDownload(f"Range request answered {r.status_code}")
+                    buffer = bytearray()
+                    async for chunk in r.aiter_bytes():
+                        buffer += chunk
+                        if len(buffer) > segment.remaining:
+                            del buffer[segment.remaining:] # Origin sent more than asked: stop here
+                            break
+                        if len(buffer) >= WRITE_BUFFER:
+                            segment.done += await _write(loop, executor, f, buffer, report)
+                    if buffer:
+                        segment.done += await _write(loop, executor, f, buffer, report)
+                if segment.remaining > 0:
+                    raise IncompleteDownload(f"Segment {segment.start}-{segment.end} ended {segment.remaining} bytes early")
+                return
+            except Exception:
+                if attempt == retries:
+                    raise
+                await asyncio.sleep(min(0.5 * 2 ** attempt, 5.0))
+    finally:
+        await loop.run_in_executor(executor, f.close)
+
+async def _download_stream(client, url: str, path: str, headers: Optional[Dict], executor,
+                           on_progress: Optional[Callable[[int, Optional[int]], None]]) -> int:
+    loop = asyncio.get_running_loop()
+    downloaded = 0
+    total = None
+
+    def report(n):
+        nonlocal downloaded
+        downloaded += n
+        if on_progress:
+            on_progress(downloaded, total)
+
+    f = await loop.run_in_executor(executor, open, path, 'wb')
+    try:
+        async with client.stream("GET", url, headers=headers) as r:
+            r.raise_for_status()
+            if not r.headers.get('content-encoding'): # Content-Length counts encoded bytes
+                total = int(r.headers.get('content-length') or 0) or None
+            buffer = bytearray()
+            async for chunk in r.aiter_bytes():
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER:
+                    await _write(loop, executor, f, buffer, report)
+            if buffer:
+                await _write(loop, executor, f, buffer, report)
+    finally:
+        await loop.run_in_executor(executor, f.close)
+    if total is not None and downloaded != total:
+        raise IncompleteDownload(f"Got {downloaded} of {total} bytes")
+    return downloaded
+
+async def download_file(client, url: str, path: str, connections: int = DEFAULT_CONNECTIONS,
+                        headers: Optional[Dict] = None, executor=None,
+                        on_progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                        min_segment: int = MIN_SEGMENT, retries: int = SEGMENT_RETRIES) -> int:
+    """
+    Download `url` to `path` and return the number of bytes.
+
+    When the origin serves byte ranges, the file is preallocated and split into up to
+    `connections` ranges fetched concurrently over the client's connection pool; each
+    segment writes at its own offset (in `executor`, off the event loop) and a failed
+    segment resumes where it stopped. Otherwise a single streamed GET is used. The size
+    on disk is checked against the origin's total either way.
+    `client` is an httpx.AsyncClient (anything with a compatible .stream()).
+    """
+    total = await probe_ranges(client, url, headers) if connections > 1 else None
+    if total is None or total < 2 * min_segment:
+        return await _download_stream(client, url, path, headers, executor, on_progress)
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, _allocate, path, total)
+    segments = [_Segment(start, end) for start, end in split_ranges(total, connections, min_segment)]
+    downloaded = 0
+
+    def report(n):
+        nonlocal downloaded
+        downloaded += n
+        if on_progress:
+            on_progress(downloaded, total)
+
+    tasks = [asyncio.ensure_future(_fetch_segment(client, url, path, s, headers, executor, report, retries))
+             for s in segments]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    size = await loop.run_in_executor(executor, os.path.getsize, path)
+    written = sum(s.done for s in segments)
+    if written != total or size != total:
+        raise IncompleteDownload(f"Wrote {written} of {total} bytes ({size} on disk)")
+    return total
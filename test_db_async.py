@@ -0,0 +1,111 @@
+"""
+Checks that DB access through db_async keeps the event loop responsive
+while the database is artificially slowed down.
+
+Run: python test_db_async.py   (or pytest test_db_async.py)
+Uses a temporary database, never touches server.db.
+"""
+import os
+import time
+import asyncio
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+import db_utils
+from db_async import AsyncDB
+
+SLOW_QUERY_SECONDS = 0.3
+TICK = 0.01
+
+@contextmanager
+def temp_db(monkeypatch):
+    monkeypatch.setattr(db_utils, 'DB_PATH', os.path.join(tempfile.mkdtemp(prefix="dbasync_"), "server.db"))
+    db_utils.init_db()
+    try:
+        yield
+    finally:
+        db_utils.close_db() # Before DB_PATH is restored: no thread keeps a handle on the temp file
+
+@pytest.fixture
+def db(monkeypatch):
+    with temp_db(monkeypatch):
+        yield
+
+class SlowDB:
+    """db_utils stand-in whose reads sleep like a stalled disk / held write lock"""
+    def __getattr__(self, name):
+        return getattr(db_utils, name)
+
+    @staticmethod
+    def get_logs(limit=100):
+        time.sleep(SLOW_QUERY_SECONDS)
+        return db_utils.get_logs(limit)
+
+async def heartbeat(stop: asyncio.Event) -> float:
+    """Tick every TICK seconds; return the worst gap seen (loop stall)"""
+    worst = 0.0
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(TICK)
+        now = time.perf_counter()
+        worst = max(worst, now - last - TICK)
+        last = now
+    return worst
+
+async def run_load(call) -> float:
+    stop = asyncio.Event()
+    hb = asyncio.create_task(heartbeat(stop))
+    await asyncio.sleep(TICK * 3)
+    await call()
+    stop.set()
+    return await hb
+
+def test_event_loop_keeps_serving_with_slow_db(db):
+    async_db = AsyncDB(SlowDB(), max_workers=2)
+
+    async def call():
+        results = await asyncio.gather(*[async_db.get_logs(limit=10) for _ in range(4)])
+        assert all(isinstance(r, list) for r in results)
+
+    try:
+        stall = asyncio.run(run_load(call))
+    finally:
+        async_db.shutdown()
+    print(f"async facade: worst loop stall {stall * 1000:.1f} ms")
+    assert stall < SLOW_QUERY_SECONDS / 3
+
+def test_direct_call_blocks_loop(db):
+    # Control: the same slow call made directly on the loop stalls it for the full duration
+    slow = SlowDB()
+
+    async def call():
+        slow.get_logs(limit=10)
+
+    stall = asyncio.run(run_load(call))
+    print(f"direct call:  worst loop stall {stall * 1000:.1f} ms")
+    assert stall >= SLOW_QUERY_SECONDS * 0.8
+
+def test_write_behind_calls_stay_inline(db):
+    async_db = AsyncDB(db_utils)
+    db_utils.start_writer()
+    try:
+        async def call():
+            for _ in range(100):
+                await async_db.log_event("127.0.0.1", "TEST", "x", "admin")
+        asyncio.run(call())
+        assert async_db.stats()["queued"] == 0
+    finally:
+        db_utils.stop_writer()
+        async_db.shutdown()
+    assert db_utils.query_one("SELECT count(*) FROM logs WHERE event_type = 'TEST'")[0] == 100
+
+if __name__ == "__main__":
+    for test in (test_event_loop_keeps_serving_with_slow_db, test_direct_call_blocks_loop, test_write_behind_calls_stay_inline):
+        try:
+            with pytest.MonkeyPatch.context() as mp, temp_db(mp):
+                test(None)
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
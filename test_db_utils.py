@@ -0,0 +1,135 @@
+"""
+db_utils connection management: close_db() reaches the connections of every thread,
+and the retention thread is joined when it is stopped. Bandwidth rollups: the per-IP
+hourly buckets are filled (and backfilled on databases that lack them) and read, and
+retention prunes every rollup on its own horizon. Renaming a user adds their counters onto the new name's.
+
+Run: python test_db_utils.py   (or pytest test_db_utils.py)
+Uses a temporary database, never touches server.db.
+"""
+import os
+import queue
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+import db_utils
+
+@contextmanager
+def temp_db(monkeypatch):
+    monkeypatch.setattr(db_utils, 'DB_PATH', os.path.join(tempfile.mkdtemp(prefix="dbutils_"), "server.db"))
+    db_utils.init_db()
+    try:
+        yield
+    finally:
+        db_utils.close_db() # Before DB_PATH is restored: no thread keeps a handle on the temp file
+
+@pytest.fixture
+def db(monkeypatch):
+    with temp_db(monkeypatch):
+        yield
+
+def test_close_db_reaches_every_thread(db):
+    # A long-lived worker thread with its own connection, asked to query on demand
+    tasks, answers = queue.Queue(), queue.Queue()
+
+    def worker():
+        for _ in iter(tasks.get, None):
+            try:
+                answers.put(db_utils.query_one("SELECT count(*) FROM users")[0])
+            except Exception as e:
+                answers.put(e)
+
+    def ask():
+        tasks.put(True)
+        return answers.get(timeout=5)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        users = ask()
+        assert isinstance(users, int)
+        db_utils.close_db()
+        assert ask() == users # Reconnected instead of ProgrammingError on a closed handle
+        assert db_utils.query_one("SELECT count(*) FROM users")[0] == users
+    finally:
+        tasks.put(None)
+        thread.join(5)
+
+def test_stop_retention_joins_the_thread(db):
+    db_utils.start_retention(interval=3600)
+    thread = db_utils._retention_thread
+    db_utils.stop_retention()
+    assert not thread.is_alive() and db_utils._retention_thread is None
+    assert db_utils.retention_stats['runs'] >= 1
+
+def test_hourly_ip_rollup_is_filled_and_read(db):
+    # A database from the version that dropped the hourly buckets, with raw rows still around
+    with db_utils.transaction() as c:
+        c.execute("DROP TABLE bandwidth_ip_hourly")
+        c.execute("DROP TRIGGER bandwidth_rollup")
+        c.execute(db_utils.SQL_INSERT_BANDWIDTH, (time.time(), "10.0.0.1", 50, 0, "proxy", None))
+    db_utils.init_db()
+    assert db_utils.get_ip_bandwidth_hourly("10.0.0.1") == [
+        {"hour": int(time.time() // 3600) * 3600, "bytes_sent": 50, "bytes_received": 0, "requests": 1}]
+
+    db_utils.log_bandwidth("10.0.0.1", 100, 20, "proxy")
+    db_utils.log_bandwidth("10.0.0.2", 1, 0, "api")
+    [hour] = db_utils.get_ip_bandwidth_hourly("10.0.0.1")
+    assert (hour["bytes_sent"], hour["bytes_received"], hour["requests"]) == (150, 20, 2)
+    stats = db_utils.get_bandwidth_stats()
+    assert stats["top_ips_24h"] == [{"ip": "10.0.0.1", "total": 170, "requests": 2},
+                                    {"ip": "10.0.0.2", "total": 1, "requests": 1}]
+    assert stats["total_sent"] == 101 # Lifetime totals are only backfilled on a fresh database
+
+def test_retention_prunes_every_rollup(db):
+    now = time.time()
+    with db_utils.transaction() as c:
+        for ip, age_days in (("10.0.0.1", 100), ("10.0.0.2", 0)):
+            c.execute(db_utils.SQL_INSERT_BANDWIDTH, (now - age_days * 86400, ip, 100, 0, "proxy", "alice"))
+    db_utils.run_retention()
+
+    def count(table):
+        return db_utils.query_one(f"SELECT count(*) FROM {table}")[0]
+
+    for table in ('bandwidth', 'bandwidth_ip_hourly', 'bandwidth_type_daily', 'bandwidth_ip_totals',
+                  'user_activity_daily'):
+        assert count(table) == 1, table
+    assert db_utils.query_one("SELECT ip FROM bandwidth_ip_totals")[0] == "10.0.0.2"
+    # Lifetime counters keep everything
+    assert db_utils.get_bandwidth_stats()["total_sent"] == 200
+    assert db_utils.query_one("SELECT bytes_sent FROM user_totals WHERE username = 'alice'")[0] == 200
+    assert not db_utils.query_one("SELECT 1 FROM sqlite_master WHERE name = 'idx_logs_ip_event_ts'")
+
+def test_rename_merges_user_counters(db):
+    # Activity logged under the new name before the rename (e.g. an earlier account of that name)
+    now = time.time()
+    with db_utils.transaction() as c:
+        for username, sent in (("old", 100), ("old", 10), ("new", 1)):
+            c.execute(db_utils.SQL_INSERT_BANDWIDTH, (now, "10.0.0.1", sent, 0, "proxy", username))
+        c.execute(db_utils.SQL_INSERT_LOG, (now - 86400, "10.0.0.1", db_utils.DOWNLOAD_EVENT, "v", "old"))
+        c.execute(db_utils.SQL_INSERT_LOG, (now, "10.0.0.1", db_utils.DOWNLOAD_EVENT, "v", "new"))
+        c.execute("INSERT INTO users (username, password, role) VALUES ('old', 'x', 'personal')")
+        user_id = c.lastrowid
+    db_utils.update_user(user_id, username="new")
+
+    stats = db_utils.get_user_stats(user_id)
+    assert stats["downloads_total"] == 2 and stats["bandwidth_total"] == 111
+    assert stats["downloads_30d"] == 2 and stats["bandwidth_30d"] == 111
+    assert stats["last_activity"] == now
+    assert not db_utils.query_one("SELECT 1 FROM user_totals WHERE username = 'old'")
+    assert not db_utils.query_one("SELECT 1 FROM user_activity_daily WHERE username = 'old'")
+
+if __name__ == "__main__":
+    for test in (test_close_db_reaches_every_thread, test_stop_retention_joins_the_thread,
+                 test_hourly_ip_rollup_is_filled_and_read, test_retention_prunes_every_rollup,
+                 test_rename_merges_user_counters):
+        try:
+            with pytest.MonkeyPatch.context() as mp, temp_db(mp):
+                test(None)
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
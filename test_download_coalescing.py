@@ -0,0 +1,80 @@
+"""
+Singleflight for identical download submissions: URL normalization, option keys,
+leader / follower bookkeeping and concurrent claims.
+
+Run: python test_download_coalescing.py   (or pytest test_download_coalescing.py)
+"""
+import threading
+
+from download_coalescing import DownloadCoalescer, coalesce_key, normalize_url
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+
+def test_youtube_variants_normalize_to_one_url():
+    canonical = normalize_url("https://www.youtube.com/watch?v=abc123")
+    assert canonical == "https://youtube.com/watch?v=abc123"
+    for url in ("https://youtu.be/abc123?si=tracking",
+                "http://m.youtube.com/watch?v=abc123&feature=share#comments",
+                "https://youtube.com/shorts/abc123",
+                "https://www.youtube.com/watch?t=42&v=abc123&utm_source=x",
+                "  https://YouTube.com/watch?v=abc123  "):
+        assert normalize_url(url) == canonical, url
+
+def test_distinct_videos_and_lists_stay_distinct():
+    assert normalize_url("https://youtu.be/abc") != normalize_url("https://youtu.be/abd")
+    assert normalize_url("https://youtube.com/playlist?list=PL1") != normalize_url("https://youtube.com/playlist?list=PL2")
+    assert normalize_url("https://example.com/a?b=2&a=1") == normalize_url("https://example.com/a?a=1&b=2")
+
+def test_key_depends_on_options():
+    url = "https://youtu.be/abc"
+    assert coalesce_key(url, {'type': 'video'}) == coalesce_key("https://youtube.com/watch?v=abc", {'type': 'video'})
+    assert coalesce_key(url, {'type': 'audio', 'audio_format': 'mp3'}) != coalesce_key(url, {'type': 'audio', 'audio_format': 'm4a'})
+
+def test_followers_attach_until_release():
+    co = DownloadCoalescer()
+    leader, f1, f2 = Job('L'), Job('F1'), Job('F2')
+    assert co.claim('k', leader, 'req-L') is None
+    assert co.claim('k', f1, 'req-F1') == 'L'
+    assert co.claim('k', f2, 'req-F2') == 'L'
+    assert co.followers('L') == [f1, f2]
+
+    assert co.detach('F1')
+    assert not co.detach('F1')
+    assert co.release('L') == [(f2, 'req-F2')]
+    assert co.followers('L') == []
+    # Flight closed: the next submission leads a new one
+    assert co.claim('k', Job('N'), 'req-N') is None
+    assert co.stats() == {'flights': 1, 'followers': 0, 'coalesced_total': 2}
+
+def test_concurrent_claims_elect_one_leader():
+    co = DownloadCoalescer()
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(16)
+
+    def submit(n):
+        barrier.wait()
+        leader = co.claim('same', Job(f"J{n}"), None)
+        with lock:
+            results.append(leader)
+
+    threads = [threading.Thread(target=submit, args=(n,)) for n in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results.count(None) == 1
+    assert len(set(r for r in results if r)) == 1
+    assert len(co.release(next(r for r in results if r))) == 15
+
+if __name__ == "__main__":
+    for test in (test_youtube_variants_normalize_to_one_url, test_distinct_videos_and_lists_stay_distinct,
+                 test_key_depends_on_options, test_followers_attach_until_release,
+                 test_concurrent_claims_elect_one_leader):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
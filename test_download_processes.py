@@ -0,0 +1,108 @@
+"""
+Worker-process downloads: progress relay, hard cancel, timeout and error propagation.
+Uses stand-in task bodies instead of yt-dlp so no network is needed.
+
+Run: python test_download_processes.py   (or pytest test_download_processes.py)
+"""
+import time
+import threading
+
+import yt_dlp
+from download_processes import DownloadProcessPool, DownloadCancelled, DownloadTimeout
+
+def fake_download(url, opts, hook):
+    for i in range(1, 4):
+        hook({'status': 'downloading', 'downloaded_bytes': i * 100, 'total_bytes': 300, 'info_dict': object()})
+        time.sleep(0.3) # Longer than PROGRESS_INTERVAL so every update is sent
+    hook({'status': 'finished', 'filename': f"{url}.mp4"})
+    return {'title': url, 'opts_seen': sorted(opts)}
+
+def hung_extractor(url, opts, hook):
+    if url == "hang":
+        time.sleep(3600)
+    return {'title': url}
+
+def failing_download(url, opts, hook):
+    if url == "format":
+        raise yt_dlp.utils.DownloadError("ERROR: Requested format is not available")
+    raise RuntimeError("boom")
+
+def test_progress_relayed_and_worker_reused():
+    pool = DownloadProcessPool(1, runner=fake_download)
+    progress = []
+    try:
+        info = pool.run("job-1", "a", {'format': 'best', 'progress_hooks': [print]}, progress.append, timeout=60)
+        assert info == {'title': 'a', 'opts_seen': ['format']}
+        assert [p['status'] for p in progress] == ['downloading'] * 3 + ['finished']
+        assert 'info_dict' not in progress[0]
+        pool.run("job-2", "b", {}, progress.append, timeout=60)
+        assert pool.stats()["spawned"] == 1
+    finally:
+        pool.shutdown()
+
+def test_timeout_kills_worker():
+    pool = DownloadProcessPool(1, runner=hung_extractor)
+    try:
+        t0 = time.monotonic()
+        try:
+            pool.run("job-1", "hang", {}, lambda d: None, timeout=1)
+            assert False, "expected timeout"
+        except DownloadTimeout:
+            pass
+        assert time.monotonic() - t0 < 5
+        stats = pool.stats()
+        assert stats["timeouts"] == 1 and stats["killed"] == 1 and stats["busy"] == 0
+        # Next job gets a fresh worker
+        assert pool.run("job-2", "ok", {}, lambda d: None, timeout=30) == {'title': 'ok'}
+    finally:
+        pool.shutdown()
+
+def test_hard_cancel():
+    pool = DownloadProcessPool(1, runner=hung_extractor)
+    result = {}
+    stop_requests = {}
+
+    def runner():
+        try:
+            pool.run("job-1", "hang", {}, lambda d: None, should_stop=lambda: stop_requests.get("job-1"))
+        except DownloadCancelled as e:
+            result["cancelled"] = str(e)
+
+    t = threading.Thread(target=runner)
+    t.start()
+    try:
+        deadline = time.monotonic() + 30
+        while not pool.stats()["busy"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.5)
+        stop_requests["job-1"] = "Deleted" # What the cancel / pause endpoints set (job_stop_requests)
+        t.join(10)
+        assert result.get("cancelled") == "Deleted"
+        assert pool.stats()["killed"] == 1 and pool.stats()["busy"] == 0
+    finally:
+        pool.shutdown()
+
+def test_errors_propagate():
+    pool = DownloadProcessPool(1, runner=failing_download)
+    try:
+        try:
+            pool.run("job-1", "format", {}, lambda d: None, timeout=30)
+            assert False, "expected DownloadError"
+        except yt_dlp.utils.DownloadError as e:
+            assert "Requested format is not available" in str(e)
+        try:
+            pool.run("job-2", "other", {}, lambda d: None, timeout=30)
+            assert False, "expected error"
+        except Exception as e:
+            assert "RuntimeError: boom" in str(e)
+        assert pool.stats()["spawned"] == 1
+    finally:
+        pool.shutdown()
+
+if __name__ == "__main__":
+    for test in (test_progress_relayed_and_worker_reused, test_timeout_kills_worker, test_hard_cancel, test_errors_propagate):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
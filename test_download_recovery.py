@@ -0,0 +1,36 @@
+"""
+Recovery actions of run_download: REFORMAT walks a ladder of more generic format
+selectors that matches the request type (audio requests never fall to a video selector
+before 'best'), and stops once the ladder is exhausted.
+
+Needs the server's dependencies (main is imported).
+Run: python test_download_recovery.py   (or pytest test_download_recovery.py)
+"""
+import main
+import retry_policy
+
+def ladder(req_type):
+    opts = main.download_format_options(main.DownloadRequest(url="https://example.com/v", type=req_type))
+    formats = []
+    while main.can_recover(retry_policy.REFORMAT, opts, req_type):
+        main.apply_recovery(retry_policy.REFORMAT, opts, req_type)
+        formats.append(opts['format'])
+    return opts, formats
+
+def test_audio_requests_relax_to_audio_selectors():
+    opts, formats = ladder('audio')
+    assert formats == ['bestaudio*', 'best']
+    assert opts['postprocessors'][0]['key'] == 'FFmpegExtractAudio'
+
+def test_video_requests_relax_to_video_selectors():
+    opts, formats = ladder('video')
+    assert formats == ['bestvideo*+bestaudio/best', 'best']
+    assert 'format_sort' not in opts
+
+if __name__ == "__main__":
+    for test in (test_audio_requests_relax_to_audio_selectors, test_video_requests_relax_to_video_selectors):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
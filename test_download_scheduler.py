@@ -0,0 +1,101 @@
+"""
+Dispatch order of the download scheduler: role lanes, fair share between users,
+per-user concurrency cap, admin moves and queue position estimates.
+
+Run: python test_download_scheduler.py   (or pytest test_download_scheduler.py)
+"""
+import time
+import threading
+
+from download_scheduler import DownloadScheduler
+
+LIMITS = {
+    'user': {'priority': 2, 'max_concurrent': 1},
+    'personal': {'priority': 1, 'max_concurrent': 1},
+    'admin': {'priority': 0, 'max_concurrent': 2},
+}
+
+class Recorder:
+    """Job body that records start order and blocks until released"""
+    def __init__(self):
+        self.started = []
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+
+    def __call__(self, job_id):
+        with self.lock:
+            self.started.append(job_id)
+        self.release.wait(5)
+
+def wait_for(predicate, timeout=5.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def make(workers=1):
+    sched = DownloadScheduler(LIMITS, workers=workers)
+    rec = Recorder()
+    return sched, rec
+
+def submit(sched, rec, job_id, owner, lane):
+    sched.submit(job_id, owner, lane, rec, job_id)
+
+def test_round_robin_between_users():
+    sched, rec = make(workers=1)
+    # Blocker keeps the single worker busy while the queue fills
+    submit(sched, rec, "blocker", "z", "admin")
+    assert wait_for(lambda: rec.started == ["blocker"])
+    for i in range(3):
+        submit(sched, rec, f"alice-{i}", "alice", "personal")
+    submit(sched, rec, "bob-0", "bob", "personal")
+    order = [job_id for job_id, _ in sorted(sched.estimates().items(), key=lambda kv: kv[1][0])]
+    assert order == ["alice-0", "bob-0", "alice-1", "alice-2"]
+    rec.release.set()
+    assert wait_for(lambda: len(rec.started) == 5)
+    sched.stop()
+    assert rec.started[1:] == order
+
+def test_admin_lane_first_and_per_user_cap():
+    sched, rec = make(workers=2)
+    submit(sched, rec, "u-0", "guest@1", "user")
+    submit(sched, rec, "u-1", "guest@1", "user")
+    assert wait_for(lambda: rec.started == ["u-0"])
+    # Second worker stays idle for guest@1 (cap 1) but picks up the admin job
+    submit(sched, rec, "a-0", "admin", "admin")
+    assert wait_for(lambda: len(rec.started) == 2)
+    assert rec.started[1] == "a-0"
+    assert sched.estimates()["u-1"][0] == 1
+    rec.release.set()
+    assert wait_for(lambda: len(rec.started) == 3)
+    sched.stop()
+
+def test_move_and_cancel():
+    sched, rec = make(workers=1)
+    submit(sched, rec, "blocker", "z", "admin")
+    assert wait_for(lambda: rec.started == ["blocker"])
+    submit(sched, rec, "p-0", "alice", "personal")
+    submit(sched, rec, "u-0", "guest@1", "user")
+    submit(sched, rec, "u-1", "guest@2", "user")
+    assert sched.move("u-1", "admin") == "admin"
+    assert sched.move("u-0", front=True) == "user"
+    assert sched.move("missing") is None
+    assert sched.cancel("p-0")
+    order = sorted(sched.estimates().items(), key=lambda kv: kv[1][0])
+    assert [job_id for job_id, _ in order] == ["u-1", "u-0"]
+    # Estimated starts never go backwards
+    assert order[0][1][1] <= order[1][1][1]
+    rec.release.set()
+    assert wait_for(lambda: len(rec.started) == 3)
+    sched.stop()
+    assert rec.started == ["blocker", "u-1", "u-0"]
+
+if __name__ == "__main__":
+    for test in (test_round_robin_between_users, test_admin_lane_first_and_per_user_cap, test_move_and_cancel):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
@@ -0,0 +1,130 @@
+"""
+Event bus behind /api/events: cross-thread delivery, filters, resume from a
+sequence number and the resync signals.
+
+Run: python test_event_bus.py   (or pytest test_event_bus.py)
+"""
+import asyncio
+import threading
+
+import event_bus as eb
+from event_bus import EventBus
+
+def only(topic):
+    return lambda e: e.topic == topic
+
+def test_delivery_from_other_threads_keeps_order():
+    bus = EventBus()
+
+    async def main():
+        bus.loop = asyncio.get_running_loop()
+        sub, missed, complete = bus.subscribe(only('job'), ['job'])
+        assert missed == [] and complete
+
+        def worker():
+            for i in range(50):
+                bus.publish('job', {'id': 'a', 'progress': i})
+                bus.publish('log', f"line {i}")
+
+        t = threading.Thread(target=worker)
+        t.start()
+        await asyncio.get_running_loop().run_in_executor(None, t.join)
+        got = [(await asyncio.wait_for(sub.queue.get(), 2)).data['progress'] for _ in range(50)]
+        assert got == list(range(50))
+        assert sub.queue.empty() # log events filtered out
+        bus.unsubscribe(sub)
+
+    asyncio.run(main())
+
+def test_concurrent_publishers_deliver_in_seq_order():
+    # Many workers publishing at once: the loop must receive the events in seq order
+    bus = EventBus(history=100000)
+
+    async def main():
+        bus.loop = asyncio.get_running_loop()
+        sub, _, _ = bus.subscribe(only('job'), ['job'])
+        sub.queue = asyncio.Queue() # Unbounded: this test is about order, not backpressure
+        start = threading.Barrier(8)
+
+        def worker():
+            start.wait()
+            for i in range(2000):
+                bus.publish('job', i)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        await asyncio.to_thread(lambda: [t.join() for t in threads])
+        await asyncio.sleep(0.1)
+        seqs = []
+        while not sub.queue.empty():
+            seqs.append(sub.queue.get_nowait().seq)
+        return seqs
+
+    seqs = asyncio.run(main())
+    assert len(seqs) == 16000
+    assert seqs == sorted(seqs), "delivered out of seq order"
+
+def test_resume_replays_missed_events():
+    bus = EventBus()
+    first = bus.publish('job', {'id': 'a', 'progress': 1})
+    bus.publish('notification', {'message': 'hi'}, username='bob')
+    bus.publish('job', {'id': 'a', 'progress': 2})
+    bus.publish('job', {'id': 'b', 'progress': 5})
+
+    async def main():
+        bus.loop = asyncio.get_running_loop()
+        accepts = lambda e: e.topic == 'job' and e.data['id'] == 'a'
+        seq, same_boot = bus.parse_last_event_id(f"{bus.boot}:{first}")
+        assert seq == first and same_boot
+        sub, missed, complete = bus.subscribe(accepts, ['job'], seq)
+        assert complete
+        assert [e.data['progress'] for e in missed] == [2]
+        bus.unsubscribe(sub)
+
+    asyncio.run(main())
+
+def test_resync_after_restart_or_eviction():
+    bus = EventBus(history=3)
+    # Id from another server boot
+    assert bus.parse_last_event_id("deadbeef:1") == (None, False)
+    assert bus.parse_last_event_id(None) == (None, True)
+    for i in range(10):
+        bus.publish('log', f"line {i}")
+
+    async def main():
+        bus.loop = asyncio.get_running_loop()
+        sub, missed, complete = bus.subscribe(only('log'), ['log'], 2)
+        assert not complete # 3..7 were evicted
+        assert [e.data for e in missed] == ["line 7", "line 8", "line 9"]
+        bus.unsubscribe(sub)
+
+    asyncio.run(main())
+
+def test_slow_subscriber_flagged_for_resync():
+    bus = EventBus()
+    old_size = eb.SUBSCRIBER_QUEUE_SIZE
+    eb.SUBSCRIBER_QUEUE_SIZE = 5
+    try:
+        async def main():
+            bus.loop = asyncio.get_running_loop()
+            sub, _, _ = bus.subscribe(only('job'), ['job'])
+            for i in range(8):
+                bus.publish('job', {'id': 'a', 'progress': i})
+            await asyncio.sleep(0.05)
+            assert sub.lagged
+            assert sub.queue.qsize() < 5
+
+        asyncio.run(main())
+    finally:
+        eb.SUBSCRIBER_QUEUE_SIZE = old_size
+
+if __name__ == "__main__":
+    for test in (test_delivery_from_other_threads_keeps_order, test_concurrent_publishers_deliver_in_seq_order,
+                 test_resume_replays_missed_events,
+                 test_resync_after_restart_or_eviction, test_slow_subscriber_flagged_for_resync):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
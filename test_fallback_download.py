@@ -0,0 +1,233 @@
+"""
+Fallback chain through main: process_generic_download_async writes the file with
+parallel byte ranges, the provider race only counts broken instances (unreachable,
+HTTP 5xx) against their health, not instances that cannot serve a URL or scrapers that
+convert slowly, and
+attempt_fallback_download runs on the app loop through fallback_service: one pooled
+client across jobs, pause / cancel relayed from job_stop_requests. After yt-dlp gave up,
+_run_download moves exactly the fallback's file (not a leftover of the yt-dlp attempts),
+indexes it in the library and clears the job's temp files.
+
+Uses the local stand-in Cobalt server (fake_cobalt.py) and a temporary database; needs
+the server's dependencies (main is imported).
+Run: python test_fallback_download.py   (or pytest test_fallback_download.py)
+"""
+import asyncio
+import concurrent.futures
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import httpx
+import pytest
+
+import external_downloaders
+import main
+import provider_health
+from fake_cobalt import FakeCobalt, media_bytes
+from fallback_service import FallbackCancelled
+from provider_health import ProviderHealth
+
+MB = 1024 * 1024
+
+@contextmanager
+def fallback_env(instances=()):
+    """A registered job, temp dir and database of its own; only `instances` in the race"""
+    job = main.DownloadJob(id=str(uuid.uuid4()), url="https://example.com/v", status=main.JobStatus.DOWNLOADING,
+                           created_at=time.time())
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(main, 'TEMP_DIR', tempfile.mkdtemp(prefix="fallback_"))
+        mp.setattr(main.db_utils, 'DB_PATH', os.path.join(tempfile.mkdtemp(prefix="fallback_db_"), "server.db"))
+        mp.setattr(main, 'COBALT_INSTANCES', list(instances))
+        mp.setattr(main, 'FALLBACK_SCRAPERS', {})
+        mp.setattr(main, 'fallback_providers', ProviderHealth())
+        mp.setitem(main.jobs, job.id, job)
+        main.db_utils.init_db()
+        try:
+            yield job
+        finally:
+            main.maintenance_executor.submit(lambda: None).result(10) # Scoreboard saves land in the temp DB
+            main.db_utils.close_db()
+
+def closed_port_url() -> str:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+@contextmanager
+def app_loop():
+    """Stand-in for the uvicorn loop, with main.fallback_service started on it"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(main.fallback_service.start(), loop).result(5)
+    try:
+        yield loop
+    finally:
+        asyncio.run_coroutine_threadsafe(main.fallback_service.stop(), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+
+def tasks_on(loop) -> int:
+    """Tasks still running on the loop (besides the one counting)"""
+    async def count():
+        return len(asyncio.all_tasks()) - 1
+    return asyncio.run_coroutine_threadsafe(count(), loop).result(5)
+
+def run_fallback(job):
+    """What _run_download does once yt-dlp gave up"""
+    return main.fallback_service.run(main.attempt_fallback_download, job.url, job.id, timeout=30.0,
+                                     should_stop=lambda: main.job_stop_requests.get(job.id))
+
+def test_generic_download_writes_the_file_in_ranges():
+    server = FakeCobalt(size=10 * MB)
+    base_url = server.start()
+    try:
+        with fallback_env() as job:
+            async def run():
+                async with httpx.AsyncClient(timeout=10.0) as client:
+                    return await main.process_generic_download_async(f"{base_url}/media/video.mp4", job.id, client,
+                                                                     "video.mp4", "mp4")
+            assert asyncio.run(run()) == {'title': "video.mp4", 'ext': "mp4",
+                                          'path': os.path.join(main.TEMP_DIR, f"{job.id}.mp4")}
+            with open(os.path.join(main.TEMP_DIR, f"{job.id}.mp4"), 'rb') as f:
+                assert f.read() == media_bytes(10 * MB)
+            assert job.progress == 100 and job.total_bytes == 10 * MB
+            # Probe + one request per range (10 MB in segments of at least 4 MB: two ranges)
+            assert server.media_requests == 1 + 2
+    finally:
+        server.stop()
+
+def test_only_broken_instances_count_as_failures():
+    refusing, failing = FakeCobalt(fail=True), FakeCobalt(api_status=502)
+    refusing_url, failing_url, dead_url = refusing.start(), failing.start(), closed_port_url()
+    try:
+        with fallback_env([refusing_url, failing_url, dead_url]) as job:
+            async def run():
+                async with httpx.AsyncClient(timeout=5.0) as client:
+                    return await main.attempt_fallback_download(job.url, job.id, client)
+
+            # The same unservable URL, more often than it takes to open a circuit
+            for _ in range(provider_health.FAILURES_TO_OPEN + 1):
+                assert not asyncio.run(run())
+            stats = main.fallback_providers.stats()
+            assert stats[refusing_url]['failures'] == 0 and stats[refusing_url]['state'] == 'closed'
+            assert refusing.api_requests == provider_health.FAILURES_TO_OPEN + 1
+            for broken in (failing_url, dead_url):
+                assert stats[broken]['failures'] == provider_health.FAILURES_TO_OPEN
+                assert stats[broken]['state'] == 'open'
+            assert main.fallback_providers.rank(main.COBALT_INSTANCES) == [refusing_url]
+    finally:
+        refusing.stop()
+        failing.stop()
+
+def test_slow_conversion_is_not_a_failure():
+    # Loader.to (Y2Mate) accepts the job, then keeps converting past the default provider timeout
+    def loader_to(request):
+        if request.url.path.endswith("/download.php"):
+            return httpx.Response(200, json={"success": True, "id": "job"})
+        return httpx.Response(200, json={"success": 0, "progress": 100})
+
+    with fallback_env() as job, pytest.MonkeyPatch.context() as mp:
+        mp.setattr(external_downloaders, 'LOADER_POLL_INTERVAL', 0.1)
+        mp.setattr(external_downloaders, 'LOADER_POLL_BUDGET', 1.0)
+        mp.setattr(main, 'FALLBACK_PROVIDER_TIMEOUT', 0.5)
+        mp.setattr(main, 'FALLBACK_PROVIDER_TIMEOUTS', {'Y2Mate': 0.5 + 1.0})
+        mp.setattr(main, 'FALLBACK_SCRAPERS', {'Y2Mate': external_downloaders.get_y2mate})
+
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(loader_to)) as client:
+                return await main.attempt_fallback_download(job.url, job.id, client)
+
+        for _ in range(provider_health.FAILURES_TO_OPEN):
+            t0 = time.monotonic()
+            assert not asyncio.run(run())
+            assert time.monotonic() - t0 > 0.5 # Polled past the default timeout
+        stats = main.fallback_providers.stats()['Y2Mate']
+        assert stats['failures'] == 0 and stats['state'] == 'closed'
+
+def test_fallback_runs_on_the_app_loop_with_one_client():
+    server = FakeCobalt(size=10 * MB)
+    base_url = server.start()
+    try:
+        with fallback_env([base_url]) as job, app_loop():
+            assert run_fallback(job)['title'] == "video.mp4"
+            first_job_connections = server.connections
+            for _ in range(2):
+                assert run_fallback(job)['title'] == "video.mp4"
+            with open(os.path.join(main.TEMP_DIR, f"{job.id}.mp4"), 'rb') as f:
+                assert f.read() == media_bytes(10 * MB)
+            # Later jobs reuse the pooled client's connections (API + ranges)
+            assert server.api_requests == 3 and server.connections == first_job_connections
+            assert main.fallback_service.stats()['active'] == 0
+    finally:
+        server.stop()
+
+def test_fallback_file_is_moved_and_indexed():
+    server = FakeCobalt(size=2 * MB)
+    base_url = server.start()
+
+    def geo_blocked(url, *args, **kwargs):
+        future = concurrent.futures.Future()
+        future.set_exception(Exception("ERROR: [youtube] abc: The uploader has not made this video available in your country"))
+        return future
+
+    try:
+        with fallback_env([base_url]) as job, app_loop(), pytest.MonkeyPatch.context() as mp:
+            mp.setattr(main, 'DOWNLOAD_DIR', tempfile.mkdtemp(prefix="fallback_dl_"))
+            mp.setattr(main, 'download_processes', None)
+            mp.setattr(main, 'fetch_raw_info', geo_blocked)
+            req = main.DownloadRequest(url="https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+            job.url = req.url
+            # What an earlier yt-dlp attempt left behind for BACKOFF to resume
+            for leftover in (f"{job.id}.f137.mp4.part", f"{job.id}.f137.mp4.ytdl"):
+                with open(os.path.join(main.TEMP_DIR, leftover), 'wb') as f:
+                    f.write(b"partial")
+
+            assert main._run_download(job, req) == [job.filename]
+            assert job.status == main.JobStatus.FINISHED and os.listdir(main.DOWNLOAD_DIR) == [job.filename]
+            with open(os.path.join(main.DOWNLOAD_DIR, job.filename), 'rb') as f:
+                assert f.read() == media_bytes(2 * MB)
+            assert not os.listdir(main.TEMP_DIR)
+            stored = main.find_in_library('Youtube', 'dQw4w9WgXcQ', main.library_signature(req))
+            assert stored['filename'] == job.filename and stored['size'] == 2 * MB
+    finally:
+        server.stop()
+
+def test_pause_and_cancel_reach_the_fallback():
+    server = FakeCobalt(latency=5.0)
+    base_url = server.start()
+    try:
+        with fallback_env([base_url]) as job, app_loop() as loop:
+            cancelled = main.fallback_service.stats()['cancelled']
+            for reason in ('pause', 'cancel'):
+                timer = threading.Timer(0.3, main.job_stop_requests.__setitem__, (job.id, reason))
+                timer.start()
+                t0 = time.monotonic()
+                try:
+                    run_fallback(job)
+                    assert False, "not stopped"
+                except FallbackCancelled as e:
+                    assert str(e) == reason and time.monotonic() - t0 < 2.0
+                finally:
+                    timer.join()
+                    main.job_stop_requests.pop(job.id, None)
+            assert main.fallback_service.stats()['cancelled'] == cancelled + 2
+            # The race was cancelled on the loop, not left running behind the worker thread
+            time.sleep(0.2)
+            assert tasks_on(loop) == 0 and not os.listdir(main.TEMP_DIR)
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    for test in (test_generic_download_writes_the_file_in_ranges, test_only_broken_instances_count_as_failures,
+                 test_slow_conversion_is_not_a_failure,
+                 test_fallback_runs_on_the_app_loop_with_one_client, test_fallback_file_is_moved_and_indexed,
+                 test_pause_and_cancel_reach_the_fallback):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
@@ -0,0 +1,103 @@
+"""
+Fallback service: worker threads run fallback coroutines on a long-lived event loop with
+one pooled client (connections are reused across jobs), pause / cancel and timeouts
+reach the coroutine, and run() works before the service is started.
+
+Uses the local stand-in Cobalt server (fake_cobalt.py); needs httpx.
+Run: python test_fallback_service.py   (or pytest test_fallback_service.py)
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+import httpx
+
+from fake_cobalt import FakeCobalt, media_bytes
+from fallback_service import FallbackCancelled, FallbackService
+from segmented_download import download_file
+
+MB = 1024 * 1024
+
+async def cobalt_fallback(base_url, path, client):
+    """What attempt_fallback_download does against one provider: ask, then fetch the file"""
+    resp = await client.post(f"{base_url}/api/json", json={"url": "https://example.com/v"})
+    data = resp.json()
+    if data.get('status') == 'error':
+        return None
+    return await download_file(client, data['url'], path, connections=4, min_segment=MB)
+
+def start_app_loop(service):
+    """Stand-in for the uvicorn loop: a loop in its own thread, service started on it"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(service.start(), loop).result(5)
+    return loop
+
+def stop_app_loop(service, loop):
+    asyncio.run_coroutine_threadsafe(service.stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+
+def test_connections_are_reused_across_jobs():
+    server = FakeCobalt(size=4 * MB)
+    base_url = server.start()
+    service = FallbackService(lambda: httpx.AsyncClient(timeout=10.0))
+    loop = start_app_loop(service)
+    try:
+        path = os.path.join(tempfile.mkdtemp(prefix="fallback_"), "out.mp4")
+        for _ in range(5):
+            assert service.run(cobalt_fallback, base_url, path) == 4 * MB
+        with open(path, 'rb') as f:
+            assert f.read() == media_bytes(4 * MB)
+        # One job opens a handful of connections (API + parallel ranges); later jobs reuse them
+        assert server.api_requests == 5 and server.connections <= 5
+        assert service.stats()['completed'] == 5
+    finally:
+        stop_app_loop(service, loop)
+        server.stop()
+
+def test_cancel_and_timeout_reach_the_coroutine():
+    server = FakeCobalt(latency=5.0)
+    base_url = server.start()
+    service = FallbackService(lambda: httpx.AsyncClient(timeout=10.0))
+    loop = start_app_loop(service)
+    path = os.path.join(tempfile.mkdtemp(prefix="fallback_"), "out.mp4")
+    try:
+        stop_at = time.monotonic() + 0.3
+        t0 = time.monotonic()
+        try:
+            service.run(cobalt_fallback, base_url, path, should_stop=lambda: 'cancel' if time.monotonic() > stop_at else None)
+            assert False, "not cancelled"
+        except FallbackCancelled as e:
+            assert str(e) == 'cancel' and time.monotonic() - t0 < 2.0
+        t0 = time.monotonic()
+        try:
+            service.run(cobalt_fallback, base_url, path, timeout=0.3)
+            assert False, "no timeout"
+        except TimeoutError:
+            assert time.monotonic() - t0 < 2.0
+        assert service.stats()['cancelled'] == 1 and service.stats()['failed'] == 1
+    finally:
+        stop_app_loop(service, loop)
+        server.stop()
+
+def test_run_before_start_uses_a_private_loop():
+    server = FakeCobalt(size=MB)
+    base_url = server.start()
+    service = FallbackService(lambda: httpx.AsyncClient(timeout=10.0))
+    try:
+        path = os.path.join(tempfile.mkdtemp(prefix="fallback_"), "out.mp4")
+        assert service.run(cobalt_fallback, base_url, path) == MB
+        assert service.client is None
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    for test in (test_connections_are_reused_across_jobs, test_cancel_and_timeout_reach_the_coroutine,
+                 test_run_before_start_uses_a_private_loop):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
@@ -0,0 +1,53 @@
+"""
+/api/download/{filename}: one route serves the stored file, attributes the download
+(event + bandwidth) to the session's user, and rejects path tricks.
+
+Uses a temporary download directory and database; needs the server's dependencies
+(main is imported).
+Run: python test_file_download.py   (or pytest test_file_download.py)
+"""
+import os
+import tempfile
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import db_utils
+import main
+
+def test_download_is_served_once_and_attributed():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(main, 'DOWNLOAD_DIR', tempfile.mkdtemp(prefix="files_"))
+        mp.setattr(db_utils, 'DB_PATH', os.path.join(tempfile.mkdtemp(prefix="files_db_"), "server.db"))
+        token = uuid.uuid4().hex
+        mp.setitem(main.sessions, token, {'username': 'alice', 'role': 'personal', 'exp': time.time() + 60})
+        db_utils.init_db()
+        try:
+            with open(os.path.join(main.DOWNLOAD_DIR, "clip.mp4"), 'wb') as f:
+                f.write(b"x" * 1000)
+            routes = [r for r in main.app.routes if getattr(r, 'path', None) == "/api/download/{filename}"]
+            assert len(routes) == 1
+
+            client = TestClient(main.app)
+            client.cookies.set(main.AUTH_COOKIE_NAME, token)
+            resp = client.get("/api/download/clip.mp4")
+            assert resp.status_code == 200 and resp.content == b"x" * 1000
+            event = db_utils.query_one("SELECT details, username FROM logs WHERE event_type = 'DOWNLOAD'")
+            assert tuple(event) == ("File: clip.mp4", "alice")
+            bandwidth = db_utils.query_one("SELECT bytes_received, username FROM bandwidth WHERE type = 'download'")
+            assert tuple(bandwidth) == (1000, "alice")
+
+            assert client.get("/api/download/..%5Cserver.db").status_code == 400
+            assert client.get("/api/download/missing.mp4").status_code == 404
+        finally:
+            db_utils.close_db()
+
+if __name__ == "__main__":
+    for test in (test_download_is_served_once_and_attributed,):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
@@ -0,0 +1,99 @@
+"""
+Fragment concurrency: ramp-up while throughput improves, settling on a plateau,
+back-off and hold after 403 / 429, capped roles, fragment detection and the logger,
+the rate limit split over fragment threads only for fragmented formats (needs yt-dlp).
+
+Run: python test_fragment_concurrency.py   (or pytest test_fragment_concurrency.py)
+"""
+import yt_dlp
+
+from fragment_concurrency import FragmentConcurrency, ThrottleLogger, site_key, split_rate_limit, uses_fragments
+
+MB = 1024 * 1024
+
+def link(level):
+    """Throughput (bytes/s) of a link where each connection gets 2 MB/s, saturating at 16 MB/s"""
+    return min(level * 2 * MB, 16 * MB)
+
+def run(controller, key='example.com', times=1):
+    for _ in range(times):
+        level = controller.choose(key)
+        controller.report(key, level, link(level) * 30, 30.0)
+    return controller.choose(key)
+
+def test_ramps_up_while_throughput_improves_then_settles():
+    controller = FragmentConcurrency(start=2, maximum=32)
+    assert controller.choose('example.com') == 2
+    assert run(controller) == 4
+    assert run(controller) == 8
+    assert run(controller) == 16
+    # 16 connections are no faster than 8 on a 16 MB/s link: settle on the cheaper level
+    assert run(controller) == 8
+    assert run(controller, times=5) == 8
+
+def test_plateau_is_probed_again():
+    controller = FragmentConcurrency(start=8, maximum=16, probe_every=3)
+    run(controller)        # 8 -> 16
+    run(controller)        # 16 no better -> 8
+    assert run(controller, times=3) == 8 # The third stable report forgets the level-16 sample
+    assert run(controller) == 16
+
+def test_throttling_halves_and_holds():
+    controller = FragmentConcurrency(start=8, hold=60)
+    controller.report('example.com', 8, throttled=True)
+    assert controller.choose('example.com') == 4
+    assert run(controller) == 4 # No ramp-up during the hold
+    assert controller.stats()['example.com']['throttles'] == 1
+    assert controller.choose('other.example') == 8 # Per site
+
+def test_short_downloads_are_not_measured():
+    controller = FragmentConcurrency(start=4)
+    controller.report('example.com', 4, 1 * MB, 0.5)
+    assert controller.choose('example.com') == 4
+
+def test_speed_cap_limits_connections():
+    controller = FragmentConcurrency(start=8)
+    cap = 3 * MB
+    assert controller.choose('example.com', cap) == 1 # Per-connection speed unknown yet
+    run(controller)
+    # 2 MB/s per connection: two connections reach a 3 MB/s cap
+    assert controller.choose('example.com', cap) == 2
+    # Throughput at the cap says nothing about the link
+    controller.report('example.com', 2, int(cap * 30), 30.0, cap_bps=cap)
+    assert controller.stats()['example.com']['per_connection_bps'] == 2 * MB
+
+def test_fragment_detection_and_logger():
+    assert uses_fragments({'protocol': 'http_dash_segments+https'})
+    assert uses_fragments({'requested_formats': [{'protocol': 'https'}, {'protocol': 'm3u8_native'}]})
+    assert not uses_fragments({'protocol': 'https'}) and not uses_fragments(None)
+    assert site_key("https://www.YouTube.com/watch?v=x") == "youtube.com"
+    log = ThrottleLogger()
+    log.debug("[download] Got error: HTTP Error 429: Too Many Requests. Retrying fragment 3 (1/10)...")
+    log.debug("[download] Destination: x.mp4")
+    assert log.throttles == 1
+
+def selected_rate_limit(protocol: str) -> int:
+    """ratelimit yt-dlp downloads with once a single-format video of `protocol` is selected"""
+    info = {'id': 'x', 'title': 't', 'extractor': 'test', 'extractor_key': 'Test', 'webpage_url': 'https://example.com/x',
+            'formats': [{'format_id': 'f', 'url': 'https://example.com/v', 'protocol': protocol, 'ext': 'mp4',
+                         'vcodec': 'h264', 'acodec': 'aac'}]}
+    opts = {'ratelimit': 4 * MB, 'fragment_ratelimit': MB, 'skip_download': True, 'quiet': True}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        split_rate_limit(ydl).process_ie_result(info, download=True)
+        return ydl.params['ratelimit']
+
+def test_rate_limit_split_only_for_fragmented_formats():
+    assert selected_rate_limit('https') == 4 * MB # One connection: the whole cap
+    assert selected_rate_limit('m3u8_native') == MB
+    assert selected_rate_limit('http_dash_segments') == MB
+
+if __name__ == "__main__":
+    for test in (test_ramps_up_while_throughput_improves_then_settles, test_plateau_is_probed_again,
+                 test_throttling_halves_and_holds, test_short_downloads_are_not_measured,
+                 test_speed_cap_limits_connections, test_fragment_detection_and_logger,
+                 test_rate_limit_split_only_for_fragmented_formats):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
@@ -0,0 +1,100 @@
+"""
+Extraction cache: singleflight under concurrent identical lookups, TTL from signed
+stream URLs, LRU eviction by entry count and by size, purge and metrics.
+
+Run: python test_metadata_cache.py   (or pytest test_metadata_cache.py)
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metadata_cache import MetadataCache, info_ttl, signed_url_expiry
+
+def test_concurrent_fetches_share_one_load():
+    cache = MetadataCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2) # Slow extraction
+        return {'title': 'x'}, 60
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: cache.fetch('k', loader).result(), range(8)))
+    assert len(calls) == 1
+    assert all(r == {'title': 'x'} for r in results)
+    assert cache.fetch('k', loader).result() == {'title': 'x'}
+    stats = cache.stats()
+    assert stats['misses'] == 1 and stats['coalesced'] + stats['hits'] == 8
+
+def test_loader_errors_reach_every_waiter_and_are_not_cached():
+    cache = MetadataCache()
+    release = threading.Event()
+
+    def failing():
+        release.wait(1)
+        raise RuntimeError("extraction failed")
+
+    executor = ThreadPoolExecutor(1)
+    futures = [cache.fetch('bad', failing, executor) for _ in range(3)]
+    release.set()
+    for f in futures:
+        assert isinstance(f.exception(2), RuntimeError)
+    assert cache.fetch('bad', lambda: ('ok', 60)).result() == 'ok'
+    executor.shutdown()
+
+def test_ttl_expiry_and_uncacheable_results():
+    cache = MetadataCache()
+    cache.fetch('short', lambda: ('v', 0.05)).result()
+    assert cache.get('short') == 'v'
+    time.sleep(0.1)
+    assert cache.get('short') is None
+    cache.fetch('none', lambda: (None, 60)).result()
+    cache.fetch('zero', lambda: ('v', 0)).result()
+    assert cache.stats()['entries'] == 0
+
+def test_signed_url_expiry_limits_ttl():
+    expire = int(time.time()) + 600
+    info = {'formats': [{'url': f"https://rr1.googlevideo.com/videoplayback?expire={expire}&ip=1.2.3.4"},
+                        {'url': "https://cdn.example.com/v.mp4?Expires=99"}]} # Duration, not a timestamp
+    assert signed_url_expiry(f['url'] for f in info['formats']) == expire
+    assert 400 < info_ttl(info, default=1800, margin=120) <= 480
+    assert info_ttl({'url': 'https://example.com/v.mp4'}, default=1800) == 1800
+    expired = {'url': f"https://x.googlevideo.com/videoplayback?expire={int(time.time()) + 30}"}
+    assert info_ttl(expired, default=1800, margin=120) == 0
+
+def test_lru_eviction_by_count_and_bytes():
+    cache = MetadataCache(max_entries=3)
+    for key in 'abc':
+        cache.fetch(key, lambda: ('v', 60)).result()
+    cache.get('a') # a becomes most recently used
+    cache.fetch('d', lambda: ('v', 60)).result()
+    assert cache.get('b') is None and cache.get('a') == 'v'
+    assert cache.stats()['evictions'] == 1
+
+    small = MetadataCache(max_bytes=2000)
+    small.fetch('x', lambda: ('x' * 900, 60)).result()
+    small.fetch('y', lambda: ('y' * 900, 60)).result()
+    small.fetch('z', lambda: ('z' * 900, 60)).result()
+    assert small.get('x') is None and small.get('z') is not None
+    assert small.stats()['bytes'] <= 2000
+    small.fetch('huge', lambda: ('h' * 5000, 60)).result() # Larger than the cache: not stored
+    assert small.get('huge') is None and small.get('z') is not None
+
+def test_purge():
+    cache = MetadataCache()
+    for key in (('info', 'u1', False), ('info', 'u2', False), ('search', 'q', )):
+        cache.fetch(key, lambda: ('v', 60)).result()
+    assert cache.purge(lambda key: key[1] == 'u1') == 1
+    assert cache.purge() == 2
+    assert cache.stats()['entries'] == 0 and cache.stats()['bytes'] == 0
+
+if __name__ == "__main__":
+    for test in (test_concurrent_fetches_share_one_load, test_loader_errors_reach_every_waiter_and_are_not_cached,
+                 test_ttl_expiry_and_uncacheable_results, test_signed_url_expiry_limits_ttl,
+                 test_lru_eviction_by_count_and_bytes, test_purge):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
@@ -0,0 +1,67 @@
+"""
+Playlist aggregation: parent progress / speed from its entries, and the parent's state
+once entries finish, fail, pause or get cancelled.
+
+Run: python test_playlist_progress.py   (or pytest test_playlist_progress.py)
+"""
+import threading
+
+from playlist_progress import PlaylistProgress
+
+def test_progress_and_speed_aggregate_over_entries():
+    playlist = PlaylistProgress(['a', 'b', 'c', 'd'])
+    playlist.update('a', 'downloading', 50, 1000.0)
+    summary = playlist.update('b', 'downloading', 30, 500.0)
+    assert summary['status'] == 'downloading'
+    assert summary['progress'] == 20.0 and summary['speed_bps'] == 1500.0
+    summary = playlist.update('a', 'finished', 100, None, 'a.mp4')
+    assert summary['progress'] == 32.5 and summary['speed_bps'] == 500.0
+    assert summary['entries_finished'] == 1 and summary['entries_total'] == 4
+
+def test_failed_entries_do_not_sink_the_playlist():
+    playlist = PlaylistProgress(['a', 'b', 'c'])
+    playlist.update('a', 'error')
+    playlist.update('b', 'finished', 100, None, 'b.mp4')
+    summary = playlist.update('c', 'finished', 100, None, 'c.mp4')
+    assert summary['status'] == 'finished' and summary['progress'] == 100.0
+    assert summary['entries_failed'] == 1 and summary['error_msg'] == "1 of 3 entries failed"
+    assert playlist.filenames() == ['b.mp4', 'c.mp4']
+
+    failed = PlaylistProgress(['a', 'b'])
+    failed.update('a', 'error')
+    assert failed.update('b', 'cancelled')['status'] == 'error'
+
+def test_paused_and_cancelled_playlists():
+    playlist = PlaylistProgress(['a', 'b'])
+    playlist.update('a', 'paused', 40)
+    assert playlist.update('b', 'queued')['status'] == 'downloading'
+    summary = playlist.update('b', 'paused', 10)
+    assert summary['status'] == 'paused' and summary['progress'] == 25.0
+    playlist.update('a', 'cancelled')
+    assert playlist.update('b', 'cancelled')['status'] == 'cancelled'
+
+def test_unknown_entries_are_ignored():
+    playlist = PlaylistProgress(['a'])
+    assert playlist.update('other', 'finished') is None
+    assert playlist.summary()['status'] == 'downloading'
+
+def test_concurrent_updates():
+    ids = [str(i) for i in range(50)]
+    playlist = PlaylistProgress(ids)
+    threads = [threading.Thread(target=playlist.update, args=(i, 'finished', 100, None, f"{i}.mp4")) for i in ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    summary = playlist.summary()
+    assert summary['status'] == 'finished' and summary['entries_finished'] == 50
+    assert len(playlist.filenames()) == 50
+
+if __name__ == "__main__":
+    for test in (test_progress_and_speed_aggregate_over_entries, test_failed_entries_do_not_sink_the_playlist,
+                 test_paused_and_cancelled_playlists, test_unknown_entries_are_ignored, test_concurrent_updates):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
@@ -0,0 +1,98 @@
+"""
+Progress aggregation: rate limit under a flood of hook calls from several threads,
+byte-counter based speed / ETA and multi-file totals (seeded from the requested formats).
+
+Run: python test_progress_tracker.py   (or pytest test_progress_tracker.py)
+"""
+import time
+import threading
+
+from progress_tracker import ProgressTracker, format_eta, format_speed
+
+def test_flood_is_coalesced():
+    tracker = ProgressTracker(rate=10)
+    emitted = []
+    lock = threading.Lock()
+
+    def fragment_thread(offset):
+        for i in range(20000):
+            snap = tracker.update({'status': 'downloading', 'filename': 'a.mp4',
+                                   'downloaded_bytes': i * 10 + offset, 'total_bytes': 10 ** 6})
+            if snap:
+                with lock:
+                    emitted.append(snap)
+
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=fragment_thread, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - t0
+    print(f"{tracker.updates} updates -> {len(emitted)} snapshots in {elapsed:.2f}s")
+    assert tracker.updates == 80000
+    assert len(emitted) <= elapsed * 10 + 2
+
+def test_speed_and_eta_from_byte_counters():
+    tracker = ProgressTracker(rate=0) # No rate limit: every update emits
+    total = 10 * 1024 * 1024
+    tracker.update({'status': 'downloading', 'filename': 'a.mp4', 'downloaded_bytes': 0, 'total_bytes': total})
+    snap = None
+    for i in range(1, 6):
+        time.sleep(0.1)
+        snap = tracker.update({'status': 'downloading', 'filename': 'a.mp4',
+                               'downloaded_bytes': i * 100 * 1024, 'total_bytes': total})
+    # ~1 MiB/s
+    assert 0.6 * 1024 * 1024 < snap['speed_bps'] < 1.3 * 1024 * 1024
+    assert 6 <= snap['eta_seconds'] <= 16
+    assert snap['speed'].endswith('KiB/s') or snap['speed'].endswith('MiB/s')
+    assert snap['progress'] == round(500 * 1024 / total * 100, 1)
+
+def test_video_then_audio_does_not_reset_progress():
+    tracker = ProgressTracker(rate=0)
+    tracker.update({'status': 'downloading', 'filename': 'v.mp4', 'downloaded_bytes': 900, 'total_bytes': 900})
+    tracker.update({'status': 'finished', 'filename': 'v.mp4'})
+    snap = tracker.update({'status': 'downloading', 'filename': 'a.m4a', 'downloaded_bytes': 50, 'total_bytes': 100})
+    assert snap['downloaded_bytes'] == 950 and snap['total_bytes'] == 1000
+    assert snap['progress'] == 95.0
+    assert snap['filename'] == 'a.m4a'
+
+def test_requested_formats_seed_the_total():
+    # Merged download: yt-dlp's info_dict lists both streams before the first byte arrives
+    info = {'requested_formats': [{'format_id': '137', 'filesize': 900}, {'format_id': '140', 'filesize_approx': 100}]}
+    tracker = ProgressTracker(rate=0)
+    snap = tracker.update({'status': 'downloading', 'filename': 'v.mp4', 'downloaded_bytes': 450,
+                           'total_bytes': 900, 'info_dict': info})
+    assert snap['total_bytes'] == 1000 and snap['progress'] == 45.0
+    snap = tracker.update({'status': 'downloading', 'filename': 'v.mp4', 'downloaded_bytes': 900, 'total_bytes': 900})
+    assert snap['progress'] == 90.0
+    tracker.update({'status': 'finished', 'filename': 'v.mp4'})
+    snap = tracker.update({'status': 'downloading', 'filename': 'a.m4a', 'downloaded_bytes': 10, 'total_bytes': 110})
+    assert snap['progress'] >= 90.0 and snap['total_bytes'] == 1010 # Exact sizes once every stream started
+
+    # Relayed from a worker process, and unknown sizes leave the old behaviour
+    tracker = ProgressTracker(rate=0)
+    snap = tracker.update({'status': 'downloading', 'filename': 'v.mp4', 'downloaded_bytes': 450,
+                           'total_bytes': 900, 'requested_sizes': [900, 100]})
+    assert snap['progress'] == 45.0
+    info = {'requested_formats': [{'filesize': 900}, {'filesize': None}]}
+    snap = ProgressTracker(rate=0).update({'status': 'downloading', 'filename': 'v.mp4', 'downloaded_bytes': 450,
+                                           'total_bytes': 900, 'info_dict': info})
+    assert snap['progress'] == 50.0
+
+def test_formatting():
+    assert format_speed(512) == "512 B/s"
+    assert format_speed(3.5 * 1024 * 1024) == "3.5 MiB/s"
+    assert format_eta(65) == "01:05"
+    assert format_eta(3725) == "1:02:05"
+    assert format_eta(None) is None
+
+if __name__ == "__main__":
+    for test in (test_flood_is_coalesced, test_speed_and_eta_from_byte_counters,
+                 test_video_then_audio_does_not_reset_progress, test_requested_formats_seed_the_total,
+                 test_formatting):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
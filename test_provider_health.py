@@ -0,0 +1,145 @@
+"""
+Fallback provider scoreboard and hedged racing: ranking by latency / success rate,
+circuit breaking with half-open trials (taken only by an attempt that starts), top-K
+first with hedging, losers cancelled, per-provider timeouts.
+
+Run: python test_provider_health.py   (or pytest test_provider_health.py)
+"""
+import asyncio
+import time
+
+import provider_health
+from provider_health import ProviderHealth, hedged_race
+
+def test_rank_by_latency_and_success_rate():
+    health = ProviderHealth()
+    health.record_success('fast', 0.5)
+    health.record_success('slow', 6.0)
+    health.record_success('flaky', 0.5)
+    health.record_failure('flaky')
+    health.record_failure('flaky')
+    assert health.rank(['slow', 'flaky', 'new', 'fast']) == ['fast', 'flaky', 'slow', 'new']
+
+def test_circuit_opens_and_half_opens():
+    health = ProviderHealth()
+    for _ in range(provider_health.FAILURES_TO_OPEN):
+        health.record_failure('dead')
+    assert health.rank(['dead', 'ok']) == ['ok']
+    assert health.stats()['dead']['state'] == 'open'
+
+    # Cool-down over: one trial request, then out again until the trial's result is known
+    health._providers['dead']['open_until'] = time.time() - 1
+    assert health.rank(['dead']) == ['dead'] and health.rank(['dead']) == ['dead'] # Ranking takes nothing
+    assert health.begin_trial('dead') and not health.begin_trial('dead')
+    assert health.rank(['dead']) == []
+    health.record_failure('dead') # Failed trial: open again, for twice as long
+    assert health._providers['dead']['open_until'] - time.time() > provider_health.OPEN_BASE * 1.5
+    health.record_success('dead', 1.0)
+    assert health.rank(['dead']) == ['dead'] and health.stats()['dead']['state'] == 'closed'
+
+def test_rows_round_trip():
+    health = ProviderHealth()
+    health.record_success('a', 1.0)
+    health.record_failure('b')
+    restored = ProviderHealth()
+    restored.load(health.rows())
+    assert restored.stats() == health.stats()
+
+def race(delays, results, width=2, hedge_delay=0.2, timeout=5.0, health=None):
+    """delays / results per provider; returns (winner, started providers, cancelled providers)"""
+    health = health or ProviderHealth()
+    started, cancelled = [], []
+
+    async def attempt(name):
+        started.append(name)
+        try:
+            await asyncio.sleep(delays[name])
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+        return results.get(name)
+
+    winner = asyncio.run(hedged_race(list(delays), attempt, health, width, hedge_delay, timeout))
+    return winner, started, cancelled
+
+def test_only_top_k_race_and_losers_are_cancelled():
+    delays = {'a': 0.05, 'b': 0.1, 'c': 0.01, 'd': 0.01}
+    winner, started, cancelled = race(delays, {'a': 'A', 'b': 'B', 'c': 'C'})
+    assert winner == ('a', 'A')
+    assert started == ['a', 'b'] and cancelled == ['b']
+
+def test_hedges_after_delay_and_after_failures():
+    delays = {'a': 1.0, 'b': 1.0, 'c': 0.05, 'd': 0.05}
+    t0 = time.monotonic()
+    winner, started, cancelled = race(delays, {'c': 'C'}, hedge_delay=0.2)
+    assert winner == ('c', 'C') and 0.2 <= time.monotonic() - t0 < 0.6
+    assert started == ['a', 'b', 'c', 'd'] and sorted(cancelled) == ['a', 'b']
+
+    # Everything running failed: the next providers start without waiting for the hedge delay
+    delays = {'a': 0.01, 'b': 0.01, 'c': 0.01}
+    t0 = time.monotonic()
+    winner, started, _ = race(delays, {'c': 'C'}, hedge_delay=5.0)
+    assert winner == ('c', 'C') and time.monotonic() - t0 < 1.0
+
+def test_timeouts_count_as_failures():
+    health = ProviderHealth()
+    winner, _, _ = race({'a': 1.0}, {'a': 'A'}, timeout=0.05, health=health)
+    assert winner is None and health.stats()['a']['failures'] == 1
+
+def test_half_open_trial_waits_for_a_launch():
+    # A recovering provider ranks behind the healthy ones, past the race width
+    health = ProviderHealth()
+    for _ in range(provider_health.FAILURES_TO_OPEN):
+        health.record_failure('recovering')
+    health._providers['recovering']['open_until'] = time.time() - 1
+    delays = {'a': 0.01, 'b': 0.01, 'recovering': 0.01}
+    for _ in range(3):
+        winner, started, _ = race(delays, {'a': 'A', 'recovering': 'R'}, width=1, health=health)
+        assert winner == ('a', 'A') and 'recovering' not in started
+    assert health.stats()['recovering']['state'] == 'half-open'
+
+    # Its turn comes (the others cannot serve this URL): the trial is still there, and it closes
+    winner, started, _ = race(delays, {'recovering': 'R'}, width=1, health=health)
+    assert winner == ('recovering', 'R') and health.stats()['recovering']['state'] == 'closed'
+
+def test_slow_providers_get_their_own_timeout():
+    health = ProviderHealth()
+
+    async def attempt(name):
+        await asyncio.sleep(0.3)
+        return name.upper()
+
+    winner = asyncio.run(hedged_race(['converter'], attempt, health, 1, 0.1, 0.1, timeouts={'converter': 1.0}))
+    assert winner == ('converter', 'CONVERTER') and health.stats()['converter']['failures'] == 0
+
+def test_unservable_content_is_not_a_provider_failure():
+    # Every provider answers "cannot download this" (empty result) for one URL, several times over
+    health = ProviderHealth()
+    providers = {name: 0.01 for name in 'abcdef'}
+    for _ in range(provider_health.FAILURES_TO_OPEN + 1):
+        winner, started, _ = race(providers, {}, health=health)
+        assert winner is None and sorted(started) == sorted(providers)
+    assert health.rank(providers) == list(providers)
+    assert all(s['failures'] == 0 and s['state'] == 'closed' for s in health.stats().values())
+
+    # Broken providers (raising: unreachable, HTTP 5xx) still count
+    async def broken(name):
+        raise ConnectionError("unreachable")
+
+    asyncio.run(hedged_race(['a'], broken, health, 1, 0.1, 1.0))
+    assert health.stats()['a']['failures'] == 1
+
+    # The next good URL still finds a provider
+    winner, _, _ = race(providers, {'c': 'C'}, health=health)
+    assert winner == ('c', 'C')
+
+if __name__ == "__main__":
+    for test in (test_rank_by_latency_and_success_rate, test_circuit_opens_and_half_opens, test_rows_round_trip,
+                 test_only_top_k_race_and_losers_are_cancelled, test_hedges_after_delay_and_after_failures,
+                 test_timeouts_count_as_failures, test_half_open_trial_waits_for_a_launch,
+                 test_slow_providers_get_their_own_timeout, test_unservable_content_is_not_a_provider_failure):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
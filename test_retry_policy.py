@@ -0,0 +1,119 @@
+"""
+Retry policy engine: yt-dlp errors are classified, each class walks its recovery plan
+(cheapest first, skipping what the caller cannot do), and outcomes are counted per class
+and action.
+
+Run: python test_retry_policy.py   (or pytest test_retry_policy.py)
+"""
+import random
+import time
+
+import retry_policy
+from retry_policy import RetryPolicy
+
+class DownloadError(Exception):
+    pass
+
+class WorkerCrashed(Exception):
+    pass
+
+def test_classify_yt_dlp_messages():
+    policy = RetryPolicy()
+    cases = {
+        "ERROR: [youtube] abc: Requested format is not available. Use --list-formats": retry_policy.FORMAT,
+        "ERROR: [youtube] abc: Sign in to confirm you're not a bot. Use --cookies-from-browser": retry_policy.AUTH,
+        "ERROR: [youtube] abc: Video unavailable. The uploader has not made this video available in your country":
+            retry_policy.GEO,
+        "ERROR: [youtube] abc: Video unavailable. This video has been removed by the uploader": retry_policy.PERMANENT,
+        "ERROR: [youtube] abc: Private video. Sign in if you've been granted access": retry_policy.AUTH,
+        "ERROR: Unsupported URL: https://example.com/page": retry_policy.PERMANENT,
+        "ERROR: [youtube] abc: Unable to download webpage: HTTP Error 429: Too Many Requests": retry_policy.THROTTLED,
+        "ERROR: unable to download video data: HTTP Error 403: Forbidden": retry_policy.THROTTLED,
+        "ERROR: [youtube] abc: Unable to download webpage: <urlopen error [Errno -3] Temporary failure in name resolution>":
+            retry_policy.TRANSIENT,
+        "ERROR: unable to download video data: HTTP Error 503: Service Unavailable": retry_policy.TRANSIENT,
+        "ERROR: Postprocessing: Conversion failed!": retry_policy.UNKNOWN,
+    }
+    for message, expected in cases.items():
+        assert policy.classify(DownloadError(message)) == expected, message
+    # Worker process died without a message worth matching
+    assert policy.classify(WorkerCrashed("Download worker exited (code -9)")) == retry_policy.TRANSIENT
+
+def test_transient_backs_off_exponentially_then_falls_back():
+    session = RetryPolicy(rng=random.Random(1)).session()
+    error = DownloadError("Connection reset by peer")
+    steps = [session.next_step(error) for _ in range(4)]
+    assert [s.action for s in steps] == ['backoff'] * 3 + ['fallback']
+    base = retry_policy.BACKOFF_BASE['backoff']
+    for retry, step in enumerate(steps[:3]):
+        nominal = base * 2 ** retry
+        assert nominal * (1 - retry_policy.BACKOFF_JITTER) <= step.delay <= nominal * (1 + retry_policy.BACKOFF_JITTER)
+    assert steps[3].delay == 0.0
+
+def test_plans_skip_what_the_caller_cannot_do():
+    policy = RetryPolicy()
+    # No cookies.txt in use: auth errors go straight to the fallback chain
+    session = policy.session()
+    assert session.next_step(DownloadError("Sign in to confirm"), can=lambda action: False).action == 'fallback'
+
+    # Two rungs of generic formats, then fallback; the second rung is skipped when exhausted
+    session = policy.session()
+    error = DownloadError("Requested format is not available")
+    assert session.next_step(error).action == 'reformat'
+    assert session.next_step(error, can=lambda action: action != 'reformat').action == 'fallback'
+
+    # Permanent errors give up without the fallback chain
+    assert policy.session().next_step(DownloadError("Video unavailable")).action == 'fail'
+
+def test_recoveries_are_capped_across_classes():
+    session = RetryPolicy(max_retries=2, rng=random.Random(1)).session()
+    assert session.next_step(DownloadError("Requested format is not available")).action == 'reformat'
+    assert session.next_step(DownloadError("Connection reset")).action == 'backoff'
+    assert session.next_step(DownloadError("Connection reset")).action == 'fallback'
+
+def test_outcomes_are_counted_and_round_trip():
+    policy = RetryPolicy(rng=random.Random(1))
+    session = policy.session()
+    session.next_step(DownloadError("HTTP Error 429"))   # refresh ...
+    session.next_step(DownloadError("HTTP Error 429"))   # ... failed; fallback ...
+    assert session.settle(True)                         # ... worked
+    assert not session.settle(True)
+
+    session = policy.session()
+    session.next_step(DownloadError("Requested format is not available"))
+    session.settle(True)
+
+    stats = policy.stats()
+    assert stats['throttled']['errors'] == 2
+    assert stats['throttled']['actions']['refresh']['recovered'] == 0
+    assert stats['throttled']['actions']['fallback']['recovery_rate'] == 1.0
+    assert stats['format']['actions']['reformat']['tried'] == 1
+    assert stats['throttled']['last_error'] == "HTTP Error 429"
+
+    restored = RetryPolicy()
+    restored.load(policy.rows())
+    assert sorted(restored.rows()) == sorted(policy.rows())
+
+def test_rules_and_plans_are_pluggable():
+    policy = RetryPolicy()
+    policy.add_rule(retry_policy.TRANSIENT, r'Conversion failed')
+    policy.set_plan(retry_policy.GEO, ['fail'])
+    session = policy.session()
+    assert session.next_step(DownloadError("Postprocessing: Conversion failed!")).action == 'backoff'
+    assert session.next_step(DownloadError("not available in your country")).action == 'fail'
+
+def test_sleep_stops_early():
+    t0 = time.monotonic()
+    assert retry_policy.sleep(5.0, lambda: 'cancel' if time.monotonic() - t0 > 0.1 else None, interval=0.02) == 'cancel'
+    assert time.monotonic() - t0 < 1.0
+    assert retry_policy.sleep(0.05) is None
+
+if __name__ == "__main__":
+    for test in (test_classify_yt_dlp_messages, test_transient_backs_off_exponentially_then_falls_back,
+                 test_plans_skip_what_the_caller_cannot_do, test_recoveries_are_capped_across_classes,
+                 test_outcomes_are_counted_and_round_trip, test_rules_and_plans_are_pluggable, test_sleep_stops_early):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
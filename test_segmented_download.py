@@ -0,0 +1,126 @@
+"""
+Segmented downloads: byte ranges fetched concurrently and written at their offsets,
+resume of a segment that broke off, size verification and the single-stream fallback.
+
+Uses an in-memory stand-in for httpx.AsyncClient, so no network (or httpx) is needed.
+Run: python test_segmented_download.py   (or pytest test_segmented_download.py)
+"""
+import asyncio
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from segmented_download import IncompleteDownload, download_file, split_ranges
+
+class FakeResponse:
+    def __init__(self, status_code, headers, body, cut_after=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.cut_after = cut_after
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    async def aread(self):
+        return b''.join([chunk async for chunk in self.aiter_bytes()])
+
+    async def aiter_bytes(self):
+        for i in range(0, len(self.body), 64 * 1024):
+            if self.cut_after is not None and i >= self.cut_after:
+                raise ConnectionError("connection reset")
+            await asyncio.sleep(0)
+            yield self.body[i:i + 64 * 1024]
+
+class FakeClient:
+    """Serves `body`; with ranges=False the Range header is ignored. The first request for
+    each range start in `break_at` is cut off halfway."""
+
+    def __init__(self, body, ranges=True, break_at=(), short_by=0):
+        self.body = body
+        self.ranges = ranges
+        self.break_at = set(break_at)
+        self.short_by = short_by
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+
+    @asynccontextmanager
+    async def stream(self, method, url, headers=None):
+        byte_range = (headers or {}).get('Range')
+        self.requests.append(byte_range)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if not byte_range or not self.ranges:
+                body = self.body[:len(self.body) - self.short_by]
+                yield FakeResponse(200, {'content-length': str(len(self.body))}, body)
+                return
+            start, end = (int(x) for x in byte_range[len('bytes='):].split('-'))
+            cut = None
+            if start in self.break_at and end > start:
+                self.break_at.discard(start)
+                cut = (end - start) // 2
+            yield FakeResponse(206, {'content-range': f"bytes {start}-{end}/{len(self.body)}"},
+                               self.body[start:end + 1], cut)
+        finally:
+            self.active -= 1
+
+MB = 1024 * 1024
+BODY = os.urandom(10 * MB + 12345)
+
+def fetch(client, **kwargs):
+    path = os.path.join(tempfile.mkdtemp(prefix="segdl_"), "out.bin")
+    progress = []
+    with ThreadPoolExecutor(2) as executor:
+        size = asyncio.run(download_file(client, "https://cdn.example/v.mp4", path, executor=executor,
+                                         on_progress=lambda done, total: progress.append((done, total)),
+                                         min_segment=MB, **kwargs))
+    with open(path, 'rb') as f:
+        return size, f.read(), progress
+
+def test_ranges_are_fetched_in_parallel():
+    client = FakeClient(BODY)
+    size, data, progress = fetch(client, connections=4)
+    assert size == len(BODY) and data == BODY
+    assert len(client.requests) == 5 # Probe + 4 segments
+    assert client.max_active == 4
+    assert progress[-1] == (len(BODY), len(BODY))
+
+def test_broken_segment_resumes_where_it_stopped():
+    ranges = split_ranges(len(BODY), 4, MB)
+    client = FakeClient(BODY, break_at=[ranges[1][0]])
+    size, data, _ = fetch(client, connections=4)
+    assert data == BODY
+    resumed = [r for r in client.requests if r and r.endswith(f"-{ranges[1][1]}")]
+    assert len(resumed) == 2 and resumed[1] != resumed[0]
+
+def test_single_stream_without_range_support():
+    client = FakeClient(BODY, ranges=False)
+    size, data, progress = fetch(client, connections=4)
+    assert data == BODY and len(client.requests) == 2 # Probe + one stream
+    assert progress[-1][1] == len(BODY)
+
+def test_short_body_is_rejected():
+    client = FakeClient(BODY, ranges=False, short_by=100)
+    try:
+        fetch(client, connections=4)
+    except IncompleteDownload:
+        return
+    assert False, "truncated download was accepted"
+
+def test_split_ranges():
+    assert split_ranges(10, 3, 1) == [(0, 3), (4, 7), (8, 9)]
+    assert split_ranges(10 * MB, 8, 4 * MB) == [(0, 5 * MB - 1), (5 * MB, 10 * MB - 1)]
+    assert split_ranges(100, 4, MB) == [(0, 99)]
+
+if __name__ == "__main__":
+    for test in (test_ranges_are_fetched_in_parallel, test_broken_segment_resumes_where_it_stopped,
+                 test_single_stream_without_range_support, test_short_body_is_rejected, test_split_ranges):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
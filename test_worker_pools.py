@@ -0,0 +1,57 @@
+"""
+Interactive work keeps its latency while the other pools are saturated,
+and each pool reports its own queue metrics.
+
+Run: python test_worker_pools.py   (or pytest test_worker_pools.py)
+"""
+import time
+import asyncio
+
+from worker_pools import MeteredExecutor
+
+LONG_TASK = 0.5
+
+def test_interactive_not_queued_behind_busy_pool():
+    busy = MeteredExecutor("busy", 2)
+    interactive = MeteredExecutor("interactive", 2)
+    try:
+        for _ in range(4):
+            busy.submit(time.sleep, LONG_TASK)
+
+        async def search():
+            t0 = time.perf_counter()
+            await interactive.run(time.sleep, 0.01)
+            return time.perf_counter() - t0
+
+        latency = asyncio.run(search())
+        stats = busy.stats()
+        print(f"interactive latency {latency * 1000:.1f} ms, busy pool queued={stats['queued']}")
+        assert latency < LONG_TASK / 2
+        assert stats["active"] == 2 and stats["queued"] == 2
+    finally:
+        busy.shutdown(wait=True)
+        interactive.shutdown(wait=True)
+
+    stats = busy.stats()
+    assert stats["completed"] == 4 and stats["queued"] == 0 and stats["active"] == 0
+    # The last two tasks waited for a full long task
+    assert stats["max_wait_ms"] >= LONG_TASK * 1000 * 0.8
+    assert interactive.stats()["completed"] == 1
+
+def test_failures_counted():
+    pool = MeteredExecutor("fail", 1)
+    future = pool.submit(lambda: 1 / 0)
+    try:
+        future.result()
+    except ZeroDivisionError:
+        pass
+    pool.shutdown(wait=True)
+    assert pool.stats()["failed"] == 1
+
+if __name__ == "__main__":
+    for test in (test_interactive_not_queued_behind_busy_pool, test_failures_counted):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
@@ -0,0 +1,104 @@
+"""
+YoutubeDL pooling: instances are reused, never shared between threads, dropped after
+an error or a reset, and do not write cookies.txt back. Versioned cache directories.
+
+Uses a stand-in for yt_dlp.YoutubeDL, so yt-dlp is not needed.
+Run: python test_ydl_pool.py   (or pytest test_ydl_pool.py)
+"""
+import os
+import tempfile
+import threading
+
+from ydl_pool import YoutubeDLPool, prepare_cache_dir
+
+class FakeYDL:
+    def __init__(self, params):
+        self.params = dict(params)
+        self.cookies_loaded = False
+        self.closed = False
+        self.in_use = threading.Lock()
+
+    @property
+    def cookiejar(self):
+        self.cookies_loaded = True
+        return object()
+
+    def close(self):
+        self.closed = True
+
+def make_pool(max_idle=2):
+    return YoutubeDLPool('test', lambda: {'quiet': True, 'cookiefile': 'cookies.txt'}, FakeYDL, max_idle)
+
+def test_instances_are_reused_without_saving_cookies():
+    pool = make_pool()
+    with pool.acquire() as first:
+        pass
+    with pool.acquire() as second:
+        pass
+    assert first is second
+    assert first.cookies_loaded and first.params['cookiefile'] is None
+    assert pool.stats()['created'] == 1 and pool.stats()['reused'] == 1
+
+def test_concurrent_users_get_distinct_instances():
+    pool = make_pool(max_idle=4)
+    errors = []
+    barrier = threading.Barrier(6)
+
+    def use():
+        with pool.acquire() as ydl:
+            if not ydl.in_use.acquire(blocking=False):
+                errors.append("instance shared between threads")
+                return
+            barrier.wait(2)
+            ydl.in_use.release()
+
+    threads = [threading.Thread(target=use) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    stats = pool.stats()
+    assert stats['created'] == 6 and stats['idle'] == 4 and stats['discarded'] == 2
+
+def test_errors_and_reset_discard_instances():
+    pool = make_pool()
+    try:
+        with pool.acquire() as broken:
+            raise RuntimeError("download failed halfway")
+    except RuntimeError:
+        pass
+    assert broken.closed
+    with pool.acquire() as before_reset:
+        pool.reset() # e.g. new cookies.txt while the instance is lent out
+    assert before_reset.closed
+    with pool.acquire() as after_reset:
+        pass
+    assert after_reset is not before_reset and not after_reset.closed
+
+def test_warm_up_prepares_idle_instances():
+    pool = make_pool()
+    prepared = []
+    pool.warm_up(prepare=prepared.append)
+    assert len(prepared) == 2 and pool.stats()['idle'] == 2
+    with pool.acquire() as ydl:
+        assert ydl in prepared
+
+def test_cache_dir_per_version():
+    base = tempfile.mkdtemp(prefix="ydlcache_")
+    old = prepare_cache_dir(base, "2024.01.01")
+    with open(os.path.join(old, "player.json"), "w") as f:
+        f.write("{}")
+    new = prepare_cache_dir(base, "2025.02.02")
+    assert os.path.isdir(new) and not os.path.exists(old)
+    assert prepare_cache_dir(base, "2025.02.02") == new
+
+if __name__ == "__main__":
+    for test in (test_instances_are_reused_without_saving_cookies, test_concurrent_users_get_distinct_instances,
+                 test_errors_and_reset_discard_instances, test_warm_up_prepares_idle_instances,
+                 test_cache_dir_per_version):
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            print(f"FAIL {test.__name__}: {e}")
@@ -0,0 +1,76 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+class MeteredExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor that keeps queue metrics: tasks waiting / running, and the
+    average time spent waiting for a thread vs running (both in ms).
+    Each kind of work gets its own pool so a slow kind cannot queue up another.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self.size = max_workers
+        self._stats_lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._started = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        self._wait_max = 0.0
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted = time.perf_counter()
+        with self._stats_lock:
+            self._queued += 1
+
+        def task():
+            started = time.perf_counter()
+            with self._stats_lock:
+                self._queued -= 1
+                self._active += 1
+                self._started += 1
+                waited = started - submitted
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._stats_lock:
+                    self._active -= 1
+                    self._completed += 1
+                    if not ok:
+                        self._failed += 1
+                    self._run_total += time.perf_counter() - started
+
+        return super().submit(task)
+
+    async def run(self, fn, *args, **kwargs):
+        """Await a blocking call on this pool from a coroutine"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self, functools.partial(fn, *args, **kwargs))
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            started = self._started or 1
+            done = self._completed or 1
+            return {
+                "workers": self.size,
+                "queued": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_ms": round(self._wait_total / started * 1000, 1),
+                "max_wait_ms": round(self._wait_max * 1000, 1),
+                "avg_run_ms": round(self._run_total / done * 1000, 1)
+            }
@@ -0,0 +1,130 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+def prepare_cache_dir(base_dir: str, version: str) -> str:
+    """
+    Managed yt-dlp cache directory (player JS, signature / nsig solutions), one subdirectory
+    per yt-dlp version so an upgrade never reads stale player code. Directories of other
+    versions are removed. yt-dlp writes cache files through a temp file + rename, so API
+    threads and download worker processes can share the directory.
+    """
+    cache_dir = os.path.join(base_dir, version)
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        for name in os.listdir(base_dir):
+            path = os.path.join(base_dir, name)
+            if name != version and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+    except OSError as e:
+        logging.warning(f"yt-dlp cache cleanup failed: {e}")
+    return cache_dir
+
+class YoutubeDLPool:
+    """
+    Reusable YoutubeDL instances for one fixed option template.
+
+    Building a YoutubeDL parses cookies.txt and sets up network handlers, and extractor
+    instances (with their in-memory player caches) live on it. acquire() lends an idle
+    instance to one thread at a time and takes it back afterwards; at most `max_idle`
+    are kept. reset() (e.g. after new cookies) makes every instance built before it be
+    dropped instead of reused.
+
+    Pooled instances never write cookies.txt back (download jobs still do), so idle
+    instances cannot overwrite a freshly uploaded file.
+    """
+
+    def __init__(self, name: str, opts_factory: Callable[[], Dict], factory: Callable[[Dict], object], max_idle: int = 4):
+        self.name = name
+        self.opts_factory = opts_factory
+        self.factory = factory
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle: List[tuple] = [] # (generation, ydl)
+        self._generation = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.build_ms = 0.0
+
+    def _build(self):
+        start = time.perf_counter()
+        opts = self.opts_factory()
+        ydl = self.factory(opts)
+        if opts.get('cookiefile'):
+            ydl.cookiejar # Loaded lazily: load it now, then stop yt-dlp from saving it on close
+            ydl.params['cookiefile'] = None
+        self.build_ms += (time.perf_counter() - start) * 1000
+        self.created += 1
+        return ydl
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            generation = self._generation
+            entry = self._idle.pop() if self._idle else None
+        if entry is not None:
+            self.reused += 1
+            ydl = entry[1]
+        else:
+            ydl = self._build()
+        ok = False
+        try:
+            yield ydl
+            ok = True
+        finally:
+            self._release(generation, ydl, keep=ok)
+
+    def _release(self, generation: int, ydl, keep: bool):
+        # An exception may leave the instance mid-way through a download: do not reuse it
+        with self._lock:
+            if keep and generation == self._generation and len(self._idle) < self.max_idle:
+                self._idle.append((generation, ydl))
+                return
+            self.discarded += 1
+        self._close(ydl)
+
+    def warm_up(self, count: Optional[int] = None, prepare: Optional[Callable] = None):
+        """Build instances ahead of the first request. `prepare(ydl)` can preload extractors."""
+        count = self.max_idle if count is None else count
+        built = []
+        for _ in range(count):
+            ydl = self._build()
+            if prepare:
+                prepare(ydl)
+            built.append(ydl)
+        with self._lock:
+            generation = self._generation
+            for ydl in built:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append((generation, ydl))
+
+    def reset(self):
+        with self._lock:
+            self._generation += 1
+            idle, self._idle = self._idle, []
+            self.discarded += len(idle)
+        for _, ydl in idle:
+            self._close(ydl)
+
+    @staticmethod
+    def _close(ydl):
+        try:
+            ydl.close()
+        except Exception as e:
+            logging.debug(f"Closing pooled YoutubeDL failed: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'max_idle': self.max_idle,
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'avg_build_ms': round(self.build_ms / self.created, 1) if self.created else None
+            }